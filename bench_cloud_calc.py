@@ -0,0 +1,868 @@
+"""
+Cloud Calc - Benchmark
+======================
+Micro-benchmark delle parti "calde" dei server Cloud Calc.
+Non richiede il server avviato: importa direttamente i moduli.
+
+Avvio:
+    python bench_cloud_calc.py              # tutti i benchmark
+    python bench_cloud_calc.py model_load   # solo quelli indicati
+
+Benchmark disponibili:
+    model_load  - costruzione modello /eval_sheet: file .xlsx vs in memoria
+    translate   - traduzione formule IT -> EN: versione originale vs regex unica
+    shapes      - /eval_sheet: tutte le formule nel modello vs forme R1C1 compilate una volta
+    results     - griglia dei risultati: regex + conversione per cella vs indice + blocco
+    pool        - richieste /eval_sheet concorrenti: thread della request vs pool di processi
+    split       - un foglio con N blocchi indipendenti: un modello vs blocchi su piu' worker
+    codec       - risposta /eval_sheet: json standard vs orjson vs colonne typed, con gzip
+    batch_wait  - N celle /batch_calc in attesa: un thread per cella vs future su un event loop
+    batch_graph - batch /batch_calc da 100k celle (catena e DAG largo): ordinamento e calcolo
+    calc_columns - /calc: una request per cella vs una request colonnare
+    ifs         - SUMIFS/COUNTIFS/... su 1M righe: match_criteria per riga vs criteri compilati
+    ranges      - 50 SUMIFS sulla stessa tabella da 50k righe: range inline vs registrati
+    lookups     - VLOOKUP di 5000 chiavi su 100k righe: scansione lineare vs indice
+    calc_bulk   - 5000 calcoli + 50 SUMIFS: una request per calcolo vs /calc/bulk
+    parse       - conversione dei valori: parse_value per valore vs parse_values per colonna
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import openpyxl
+import formulas as formulas_lib
+import numpy as np
+
+import cloud_calc_api as calc_api
+import cloud_calc_batch_api as batch_api
+import cloud_calc_dependencies_api as deps_api
+import cloud_calc_values as calc_values
+
+
+# ---------------------------------------------------------------------------
+# Fogli di test
+# ---------------------------------------------------------------------------
+
+def make_sheet(num_rows, num_input_cols=3):
+    """Genera un foglio tipo: colonne di input + formule copiate in basso.
+
+    Ritorna (formulas_grid, values_grid) nello stesso formato inviato
+    da evaluateSheet() in google_apps_script_batch.js.
+    """
+    formulas_grid = []
+    values_grid = []
+    for r in range(num_rows):
+        row_n = r + 1
+        values_row = [r + 1, (r % 7) * 1.5, 'voce%d' % (r % 5)][:num_input_cols]
+        values_row += [None] * 3
+        formulas_row = [''] * num_input_cols + [
+            '=A%d*B%d' % (row_n, row_n),
+            '=SE(D%d>10;D%d;0)' % (row_n, row_n),
+            '=SOMMA(A%d:B%d)+E%d' % (row_n, row_n, row_n),
+        ]
+        formulas_grid.append(formulas_row)
+        values_grid.append(values_row)
+    return formulas_grid, values_grid
+
+
+def make_blocks_sheet(num_blocks, num_rows):
+    """Foglio con `num_blocks` blocchi di calcolo indipendenti affiancati.
+
+    Ogni blocco ha 2 colonne di input, una formula per riga e un totale
+    progressivo (legato alla riga sopra): un blocco e' una sola componente.
+    """
+    formulas_grid = []
+    values_grid = []
+    for r in range(num_rows):
+        row_n = r + 1
+        formulas_row = []
+        values_row = []
+        for k in range(num_blocks):
+            a, b, c, d = (openpyxl.utils.get_column_letter(4 * k + i) for i in range(1, 5))
+            previous = f'{d}{row_n - 1}' if r else '0'
+            formulas_row += ['', '', f'=SE({a}{row_n}>3;{a}{row_n}*{b}{row_n};0)',
+                             f'={previous}+{c}{row_n}']
+            values_row += [r + k, (r % 5) * 0.5, None, None]
+        formulas_grid.append(formulas_row)
+        values_grid.append(values_row)
+    return formulas_grid, values_grid
+
+
+def timed(fn, *args, repeat=3):
+    """Esegue fn(*args) `repeat` volte; ritorna (miglior tempo in ms, risultato)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        elapsed = (time.perf_counter() - t0) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# ---------------------------------------------------------------------------
+# model_load: xlsx temporaneo vs modello in memoria
+# ---------------------------------------------------------------------------
+
+def _load_model_xlsx(formulas_grid, values_grid, num_rows, num_cols):
+    """Percorso originale: openpyxl -> file .xlsx temporaneo -> ExcelModel.loads."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = batch_api.MODEL_SHEET
+    for r in range(num_rows):
+        for c in range(num_cols):
+            cell = ws.cell(row=r + 1, column=c + 1)
+            formula = ''
+            if r < len(formulas_grid) and c < len(formulas_grid[r]):
+                formula = formulas_grid[r][c]
+            if formula:
+                cell.value = batch_api.translate_formula_it_to_en(formula)
+            else:
+                val = values_grid[r][c] if c < len(values_grid[r]) else None
+                cell.value = batch_api.parse_value(val)
+
+    tmp_fd, tmp_path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(tmp_fd)
+    try:
+        wb.save(tmp_path)
+        return formulas_lib.ExcelModel().loads(tmp_path).finish()
+    finally:
+        os.unlink(tmp_path)
+
+
+def _load_model_memory(formulas_grid, values_grid, num_rows, num_cols):
+    formula_cells, value_cells, _ = batch_api.collect_cells(
+        formulas_grid, values_grid, num_rows, num_cols)
+    return batch_api.build_excel_model(formula_cells, value_cells)
+
+
+def _cell_values(solution):
+    """Valori delle singole celle della solution, indicizzati per coordinata."""
+    out = {}
+    for key, val in solution.items():
+        key = str(key)
+        if '!' in key and ':' not in key:
+            out[key.rsplit('!', 1)[1]] = batch_api.convert_formulas_value(val)
+    return out
+
+
+def bench_model_load():
+    print('model_load: costruzione + calcolo del modello /eval_sheet')
+    for num_rows in (200, 1000, 2000):
+        formulas_grid, values_grid = make_sheet(num_rows)
+        num_cols = len(values_grid[0])
+        args = (formulas_grid, values_grid, num_rows, num_cols)
+
+        t_xlsx, model_xlsx = timed(_load_model_xlsx, *args, repeat=1)
+        t_mem, model_mem = timed(_load_model_memory, *args, repeat=1)
+
+        same = _cell_values(model_xlsx.calculate()) == _cell_values(model_mem.calculate())
+        print(f'  {num_rows * num_cols:>6} celle | xlsx {t_xlsx:8.0f} ms | '
+              f'memoria {t_mem:8.0f} ms | x{t_xlsx / t_mem:5.1f} | '
+              f'risultati identici: {same}')
+
+
+# ---------------------------------------------------------------------------
+# translate: traduttore originale (una regex per funzione) vs regex unica
+# ---------------------------------------------------------------------------
+
+def _translate_legacy(formula):
+    """Traduttore originale: ordina e compila ~70 regex a ogni chiamata."""
+    if not formula or not formula.startswith('='):
+        return formula
+    result = formula
+    sorted_funcs = sorted(batch_api.IT_TO_EN_FUNCTIONS.keys(), key=len, reverse=True)
+    for it_name in sorted_funcs:
+        en_name = batch_api.IT_TO_EN_FUNCTIONS[it_name]
+        pattern = re.compile(re.escape(it_name) + r'\s*\(', re.IGNORECASE)
+        result = pattern.sub(en_name + '(', result)
+    translated = []
+    in_string = False
+    for ch in result:
+        if in_string:
+            translated.append(ch)
+            if ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            translated.append(ch)
+        else:
+            translated.append(',' if ch == ';' else ch)
+    return ''.join(translated)
+
+
+def bench_translate():
+    print('translate: traduzione di 10.000 formule IT -> EN')
+    templates = [
+        '=SOMMA(A{n}:C{n})',
+        '=SE(B{n}>10;"alto;x";ARROTONDA(B{n}/3;2))',
+        '=CERCA.VERT(A{n};Foglio2!A:C;3;FALSO)',
+        '=SOMMA.PIU.SE(C1:C100;A1:A100;">"&A{n})',
+        '=SE.ERRORE(A{n}/B{n};0)',
+    ]
+    formulas = [templates[i % len(templates)].format(n=i // len(templates) + 1)
+                for i in range(10_000)]
+
+    def run_legacy():
+        return [_translate_legacy(f) for f in formulas]
+
+    def run_new():
+        batch_api.translate_formula_it_to_en.cache_clear()
+        return [batch_api.translate_formula_it_to_en(f) for f in formulas]
+
+    def run_memo():
+        # Formule relative ripetute: stesso testo -> risposta dalla cache LRU
+        return [batch_api.translate_formula_it_to_en(f) for f in formulas]
+
+    t_legacy, out_legacy = timed(run_legacy)
+    t_new, out_new = timed(run_new)
+    t_memo, _ = timed(run_memo)
+    print(f'  originale {t_legacy:8.1f} ms | regex unica {t_new:8.1f} ms | '
+          f'x{t_legacy / t_new:5.1f} | con cache {t_memo:6.1f} ms | '
+          f'output identici: {out_legacy == out_new}')
+
+
+# ---------------------------------------------------------------------------
+# shapes: una formula del modello per cella vs forme R1C1 compilate una volta
+# ---------------------------------------------------------------------------
+
+def _eval_shapes(formulas_grid, values_grid, num_rows, num_cols):
+    """Stesso percorso di eval_sheet() su cache miss: piano delle forme + modello."""
+    formula_cells, value_cells, positions = batch_api.collect_cells(
+        formulas_grid, values_grid, num_rows, num_cols)
+    plan = batch_api.build_shape_plan(formula_cells, value_cells, positions, num_rows, num_cols)
+    shape_values = batch_api.run_shape_plan(plan, batch_api.shape_grid(plan, value_cells))
+    model_cells = dict(value_cells)
+    model_cells.update((ref, batch_api.shape_literal(v)) for ref, v in shape_values.items())
+    model = batch_api.build_excel_model(
+        {ref: f for ref, f in formula_cells.items() if ref not in shape_values}, model_cells)
+    return model.calculate(), plan
+
+
+def bench_shapes():
+    print('shapes: valutazione /eval_sheet (cache miss), formule copiate in basso')
+    for num_rows in (200, 1000, 2000):
+        formulas_grid, values_grid = make_sheet(num_rows)
+        num_cols = len(values_grid[0])
+        args = (formulas_grid, values_grid, num_rows, num_cols)
+
+        batch_api.translate_formula_it_to_en.cache_clear()
+        t_model, model = timed(_load_model_memory, *args, repeat=1)
+        t0 = time.perf_counter()
+        solution_model = model.calculate()
+        t_model += (time.perf_counter() - t0) * 1000
+        batch_api.translate_formula_it_to_en.cache_clear()
+        t_shapes, (solution_shapes, plan) = timed(_eval_shapes, *args, repeat=1)
+
+        same = _cell_values(solution_model) == _cell_values(solution_shapes)
+        print(f'  {num_rows * num_cols:>6} celle | modello {t_model:8.0f} ms | '
+              f'forme {t_shapes:8.0f} ms | x{t_model / t_shapes:5.1f} | '
+              f'{plan["formula_shapes"]} forme, {plan["vectorized_cells"]} celle vettoriali | '
+              f'risultati identici: {same}')
+
+
+# ---------------------------------------------------------------------------
+# results: costruzione della griglia dei risultati di /eval_sheet
+# ---------------------------------------------------------------------------
+
+def _convert_legacy(val):
+    """convert_formulas_value originale: catena di isinstance per ogni valore."""
+    if val is None:
+        return ''
+    if hasattr(val, 'value'):
+        val = val.value
+    if isinstance(val, np.ndarray):
+        val = val.item() if val.size == 1 else val.tolist()
+    if isinstance(val, np.integer):
+        return int(val)
+    if isinstance(val, np.floating):
+        f = float(val)
+        return int(f) if f == int(f) else f
+    if isinstance(val, np.bool_):
+        return bool(val)
+    if isinstance(val, np.str_):
+        return str(val)
+    if isinstance(val, (bool, int, float, str)):
+        return val
+    return str(val)
+
+
+def _results_legacy(solution, values_grid, num_rows, num_cols):
+    """Percorso originale: regex su ogni chiave, A1 e conversione per cella."""
+    cell_pattern = re.compile(r"!([A-Z]+\d+)$", re.IGNORECASE)
+    sheet_pattern = re.compile(r"\](.+?)'!", re.IGNORECASE)
+    solution_map = {}
+    for key, val in solution.items():
+        cell_match = cell_pattern.search(str(key))
+        sheet_match = sheet_pattern.search(str(key))
+        if cell_match:
+            sheet_name = sheet_match.group(1).upper() if sheet_match else 'MODEL'
+            solution_map[f"{sheet_name}!{cell_match.group(1).upper()}"] = val
+    results = []
+    for r in range(num_rows):
+        row = []
+        for c in range(num_cols):
+            lookup_key = f"MODEL!{openpyxl.utils.get_column_letter(c + 1)}{r + 1}"
+            if lookup_key in solution_map:
+                row.append(_convert_legacy(solution_map[lookup_key]))
+            else:
+                val = values_grid[r][c] if c < len(values_grid[r]) else None
+                row.append(batch_api.parse_value(val) if val is not None else '')
+        results.append(row)
+    return results
+
+
+def bench_results():
+    print('results: griglia dei risultati di /eval_sheet da una solution calcolata')
+    for num_rows in (2000, 10000):
+        formulas_grid, values_grid = make_sheet(num_rows)
+        num_cols = len(values_grid[0])
+        formula_cells, value_cells, positions = batch_api.collect_cells(
+            formulas_grid, values_grid, num_rows, num_cols)
+        solution, _ = _eval_shapes(formulas_grid, values_grid, num_rows, num_cols)
+        index = batch_api.cell_index(positions)
+
+        t_legacy, out_legacy = timed(
+            _results_legacy, solution, values_grid, num_rows, num_cols)
+        t_new, out_new = timed(
+            batch_api.dense_results, solution, value_cells, index,
+            values_grid, num_rows, num_cols)
+        print(f'  {num_rows * num_cols:>6} celle | originale {t_legacy:8.1f} ms | '
+              f'blocco {t_new:8.1f} ms | x{t_legacy / t_new:5.1f} | '
+              f'risultati identici: {out_legacy == out_new}')
+
+
+# ---------------------------------------------------------------------------
+# pool: piu' utenti che premono "Calcola tutto" insieme
+# ---------------------------------------------------------------------------
+
+def _run_concurrent(pool, payloads):
+    """Invia tutti i payload insieme (un thread per utente); ritorna gli status."""
+    statuses = [None] * len(payloads)
+
+    def user(i):
+        worker = pool.worker_for(batch_api.sheet_route_key(payloads[i]))
+        _, statuses[i] = pool.run(batch_api.evaluate_sheet, payloads[i], worker)
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(len(payloads))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return statuses
+
+
+def bench_pool():
+    workers = os.cpu_count() or 1
+    num_users = 2 * workers
+    print(f'pool: {num_users} fogli diversi valutati insieme, {workers} core')
+    # Fogli diversi: nessun modello in comune tra gli utenti
+    payloads = []
+    for i in range(num_users):
+        formulas_grid, values_grid = make_sheet(300 + i)
+        payloads.append({'formulas': formulas_grid, 'values': values_grid})
+
+    batch_api._warm_worker()   # anche il processo principale parte gia' pronto
+    timings = {}
+    for label, num_workers in (('thread', 0), ('processi', workers)):
+        batch_api.model_cache = batch_api.ModelCache()
+        pool = batch_api.EvalPool(workers=num_workers, max_pending=num_users)
+        if num_workers:
+            pool.start()
+        try:
+            timings[label], statuses = timed(_run_concurrent, pool, payloads, repeat=1)
+        finally:
+            pool.close()
+        print(f'  {label:>8}: {timings[label]:8.0f} ms | '
+              f'{num_users * 1000 / timings[label]:6.2f} fogli/s | status {sorted(set(statuses))}')
+    print(f'  x{timings["thread"] / timings["processi"]:5.1f} con {workers} worker')
+
+
+# ---------------------------------------------------------------------------
+# split: blocchi indipendenti dello stesso foglio su piu' worker
+# ---------------------------------------------------------------------------
+
+def bench_split():
+    workers = max(os.cpu_count() or 1, 2)
+    num_blocks = 2 * workers
+    print(f'split: un foglio con {num_blocks} blocchi indipendenti, {workers} worker '
+          f'({os.cpu_count()} core)')
+    batch_api._warm_worker()
+    for num_rows in (500, 2000):
+        formulas_grid, values_grid = make_blocks_sheet(num_blocks, num_rows)
+        data = {'formulas': formulas_grid, 'values': values_grid}
+
+        batch_api.model_cache = batch_api.ModelCache()
+        t_single, (single, _) = timed(batch_api.evaluate_sheet, data, repeat=1)
+
+        batch_api.eval_pool = batch_api.EvalPool(workers=workers, max_pending=2 * workers)
+        batch_api.split_cache = batch_api.ModelCache()
+        batch_api.eval_pool.start()
+        try:
+            t_split, (split, _) = timed(batch_api.evaluate_sheet_split, data, repeat=1)
+        finally:
+            batch_api.eval_pool.close()
+
+        print(f'  {num_rows * num_blocks * 4:>6} celle | un modello {t_single:8.0f} ms | '
+              f'blocchi {t_split:8.0f} ms | x{t_single / t_split:5.1f} | '
+              f'{split["stats"]["split"]["components"]} componenti | '
+              f'risultati identici: {single["results"] == split["results"]}')
+
+
+# ---------------------------------------------------------------------------
+# codec: serializzazione e compressione della risposta
+# ---------------------------------------------------------------------------
+
+def _json_flask(obj):
+    """Serializzazione di jsonify con il provider JSON predefinito di Flask."""
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _codec_row(label, encode, decode, obj):
+    t_enc, body = timed(encode, obj)
+    t_dec, _ = timed(decode, body)
+    t_gz, packed = timed(gzip.compress, body, batch_api.COMPRESS_LEVEL, repeat=1)
+    print(f'    {label:<16} | encode {t_enc:7.1f} ms | decode {t_dec:7.1f} ms | '
+          f'{len(body) / 1024:8.0f} KB | gzip {len(packed) / 1024:7.0f} KB in {t_gz:6.1f} ms')
+
+
+def bench_codec():
+    backends = ['json'] + (['orjson'] if batch_api.orjson is not None else [])
+    print(f'codec: risposta /eval_sheet densa (backend disponibili: {", ".join(backends)})')
+    for num_rows in (2000, 17000):
+        formulas_grid, values_grid = make_sheet(num_rows)
+        num_cols = len(values_grid[0])
+        _, value_cells, positions = batch_api.collect_cells(
+            formulas_grid, values_grid, num_rows, num_cols)
+        solution, _ = _eval_shapes(formulas_grid, values_grid, num_rows, num_cols)
+        results = batch_api.dense_results(solution, value_cells, batch_api.cell_index(positions),
+                                          values_grid, num_rows, num_cols)
+        t_typed, typed = timed(batch_api.encode_typed_results, results, False)
+        print(f'  {num_rows * num_cols:>6} celle (codifica typed {t_typed:.1f} ms)')
+        _codec_row('flask json', _json_flask, json.loads, {'results': results})
+        saved = batch_api.JSON_BACKEND
+        try:
+            for backend in backends:
+                batch_api.JSON_BACKEND = backend
+                _codec_row(f'{backend}', batch_api.json_dumps, batch_api.json_loads,
+                           {'results': results})
+                _codec_row(f'{backend} + typed', batch_api.json_dumps, batch_api.json_loads,
+                           {'results': typed})
+        finally:
+            batch_api.JSON_BACKEND = saved
+
+
+# ---------------------------------------------------------------------------
+# batch_wait: celle /batch_calc in attesa della finestra del batch
+# ---------------------------------------------------------------------------
+
+def _rss_mb():
+    """Memoria residente del processo in MB (Linux; 0 altrove)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return 0.0
+
+
+def _batch_cells(num_cells):
+    return [(f'A{i + 1}', 'plus', [{'ref': f'B{i + 1}', 'value': i}, {'ref': '', 'value': 1}])
+            for i in range(num_cells)]
+
+
+def _wait_threads(manager, cells):
+    """Una cella per thread, come le request Flask sotto WSGI."""
+    results = [None] * len(cells)
+
+    def request_thread(i):
+        results[i] = manager.submit(*cells[i])
+
+    threads = [threading.Thread(target=request_thread, args=(i,)) for i in range(len(cells))]
+    for t in threads:
+        t.start()
+    peak = (threading.active_count(), _rss_mb())
+    for t in threads:
+        t.join()
+    return results, peak
+
+
+def _wait_async(manager, cells):
+    """Una cella per coroutine sullo stesso event loop, come asgi_app."""
+    peak = []
+
+    async def run():
+        tasks = [asyncio.ensure_future(manager.submit_async(*cell)) for cell in cells]
+        await asyncio.sleep(0)       # tutte le celle registrate nel batch
+        peak.append((threading.active_count(), _rss_mb()))
+        return await asyncio.gather(*tasks)
+
+    return asyncio.run(run()), peak[0]
+
+
+def bench_batch_wait():
+    window_s = 0.5
+    print(f'batch_wait: celle /batch_calc in attesa di un batch (finestra {window_s}s)')
+    for label, wait, sizes in (('thread', _wait_threads, (1000, 2000)),
+                               ('asyncio', _wait_async, (1000, 2000, 20000))):
+        for num_cells in sizes:
+            manager = deps_api.BatchManager(window_s=window_s)
+            cells = _batch_cells(num_cells)
+            rss_before = _rss_mb()
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, (results, (threads, rss_peak)) = timed(wait, manager, cells, repeat=1)
+            manager.close()
+            solved = sum(1 for r in results if 'result' in r)
+            print(f'  {label:>8} {num_cells:>6} celle | {elapsed:7.0f} ms | '
+                  f'{threads:>6} thread attivi | +{rss_peak - rss_before:6.1f} MB | '
+                  f'risolte {solved}/{num_cells}')
+
+
+# ---------------------------------------------------------------------------
+# batch_graph: ordinamento topologico e calcolo di batch grandi
+# ---------------------------------------------------------------------------
+
+def _topological_sort_legacy(deps):
+    """Ordinamento originale di BatchManager (Kahn con queue.pop(0))."""
+    in_degree = {n: 0 for n in deps}
+    for node, node_deps in deps.items():
+        for d in node_deps:
+            if d not in in_degree:
+                in_degree[d] = 0
+    adj = {n: [] for n in in_degree}
+    for node, node_deps in deps.items():
+        in_degree[node] = len(node_deps)
+        for d in node_deps:
+            adj.setdefault(d, []).append(node)
+    queue = [n for n, deg in in_degree.items() if deg == 0]
+    order = []
+    while queue:
+        node = queue.pop(0)
+        order.append(node)
+        for neighbor in adj.get(node, []):
+            in_degree[neighbor] -= 1
+            if in_degree[neighbor] == 0:
+                queue.append(neighbor)
+    return order if len(order) == len(in_degree) else None
+
+
+def _graph_cells(kind, num_cells):
+    """Celle CLOUD_CALC_BATCH (cell, operation, args) di un batch di prova.
+
+    - chain: ogni cella legge la precedente (un livello per cella)
+    - wide:  10 livelli; ogni cella legge due celle del livello sopra
+    - flat:  celle indipendenti (un solo livello)
+    """
+    if kind == 'flat':
+        return [(f'A{i + 1}', 'plus', [{'ref': f'B{i + 1}', 'value': i}, {'ref': '', 'value': 1}])
+                for i in range(num_cells)]
+    if kind == 'chain':
+        return [(f'A{i + 1}', 'plus', [{'ref': f'A{i}' if i else 'B1', 'value': 1},
+                                       {'ref': '', 'value': 1}])
+                for i in range(num_cells)]
+    width = num_cells // 10
+    cells = []
+    for level in range(10):
+        col = openpyxl.utils.get_column_letter(level + 1)
+        above = openpyxl.utils.get_column_letter(level) if level else ''
+        for r in range(1, width + 1):
+            if level == 0:
+                args = [{'ref': f'Z{r}', 'value': r}, {'ref': '', 'value': 2}]
+            else:
+                args = [{'ref': f'{above}{r}', 'value': 0},
+                        {'ref': f'{above}{r % width + 1}', 'value': 0}]
+            cells.append((f'{col}{r}', 'multiply' if level % 2 else 'plus', args))
+    return cells
+
+
+def bench_batch_graph():
+    print('batch_graph: batch /batch_calc da 100k celle')
+    for kind in ('chain', 'wide', 'flat'):
+        cells = _graph_cells(kind, 100_000)
+        names = {cell for cell, _, _ in cells}
+        deps = {cell: [a['ref'] for a in args if a['ref'] in names] for cell, _, args in cells}
+
+        t_legacy, order = timed(_topological_sort_legacy, deps, repeat=1)
+        t_levels, levels = timed(deps_api.BatchManager._topological_levels, deps, repeat=1)
+
+        # Batch completo: grafo, ordinamento, calcolo per livelli, cache
+        manager = deps_api.BatchManager(window_s=3600, max_age_s=3600, max_cells=len(cells) + 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for cell, operation, args in cells:
+                manager._enqueue('bench', cell, operation, args, lambda result: None)
+            t_resolve, _ = timed(manager._resolve_batch, 'bench', repeat=1)
+        manager.close()
+        errors = sum(1 for node in manager._sheets['bench']['graph'].values() if not node['computed'])
+        print(f'  {kind:>5} {len(cells):>6} celle | sort originale {t_legacy:8.0f} ms | '
+              f'livelli {t_levels:6.0f} ms ({len(levels)} livelli) | '
+              f'batch completo {t_resolve:6.0f} ms | errori {errors} | '
+              f'stesso numero di celle: {len(order) == sum(map(len, levels))}')
+
+
+# ---------------------------------------------------------------------------
+# calc_columns: /calc una cella per request vs colonne in una request
+# ---------------------------------------------------------------------------
+
+def _calc_per_cell(client, operation, columns):
+    return [client.post('/calc', json={'operation': operation, 'args': list(row)}).get_json()['result']
+            for row in zip(*columns)]
+
+
+def _calc_columnar(client, operation, columns):
+    return client.post('/calc', json={'operation': operation, 'columns': columns}).get_json()['result']
+
+
+def bench_calc_columns():
+    print('calc_columns: "multiply" su due colonne (client di test Flask, senza rete)')
+    client = calc_api.app.test_client()
+    for num_rows in (5_000, 100_000):
+        columns = [[r + 1 for r in range(num_rows)], [(r % 7) * 1.5 for r in range(num_rows)]]
+        with contextlib.redirect_stdout(io.StringIO()):
+            if num_rows <= 5_000:
+                t_cells, per_cell = timed(_calc_per_cell, client, 'multiply', columns, repeat=1)
+            t_cols, columnar = timed(_calc_columnar, client, 'multiply', columns)
+        t_rows, by_row = timed(lambda: [calc_api.OPERATIONS['multiply'](*row) for row in zip(*columns)])
+        t_numpy, _ = timed(calc_api.calc_columns, 'multiply', columns)
+        line = f'  {num_rows:>7} righe | '
+        if num_rows <= 5_000:
+            line += f'{num_rows} request {t_cells:8.0f} ms (uguali: {per_cell == columnar}) | '
+        print(line + f'1 request colonnare {t_cols:6.0f} ms | '
+              f'calcolo per riga {t_rows:5.1f} ms vs NumPy {t_numpy:5.1f} ms '
+              f'(uguali: {by_row == columnar})')
+
+
+# ---------------------------------------------------------------------------
+# ifs: SUMIFS & co. con match_criteria per riga vs criteri compilati
+# ---------------------------------------------------------------------------
+
+def _sumifs_legacy(sum_range, criteria_pairs):
+    """calc_sumifs() originale: match_criteria() per riga e per criterio."""
+    total = 0
+    for i in range(len(sum_range)):
+        match = True
+        for pair in criteria_pairs:
+            crit_range = pair['range']
+            if i >= len(crit_range) or not calc_api.match_criteria(crit_range[i], pair['criteria']):
+                match = False
+                break
+        if match:
+            val = sum_range[i]
+            if val is not None:
+                try:
+                    total += float(val)
+                except (ValueError, TypeError):
+                    pass
+    return total
+
+
+def bench_ifs():
+    num_rows = 1_000_000
+    print(f'ifs: {num_rows} righe, 2 criteri')
+    kinds = ['H Rilevate', 'H Rif', 'Altro']
+    gases = ['metano', 'Metano', 'gpl', 'azoto', None]
+    sum_range = [(r % 97) * 0.5 for r in range(num_rows)]
+    kind_range = [kinds[r % 3] for r in range(num_rows)]
+    gas_range = [gases[r % 5] for r in range(num_rows)]
+    level_range = [r % 50 for r in range(num_rows)]
+
+    cases = [
+        ('testo = testo', [{'range': kind_range, 'criteria': 'H Rilevate'},
+                           {'range': gas_range, 'criteria': 'metano'}]),
+        ('wildcard + soglia', [{'range': gas_range, 'criteria': 'met*'},
+                               {'range': level_range, 'criteria': '>=25'}]),
+    ]
+    for label, pairs in cases:
+        t_legacy, expected = timed(_sumifs_legacy, sum_range, pairs, repeat=1)
+        t_new, total = timed(calc_api.calc_ifs, 'sum', sum_range, pairs, repeat=1)
+        # Range gia' preparati (es. stesso range in piu' celle): solo maschere
+        prepared = [{'range': calc_api.CriteriaColumn(p['range']), 'criteria': p['criteria']}
+                    for p in pairs]
+        values = calc_api.CriteriaColumn(sum_range)
+        calc_api.calc_ifs('sum', values, prepared)
+        t_warm, _ = timed(calc_api.calc_ifs, 'sum', values, prepared)
+        print(f'  SUMIFS {label:<18} | per riga {t_legacy:7.0f} ms | compilato {t_new:6.0f} ms | '
+              f'range preparati {t_warm:5.1f} ms | uguali: {expected == total}')
+
+    prepared = [{'range': calc_api.CriteriaColumn(kind_range), 'criteria': 'H Rif'},
+                {'range': calc_api.CriteriaColumn(level_range), 'criteria': '<10'}]
+    values = calc_api.CriteriaColumn(sum_range)
+    for aggregate in ('count', 'average', 'max', 'min'):
+        t, result = timed(calc_api.calc_ifs, aggregate, values, prepared)
+        print(f'  {aggregate.upper() + "IFS":<13} range preparati {t:5.1f} ms -> {result}')
+
+
+# ---------------------------------------------------------------------------
+# ranges: range inviati a ogni chiamata vs registrati una volta (/ranges)
+# ---------------------------------------------------------------------------
+
+def _sumifs_calls(client, payloads):
+    total_bytes = 0
+    results = []
+    for payload in payloads:
+        body = json.dumps(payload)
+        total_bytes += len(body)
+        results.append(client.post('/calc', data=body, content_type='application/json')
+                       .get_json()['result'])
+    return total_bytes, results
+
+
+def bench_ranges():
+    num_rows, num_cells = 50_000, 50
+    print(f'ranges: {num_cells} celle SUMIFS su una tabella da {num_rows} righe (client di test Flask)')
+    client = calc_api.app.test_client()
+    sum_range = [(r % 97) * 0.5 for r in range(num_rows)]
+    kind_range = [f'voce{r % 40}' for r in range(num_rows)]
+    criteria = [f'voce{i % 40}' for i in range(num_cells)]
+
+    inline = [{'operation': 'sumifs', 'sum_range': sum_range,
+               'criteria_pairs': [{'range': kind_range, 'criteria': c}]} for c in criteria]
+
+    def registered():
+        upload = 0
+        refs = {}
+        for name, values in (('sum', sum_range), ('kind', kind_range)):
+            body = json.dumps({'values': values})
+            upload += len(body)
+            refs[name] = client.put(f'/ranges/bench-{name}', data=body,
+                                    content_type='application/json').get_json()
+        payloads = [{'operation': 'sumifs', 'sum_range': {'range_id': refs['sum']['id']},
+                     'criteria_pairs': [{'range': {'range_id': refs['kind']['id']}, 'criteria': c}]}
+                    for c in criteria]
+        sent, results = _sumifs_calls(client, payloads)
+        return upload + sent, results
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_inline, (bytes_inline, expected) = timed(_sumifs_calls, client, inline, repeat=1)
+        t_registered, (bytes_registered, results) = timed(registered, repeat=1)
+    print(f'  inline     {t_inline:7.0f} ms | {bytes_inline / 1e6:6.1f} MB inviati')
+    print(f'  registrati {t_registered:7.0f} ms | {bytes_registered / 1e6:6.1f} MB inviati '
+          f'(registrazione inclusa) | uguali: {expected == results}')
+
+
+# ---------------------------------------------------------------------------
+# lookups: VLOOKUP per chiave con scansione lineare vs indice (una chiamata)
+# ---------------------------------------------------------------------------
+
+def _vlookup_linear(table, key, col_index):
+    folded = key.lower() if isinstance(key, str) else key
+    for row in table:
+        value = row[0].lower() if isinstance(row[0], str) else row[0]
+        if value == folded:
+            return row[col_index - 1]
+    return '#N/A'
+
+
+def bench_lookups():
+    num_rows, num_keys, num_linear = 100_000, 5000, 200
+    print(f'lookups: VLOOKUP esatto di {num_keys} chiavi su una tabella da {num_rows} righe')
+    client = calc_api.app.test_client()
+    table = [[f'cod{r:06d}', r * 0.5] for r in range(num_rows)]
+    keys = [f'COD{(k * 7919) % (num_rows + 500):06d}' for k in range(num_keys)]
+    payload = {'operation': 'vlookup', 'lookup_values': keys, 'table': table,
+               'col_index': 2, 'range_lookup': False}
+
+    def indexed():
+        return client.post('/calc', json=payload).get_json()['result']
+
+    t_linear, expected = timed(lambda: [_vlookup_linear(table, k, 2) for k in keys[:num_linear]],
+                               repeat=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_first, results = timed(indexed, repeat=1)
+        t_cached, _ = timed(indexed, repeat=3)
+    print(f'  lineare             {t_linear / num_linear * num_keys:6.0f} ms (stimato da {num_linear} chiavi)')
+    print(f'  indice, 1a chiamata {t_first:6.0f} ms (costruzione indice inclusa)')
+    print(f'  indice, successive  {t_cached:6.0f} ms | uguali: {expected == results[:num_linear]}')
+
+
+# ---------------------------------------------------------------------------
+# calc_bulk: una request /calc per cella vs una sola /calc/bulk
+# ---------------------------------------------------------------------------
+
+def bench_calc_bulk():
+    num_items, num_sumifs, num_rows = 5000, 50, 20_000
+    print(f'calc_bulk: {num_items} calcoli semplici + {num_sumifs} SUMIFS su {num_rows} righe '
+          f'(client di test Flask)')
+    client = calc_api.app.test_client()
+    ops = ['plus', 'multiply', 'divide', 'max', 'greater']
+    items = [{'id': f'c{i}', 'operation': ops[i % len(ops)], 'args': [i % 97, (i % 13) * 0.5]}
+             for i in range(num_items)]
+    sum_range = [(r % 97) * 0.5 for r in range(num_rows)]
+    kind_range = [f'voce{r % 40}' for r in range(num_rows)]
+    items += [{'id': f's{i}', 'operation': 'sumifs', 'sum_range': sum_range,
+               'criteria_pairs': [{'range': kind_range, 'criteria': f'voce{i % 40}'}]}
+              for i in range(num_sumifs)]
+
+    def single():
+        return [client.post('/calc', json=item).get_json()['result'] for item in items]
+
+    def bulk():
+        results = client.post('/calc/bulk', json={'items': items}).get_json()['results']
+        return [r['result'] for r in results]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_single, expected = timed(single, repeat=1)
+        t_bulk, results = timed(bulk, repeat=3)
+    print(f'  una request per calcolo {t_single:7.0f} ms')
+    print(f'  /calc/bulk              {t_bulk:7.0f} ms | uguali: {expected == results}')
+
+
+# ---------------------------------------------------------------------------
+# parse: parse_value per valore vs parse_values su colonne intere
+# ---------------------------------------------------------------------------
+
+def bench_parse():
+    num_values = 200_000
+    print(f'parse: conversione di {num_values} valori per colonna')
+    columns = {
+        'numeri JSON': [(i % 1000) if i % 2 else i * 0.25 for i in range(num_values)],
+        'stringhe numeriche': [f'{i * 0.37:.2f}' if i % 2 else str(i) for i in range(num_values)],
+        'etichette': [f'voce{i % 50}' for i in range(num_values)],
+        'misti': [(1, 2.5, '', 'TRUE', 'abc', '3.0', None, ' 7 ')[i % 8] for i in range(num_values)],
+    }
+    for label, values in columns.items():
+        t_value, expected = timed(lambda: [calc_values.parse_value(v) for v in values])
+        t_values, results = timed(calc_values.parse_values, values)
+        same = all(type(a) is type(b) and a == b for a, b in zip(expected, results))
+        print(f'  {label:19} parse_value {t_value:6.1f} ms | parse_values {t_values:6.1f} ms | '
+              f'x {t_value / t_values:4.1f} | uguali: {same}')
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+BENCHMARKS = {
+    'model_load': bench_model_load,
+    'translate': bench_translate,
+    'shapes': bench_shapes,
+    'results': bench_results,
+    'pool': bench_pool,
+    'split': bench_split,
+    'codec': bench_codec,
+    'batch_wait': bench_batch_wait,
+    'batch_graph': bench_batch_graph,
+    'calc_columns': bench_calc_columns,
+    'ifs': bench_ifs,
+    'ranges': bench_ranges,
+    'lookups': bench_lookups,
+    'calc_bulk': bench_calc_bulk,
+    'parse': bench_parse,
+}
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            print(f'Benchmark sconosciuto: {name} (disponibili: {", ".join(BENCHMARKS)})')
+            sys.exit(1)
+        BENCHMARKS[name]()
@@ -1,12 +1,28 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from collections import OrderedDict
+import hashlib
+import json
 import operator
 import math
+import bisect
 import fnmatch
-import tempfile
-import os
+import functools
+import inspect
+import re
+import threading
 import time
 
+from cloud_calc_values import parse_value, parse_values
+
+# NumPy (opzionale) per la modalita' colonnare di /calc: senza NumPy le
+# colonne vengono calcolate riga per riga con OPERATIONS
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 # Dipendenze opzionali per /eval_sheet
 # pip install formulas openpyxl numpy
 try:
@@ -20,6 +36,20 @@ except ImportError:
 app = Flask(__name__)
 CORS(app)  # Necessario per chiamate da Google Sheets
 
+# Workbook/foglio virtuale usato da /eval_sheet (modello costruito in memoria)
+MODEL_BOOK = 'MODEL.XLSX'
+MODEL_SHEET = 'MODEL'
+MODEL_CELL_PREFIX = f"'[{MODEL_BOOK}]{MODEL_SHEET}'!"
+
+# Registro dei range (/ranges): tabelle caricate una volta e usate per id
+RANGE_REGISTRY_MAX_CELLS = 20_000_000  # celle totali registrate (limite memoria)
+RANGE_IDLE_TTL_S = 3600.0              # range non usati da 1 ora rimossi
+
+# /calc/bulk
+CALC_BULK_MAX_ITEMS = 100_000          # elementi massimi in una request
+CALC_BULK_COLUMNAR_MIN_ITEMS = 8       # elementi semplici calcolati insieme da qui in su
+CALC_BULK_SHARED_RANGE_CELLS = 100     # range inline condivisi fra elementi da qui in su
+
 @app.before_request
 def _start_timer():
     request._start_time = time.time()
@@ -123,126 +153,1141 @@ def match_criteria(value, criteria):
         return str(value).strip().lower() == criteria_str.lower()
 
 
-def calc_sumifs(sum_range, criteria_pairs):
-    """Implementazione di SUMIFS: somma condizionale con criteri multipli"""
-    total = 0
-    for i in range(len(sum_range)):
-        match = True
-        for pair in criteria_pairs:
-            crit_range = pair['range']
-            criteria = pair['criteria']
-            if i >= len(crit_range):
-                match = False
-                break
-            if not match_criteria(crit_range[i], criteria):
-                match = False
-                break
-        if match:
-            val = sum_range[i]
-            if val is not None:
+# ---------------------------------------------------------------------------
+# SUMIFS / COUNTIFS / AVERAGEIFS / MAXIFS / MINIFS
+# ---------------------------------------------------------------------------
+#
+# Ogni criterio viene analizzato una sola volta (compile_criteria) e
+# valutato su tutto il range come maschera booleana NumPy: soglie numeriche
+# sui valori convertiti in float una volta per range, gli altri criteri
+# (uguaglianza, <>, wildcard) una volta per valore distinto del range.
+# La semantica e' quella di match_criteria().
+
+# operazione -> (aggregazione, campo del payload con il range dei valori)
+CONDITIONAL_AGGREGATES = {
+    'sumifs': ('sum', 'sum_range'),
+    'countifs': ('count', None),
+    'averageifs': ('average', 'average_range'),
+    'maxifs': ('max', 'max_range'),
+    'minifs': ('min', 'min_range'),
+}
+
+_CRITERIA_COMPARE = (('>=', operator.ge), ('<=', operator.le), ('<>', None),
+                     ('>', operator.gt), ('<', operator.lt))
+
+
+class CompiledCriteria:
+    """Criterio SUMIFS analizzato una volta.
+
+    `test(value)` equivale a match_criteria(value, criteria); `mask(column)`
+    valuta il criterio su un CriteriaColumn intero.
+    """
+    __slots__ = ('test', 'compare', 'threshold', 'number')
+
+    def __init__(self, test, compare=None, threshold=None, number=None):
+        self.test = test
+        self.compare = compare      # operatore per le soglie >=, <=, >, <
+        self.threshold = threshold  # soglia float (None se non numerica)
+        self.number = number        # float del criterio numerico (uguaglianza)
+
+    def mask(self, column):
+        if self.compare is not None:
+            if self.threshold is None:
+                return np.zeros(len(column), dtype=bool)
+            with np.errstate(invalid='ignore'):
+                return self.compare(column.numbers, self.threshold)
+        if self.number is not None:
+            # Uguaglianza numerica; i valori non convertibili in float
+            # ricadono sul confronto fra stringhe di match_criteria
+            result = column.number_ok & (column.numbers == self.number)
+            for i in np.flatnonzero(~column.number_ok):
+                result[i] = self.test(column.values[i])
+            return result
+        table = np.fromiter((self.test(value) for value in column.uniques), bool,
+                            len(column.uniques))
+        return table[column.codes]
+
+
+def _number_or_none(text):
+    try:
+        return float(text)
+    except (ValueError, TypeError):
+        return None
+
+
+@functools.lru_cache(maxsize=4096, typed=True)
+def compile_criteria(criteria):
+    """Analizza un criterio stile SUMIFS (gia' passato da parse_value)."""
+    if criteria is None:
+        return CompiledCriteria(lambda value: value is None)
+
+    criteria_str = str(criteria).strip()
+
+    for prefix, compare in _CRITERIA_COMPARE:
+        if not criteria_str.startswith(prefix):
+            continue
+        rest = criteria_str[len(prefix):]
+        if compare is None:
+            other = rest.lower()
+            return CompiledCriteria(lambda value: str(value).lower() != other)
+        threshold = _number_or_none(rest)
+
+        def test(value, compare=compare, threshold=threshold):
+            if threshold is None:
+                return False
+            try:
+                return compare(float(value), threshold)
+            except (ValueError, TypeError):
+                return False
+        return CompiledCriteria(test, compare, threshold)
+
+    folded = criteria_str.lower()
+    if '*' in criteria_str or '?' in criteria_str:
+        pattern = re.compile(fnmatch.translate(folded)).match
+        return CompiledCriteria(lambda value: pattern(str(value).lower()) is not None)
+
+    number = _number_or_none(criteria)
+
+    def test(value):
+        if isinstance(value, str) and isinstance(criteria, str):
+            return value.strip().lower() == folded
+        try:
+            if number is None:
+                raise ValueError
+            return float(value) == number
+        except (ValueError, TypeError):
+            return str(value).strip().lower() == folded
+    return CompiledCriteria(test, number=None if isinstance(criteria, str) else number)
+
+
+class CriteriaColumn:
+    """Range di valori (gia' passati da parse_value) con le viste usate dai
+    criteri e dalle ricerche, calcolate al primo uso: float dei valori (nan
+    se non convertibili), codici dei valori distinti, indice hash e chiavi
+    ordinate per MATCH/VLOOKUP/XLOOKUP."""
+    __slots__ = ('values', '_numbers', '_number_ok', '_codes', '_uniques',
+                 '_exact_index', '_sorted_keys')
+
+    def __init__(self, values):
+        self.values = values
+        self._numbers = None
+        self._number_ok = None
+        self._codes = None
+        self._uniques = None
+        self._exact_index = None
+        self._sorted_keys = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def _convert(self):
+        values = self.values
+        types = set(map(type, values))
+        if types <= {int, float}:
+            self._numbers = np.array(values, dtype=np.float64)
+            self._number_ok = np.ones(len(values), dtype=bool)
+        elif types <= {int, float, type(None)}:
+            self._numbers = np.array(values, dtype=np.float64)   # None -> nan
+            self._number_ok = np.fromiter((v is not None for v in values), bool, len(values))
+        else:
+            numbers = np.full(len(values), np.nan)
+            number_ok = np.zeros(len(values), dtype=bool)
+            for i, value in enumerate(values):
                 try:
-                    total += float(val)
+                    numbers[i] = float(value)
+                    number_ok[i] = True
                 except (ValueError, TypeError):
                     pass
-    return total
+            self._numbers, self._number_ok = numbers, number_ok
+
+    @property
+    def numbers(self):
+        if self._numbers is None:
+            self._convert()
+        return self._numbers
+
+    @property
+    def number_ok(self):
+        if self._number_ok is None:
+            self._convert()
+        return self._number_ok
+
+    def _factorize(self):
+        # Chiave (tipo, valore): 1, 1.0 e True sono distinti per i criteri
+        index = {}
+        codes = np.fromiter((index.setdefault((type(v), v), len(index)) for v in self.values),
+                            np.int64, len(self.values))
+        self._codes = codes
+        self._uniques = [value for _, value in index]
+
+    @property
+    def codes(self):
+        if self._codes is None:
+            self._factorize()
+        return self._codes
+
+    @property
+    def uniques(self):
+        if self._uniques is None:
+            self._factorize()
+        return self._uniques
+
+    @property
+    def exact_index(self):
+        """chiave di ricerca (lookup_key) -> [prima, ultima] posizione."""
+        if self._exact_index is None:
+            index = {}
+            for i, key in enumerate(map(lookup_key, self.values)):
+                if key is None:
+                    continue
+                positions = index.get(key)
+                if positions is None:
+                    index[key] = [i, i]
+                else:
+                    positions[1] = i
+            self._exact_index = index
+        return self._exact_index
+
+    def sorted_keys(self, kind):
+        """Chiavi numeriche (kind float) o di testo (kind str) ordinate,
+        con le loro posizioni: (chiavi, posizioni). A parita' di chiave le
+        posizioni sono crescenti."""
+        if self._sorted_keys is None:
+            by_kind = {float: [], str: []}
+            for i, key in enumerate(map(lookup_key, self.values)):
+                items = by_kind.get(type(key))
+                if items is not None and key == key:    # esclude nan
+                    items.append((key, i))
+            self._sorted_keys = {}
+            for key_kind, items in by_kind.items():
+                items.sort()
+                self._sorted_keys[key_kind] = ([key for key, _ in items],
+                                               [i for _, i in items])
+        return self._sorted_keys[kind]
+
+
+def _criteria_mask(criteria_pairs, num_rows):
+    """Maschera delle righe che soddisfano tutti i criteri (range piu' corti
+    di num_rows non soddisfano le righe mancanti)."""
+    mask = np.ones(num_rows, dtype=bool)
+    for pair in criteria_pairs:
+        column = pair['range']
+        if not isinstance(column, CriteriaColumn):
+            column = CriteriaColumn(column)
+        pair_mask = compile_criteria(pair['criteria']).mask(column)[:num_rows]
+        mask[:len(pair_mask)] &= pair_mask
+        mask[len(pair_mask):] = False
+    return mask
+
+
+def _aggregate(aggregate, numbers, count):
+    """Aggrega i valori numerici selezionati (somma nello stesso ordine del
+    ciclo originale)."""
+    if aggregate == 'count':
+        return count
+    if not numbers:
+        return '#DIV/0!' if aggregate == 'average' else 0
+    if aggregate == 'max':
+        return max(numbers)
+    if aggregate == 'min':
+        return min(numbers)
+    total = functools.reduce(operator.add, numbers, 0)
+    return total / len(numbers) if aggregate == 'average' else total
+
+
+def calc_ifs(aggregate, values, criteria_pairs):
+    """SUMIFS/COUNTIFS/AVERAGEIFS/MAXIFS/MINIFS con criteri multipli.
+
+    `aggregate` e' 'sum', 'count', 'average', 'max' o 'min'; `values` e' il
+    range da aggregare (per 'count' puo' essere None: conta le righe del
+    primo criteria range). Sono aggregati solo i valori convertibili in
+    numero; average senza valori da' #DIV/0!, max/min danno 0.
+    """
+    if values is None:
+        first = criteria_pairs[0]['range']
+        num_rows = len(first)
+    else:
+        num_rows = len(values)
+
+    if not NUMPY_AVAILABLE:
+        tests = [(pair['range'], compile_criteria(pair['criteria']).test) for pair in criteria_pairs]
+        rows = [i for i in range(num_rows)
+                if all(i < len(column) and test(column[i]) for column, test in tests)]
+        numbers = []
+        if aggregate != 'count':
+            for i in rows:
+                try:
+                    numbers.append(float(values[i]))
+                except (ValueError, TypeError):
+                    pass
+        return _aggregate(aggregate, numbers, len(rows))
 
+    mask = _criteria_mask(criteria_pairs, num_rows)
+    if aggregate == 'count':
+        return int(np.count_nonzero(mask))
+    column = values if isinstance(values, CriteriaColumn) else CriteriaColumn(values)
+    selected = column.numbers[mask & column.number_ok]
+    if aggregate in ('sum', 'average') and len(selected):
+        # Somma sequenziale come il ciclo originale (non la somma a coppie di NumPy)
+        total = np.cumsum(selected)[-1].item()
+        return total / len(selected) if aggregate == 'average' else total
+    return _aggregate(aggregate, selected.tolist(), int(np.count_nonzero(mask)))
 
-def parse_value(value):
-    """Converte il valore nel tipo appropriato"""
-    if value is None or value == '':
-        return None
-    
-    # Prova a convertire in numero
-    if isinstance(value, (int, float, bool)):
-        return value
-    
-    value_str = str(value).strip()
-    
-    # Booleani
-    if value_str.lower() == 'true':
-        return True
-    if value_str.lower() == 'false':
-        return False
-    
-    # Numeri
-    try:
-        if '.' in value_str:
-            return float(value_str)
-        return int(value_str)
-    except ValueError:
-        return value_str
 
-@app.route('/calc', methods=['POST', 'GET'])
-def calculate():
+def calc_sumifs(sum_range, criteria_pairs):
+    """Implementazione di SUMIFS: somma condizionale con criteri multipli"""
+    return calc_ifs('sum', sum_range, criteria_pairs)
+
+
+# ---------------------------------------------------------------------------
+# Modalita' colonnare: una operazione applicata riga per riga a colonne
+# di argomenti (es. CLOUD_CALC_ARRAY("multiply"; A2:A5000; B2:B5000))
+# ---------------------------------------------------------------------------
+
+# Errori di foglio: un argomento in errore rende in errore la riga
+SHEET_ERRORS = ('#DIV/0!', '#N/A', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#NULL!', '#ERROR')
+
+# Operazioni calcolate con NumPy su tutte le righe numeriche in una volta.
+# Le celle vuote valgono 0 come nelle formule del foglio.
+COLUMN_OPERATIONS = {
+    'plus': lambda *c: functools.reduce(np.add, c),
+    'minus': lambda a, b: a - b,
+    'multiply': lambda *c: functools.reduce(np.multiply, c),
+    'divide': lambda a, b: a / b,
+    'power': lambda a, b: np.power(a, b),
+    'mod': lambda a, b: np.mod(a, b),
+    'equals': lambda a, b: a == b,
+    'greater': lambda a, b: a > b,
+    'less': lambda a, b: a < b,
+    'greater_equal': lambda a, b: a >= b,
+    'less_equal': lambda a, b: a <= b,
+    'and': lambda *c: np.logical_and.reduce(c),
+    'or': lambda *c: np.logical_or.reduce(c),
+    'not': lambda a: np.logical_not(a),
+    'sqrt': lambda a: np.sqrt(a),
+    'abs': lambda a: np.abs(a),
+    'floor': lambda a: np.floor(a),
+    'ceil': lambda a: np.ceil(a),
+    'max': lambda *c: functools.reduce(np.maximum, c),
+    'min': lambda *c: functools.reduce(np.minimum, c),
+    'average': lambda *c: functools.reduce(np.add, c) / len(c),
+}
+
+# Operazioni numeriche: un argomento testo rende la riga #VALUE!
+NUMERIC_COLUMN_OPERATIONS = {'plus', 'minus', 'multiply', 'divide', 'power', 'mod',
+                             'sqrt', 'abs', 'floor', 'ceil', 'max', 'min', 'average'}
+
+# Su argomenti interi danno un intero (come OPERATIONS); floor/ceil sempre
+INT_COLUMN_OPERATIONS = {'plus', 'minus', 'multiply', 'power', 'mod', 'abs', 'max', 'min'}
+ALWAYS_INT_COLUMN_OPERATIONS = {'floor', 'ceil'}
+
+# Interi oltre 2**53 non sono esatti in float64: ricalcolati con OPERATIONS
+MAX_EXACT_INT = 2 ** 53
+_NUMERIC_TYPES = {int, float, type(None)}
+
+
+def excel_error(exc):
+    """Codice di errore di foglio per un'eccezione di calcolo."""
+    if isinstance(exc, ZeroDivisionError):
+        return '#DIV/0!'
+    if isinstance(exc, (ValueError, OverflowError)):
+        return '#NUM!'
+    return '#VALUE!'
+
+
+def _apply_row(func, row):
+    """Applica una funzione di OPERATIONS a una riga; gli errori diventano codici."""
     try:
-        # Supporta sia GET che POST
-        if request.method == 'POST':
-            data = request.get_json()
+        result = func(*row)
+    except Exception as e:
+        return excel_error(e)
+    return '#NUM!' if isinstance(result, complex) else result
+
+
+def _column_values(operation, func, args, int_args, row_at):
+    """Calcola con NumPy le righe numeriche (`args`: un array float64 per
+    argomento, celle vuote a 0) e converte i risultati come OPERATIONS:
+    codici di errore per divisioni per zero e risultati non finiti, interi
+    dove OPERATIONS darebbe un intero. `int_args[k][j]` indica se l'argomento
+    k della riga j e' intero; `row_at(j)` ritorna la riga j originale,
+    ricalcolata con OPERATIONS se un intero (argomento o risultato) non e'
+    esatto in float64.
+    """
+    with np.errstate(all='ignore'):
+        values = COLUMN_OPERATIONS[operation](*args)
+    out = values.tolist()
+    # Argomenti interi da 2**53 in su: in float64 perdono le unita'
+    # (2**53 + 1 == 2**53), la riga va calcolata sugli interi originali
+    inexact = (int_args & (np.abs(np.array(args)) >= MAX_EXACT_INT)).any(axis=0)
+    if values.dtype.kind != 'f':
+        return _recompute_rows(out, func, np.flatnonzero(inexact), row_at)
+
+    finite = np.isfinite(values)
+    if operation in ('divide', 'mod'):
+        div0 = args[1] == 0
+    elif operation == 'power':
+        div0 = (args[0] == 0) & (args[1] < 0)
+    else:
+        div0 = np.zeros(len(out), dtype=bool)
+    for j in np.flatnonzero(~finite | div0):
+        out[j] = '#DIV/0!' if div0[j] else '#NUM!'
+
+    if operation in ALWAYS_INT_COLUMN_OPERATIONS:
+        for j in np.flatnonzero(finite):
+            out[j] = int(out[j])
+    elif operation in INT_COLUMN_OPERATIONS:
+        if operation in ('max', 'min'):
+            # max()/min() restituiscono il primo argomento scelto, col suo tipo
+            stacked = np.array(args)
+            chosen = stacked.argmax(axis=0) if operation == 'max' else stacked.argmin(axis=0)
+            as_int = int_args[chosen, np.arange(len(out))] & finite
         else:
-            data = {
-                'operation': request.args.get('operation'),
-                'args': request.args.getlist('args')
+            as_int = int_args.all(axis=0) & finite & ~div0
+        if operation == 'power':
+            as_int &= args[1] >= 0
+        exact = np.abs(values) < MAX_EXACT_INT
+        for j in np.flatnonzero(as_int & exact):
+            out[j] = int(out[j])
+        inexact |= as_int & ~exact
+    return _recompute_rows(out, func, np.flatnonzero(inexact), row_at)
+
+
+def _recompute_rows(out, func, rows, row_at):
+    """Ricalcola con OPERATIONS le righe `rows` di `out` (celle vuote a 0)."""
+    for j in rows:
+        out[j] = _apply_row(func, [0 if v is None else v for v in row_at(j)])
+    return out
+
+
+def calc_columns(operation, columns):
+    """Applica `operation` elemento per elemento a colonne di uguale lunghezza.
+
+    Righe con un argomento in errore (#DIV/0!, #N/A, ...) restituiscono il
+    primo errore (tranne if/iferror, che li gestiscono da sole) e le
+    operazioni numeriche su testo danno #VALUE!; righe tutte vuote restano
+    vuote (None). Le righe numeriche delle operazioni in COLUMN_OPERATIONS
+    sono calcolate con NumPy, le altre con OPERATIONS.
+    """
+    func = OPERATIONS[operation]
+    vector = NUMPY_AVAILABLE and operation in COLUMN_OPERATIONS
+    num_rows = len(columns[0])
+
+    # Caso comune: colonne di soli numeri e celle vuote, nessun ciclo per riga
+    types = [set(map(type, col)) for col in columns]
+    if vector and all(t <= _NUMERIC_TYPES for t in types):
+        try:
+            data = np.array(columns, dtype=np.float64)   # None -> nan
+        except OverflowError:
+            data = None   # interi oltre il float64: righe una per una
+    else:
+        data = None
+    if data is not None:
+        empty = np.isnan(data)
+        data[empty] = 0
+        int_args = np.ones(data.shape, dtype=bool)
+        for k, (col, col_types) in enumerate(zip(columns, types)):
+            if float in col_types:
+                int_args[k] = np.fromiter((type(v) is not float for v in col), bool, num_rows)
+        out = _column_values(operation, func, list(data), int_args,
+                             lambda j: [col[j] for col in columns])
+        for j in np.flatnonzero(empty.all(axis=0)):
+            out[j] = None
+        return out
+
+    propagate = operation not in ('if', 'iferror')
+    numeric_only = operation in NUMERIC_COLUMN_OPERATIONS
+    rows = list(zip(*columns))
+    results = [None] * num_rows
+    numeric_index = []
+    numeric_rows = []
+    for i, row in enumerate(rows):
+        blank = True
+        numeric = vector
+        exact = True
+        error = None
+        for value in row:
+            if value is None:
+                continue
+            blank = False
+            kind = type(value)
+            if kind is float:
+                continue
+            if kind is int:
+                exact = exact and -MAX_EXACT_INT < value < MAX_EXACT_INT
+                continue
+            numeric = False
+            if error is None and propagate and kind is str and value.startswith(SHEET_ERRORS):
+                error = value
+        if error is not None:
+            results[i] = error
+        elif blank:
+            continue
+        elif numeric and not exact:
+            # Interi non esatti in float64: calcolo sugli interi originali
+            results[i] = _apply_row(func, [0 if v is None else v for v in row])
+        elif numeric:
+            numeric_index.append(i)
+            numeric_rows.append(row)
+        elif numeric_only and any(type(value) is str for value in row):
+            results[i] = '#VALUE!'
+        else:
+            results[i] = _apply_row(func, row)
+
+    if numeric_rows:
+        data = np.array(numeric_rows, dtype=np.float64)
+        data[np.isnan(data)] = 0  # celle vuote
+        int_args = np.array([[type(v) is not float for v in row] for row in numeric_rows]).T
+        out = _column_values(operation, func, list(data.T), int_args,
+                             lambda j: numeric_rows[j])
+        for i, value in zip(numeric_index, out):
+            results[i] = value
+    return results
+
+
+def column_arguments(columns_raw):
+    """Converte le colonne del payload in liste di uguale lunghezza.
+
+    Una colonna puo' essere un range registrato ({"range_id": ...}). Un
+    valore singolo (o una lista di un elemento) viene ripetuto su tutte le
+    righe. Solleva ValueError se le lunghezze non coincidono.
+    """
+    if not isinstance(columns_raw, list) or not columns_raw:
+        raise ValueError('columns must be a non-empty list')
+    columns = [resolve_range(col).values if isinstance(col, (list, dict)) else [parse_value(col)]
+               for col in columns_raw]
+    lengths = {len(col) for col in columns if len(col) != 1}
+    if len(lengths) > 1:
+        raise ValueError(f'columns must have the same length (got {sorted(lengths)})')
+    num_rows = lengths.pop() if lengths else 1
+    return [col * num_rows if len(col) == 1 else col for col in columns]
+
+
+# ---------------------------------------------------------------------------
+# Registro dei range
+# ---------------------------------------------------------------------------
+#
+# Un range grande (es. la tabella di 50k righe letta da 50 celle SUMIFS)
+# viene caricato una volta con PUT /ranges/<id> e poi indicato in /calc con
+# {"range_id": id} al posto della lista dei valori. Il server conserva i
+# valori gia' convertiti e, al primo uso, le viste dei criteri
+# (CriteriaColumn: float dei valori e codici dei valori distinti).
+
+class RangeRefError(Exception):
+    """Riferimento a un range non registrato (404) o di versione diversa (412)."""
+
+    def __init__(self, message, range_id, status):
+        super().__init__(message)
+        self.range_id = range_id
+        self.status = status
+
+
+def range_etag(values) -> str:
+    """Versione di un range: impronta SHA-1 dei valori come ricevuti."""
+    payload = json.dumps(values, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class RangeRegistry:
+    """Range registrati per id (nome scelto dal client o impronta del
+    contenuto), con eviction LRU sul totale delle celle e rimozione dei
+    range non usati da RANGE_IDLE_TTL_S secondi.
+    """
+
+    def __init__(self, max_cells=RANGE_REGISTRY_MAX_CELLS, idle_ttl_s=RANGE_IDLE_TTL_S):
+        self.max_cells = max_cells
+        self.idle_ttl_s = idle_ttl_s
+        self._lock = threading.Lock()
+        self._ranges: OrderedDict[str, dict] = OrderedDict()   # id -> entry
+        self._cells = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, range_id: str, values: list, etag: str | None = None) -> dict:
+        """Registra (o sostituisce) un range; ritorna la sua entry.
+
+        Se il contenuto non e' cambiato la entry esistente, con le sue
+        viste gia' calcolate, viene conservata. Solleva ValueError se il
+        range supera da solo il limite del registro.
+        """
+        if len(values) > self.max_cells:
+            raise ValueError(f'range too large: {len(values)} cells (max {self.max_cells})')
+        etag = etag or range_etag(values)
+        with self._lock:
+            entry = self._ranges.get(range_id)
+            if entry is not None and entry['etag'] == etag:
+                entry['last_used'] = time.time()
+                self._ranges.move_to_end(range_id)
+                return entry
+        column = CriteriaColumn(parse_values(values))
+        entry = {'id': range_id, 'etag': etag, 'column': column, 'cells': len(values),
+                 'created': time.time(), 'last_used': time.time()}
+        with self._lock:
+            old = self._ranges.pop(range_id, None)
+            if old is not None:
+                self._cells -= old['cells']
+            self._ranges[range_id] = entry
+            self._cells += entry['cells']
+            self._evict()
+        return entry
+
+    def get(self, range_id: str) -> dict | None:
+        """Ritorna la entry del range (e la marca come usata) o None."""
+        with self._lock:
+            self._evict()
+            entry = self._ranges.get(range_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._ranges.move_to_end(range_id)
+            entry['last_used'] = time.time()
+            self.hits += 1
+            return entry
+
+    def delete(self, range_id: str) -> bool:
+        with self._lock:
+            entry = self._ranges.pop(range_id, None)
+            if entry is None:
+                return False
+            self._cells -= entry['cells']
+            return True
+
+    def _evict(self):
+        """Rimuove i range inattivi e, oltre il limite di celle, i meno
+        usati di recente. Da chiamare con il lock."""
+        expired_at = time.time() - self.idle_ttl_s
+        while self._ranges:
+            oldest = next(iter(self._ranges.values()))
+            if self._cells <= self.max_cells and oldest['last_used'] > expired_at:
+                break
+            self._ranges.popitem(last=False)
+            self._cells -= oldest['cells']
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'ranges': len(self._ranges),
+                'cells': self._cells,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
             }
-        
-        operation = data.get('operation', '').lower()
+
+
+# Singleton
+range_registry = RangeRegistry()
+
+
+def range_info(entry) -> dict:
+    return {'id': entry['id'], 'etag': entry['etag'], 'size': entry['cells']}
+
+
+def resolve_range(raw):
+    """Range del payload: lista di valori oppure {"range_id", "etag"?}
+    di un range registrato. Ritorna un CriteriaColumn.
+
+    Solleva RangeRefError se il range non e' registrato o se l'etag
+    indicato non corrisponde alla versione registrata.
+    """
+    if isinstance(raw, CriteriaColumn):
+        return raw
+    if isinstance(raw, dict):
+        range_id = str(raw.get('range_id', ''))
+        entry = range_registry.get(range_id)
+        if entry is None:
+            raise RangeRefError(f'Range non registrato: {range_id}', range_id, 404)
+        etag = raw.get('etag')
+        if etag and etag != entry['etag']:
+            raise RangeRefError(f'Range modificato: {range_id}', range_id, 412)
+        return entry['column']
+    return CriteriaColumn(parse_values(raw))
+
+
+# ---------------------------------------------------------------------------
+# MATCH / VLOOKUP / XLOOKUP
+# ---------------------------------------------------------------------------
+#
+# Ricerca esatta con un indice hash per range (chiave -> prima e ultima
+# posizione), ricerca approssimata con ricerca binaria sulle chiavi
+# ordinate. Gli indici sono viste di CriteriaColumn: per i range registrati
+# (e per i range inline grandi, registrati per impronta) restano validi fra
+# una chiamata e l'altra. Con "lookup_values" invece di "lookup_value" una
+# sola chiamata risponde a molte chiavi sulla stessa tabella.
+
+LOOKUP_OPERATIONS = ('match', 'vlookup', 'xlookup')
+LOOKUP_AUTO_REGISTER_CELLS = 1000   # range inline da qui in su tenuti nel registro
+
+
+def lookup_key(value):
+    """Chiave di confronto per le ricerche: testo senza distinzione fra
+    maiuscole e minuscole, numeri come float, booleani distinti dai numeri.
+    None (cella vuota) non ha chiave."""
+    kind = type(value)
+    if kind is str:
+        return value.lower()
+    if kind is bool:
+        return (value,)
+    if kind is int or kind is float:
+        return float(value)
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _wildcard_pattern(key):
+    return re.compile(fnmatch.translate(key)).match
+
+
+def _wildcard_position(column, key, last):
+    match = _wildcard_pattern(key)
+    positions = range(len(column.values) - 1, -1, -1) if last else range(len(column.values))
+    for i in positions:
+        value = column.values[i]
+        if type(value) is str and match(value.lower()):
+            return i
+    return None
+
+
+def lookup_position(column, value, mode='exact', last=False, wildcards=False):
+    """Posizione (da 0) di `value` nel range, o None se non trovato.
+
+    mode: 'exact', 'le' (esatto o il piu' grande minore) o 'ge' (esatto o
+    il piu' piccolo maggiore); numeri e testo si confrontano solo fra loro.
+    A parita' di valore ritorna la prima posizione, o l'ultima con `last`.
+    Con `wildcards` un testo con * o ? e' un modello (solo ricerca esatta).
+    """
+    key = lookup_key(value)
+    if key is None:
+        return None
+    if wildcards and type(key) is str and ('*' in key or '?' in key):
+        return _wildcard_position(column, key, last)
+    positions = column.exact_index.get(key)
+    if positions is not None:
+        return positions[last]
+    if mode == 'exact' or type(key) is tuple:   # booleani: solo esatto
+        return None
+    keys, positions = column.sorted_keys(type(key))
+    if mode == 'le':
+        i = bisect.bisect_right(keys, key) - 1
+        if i < 0:
+            return None
+    else:
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys):
+            return None
+    found = keys[i]
+    i = bisect.bisect_right(keys, found) - 1 if last else bisect.bisect_left(keys, found)
+    return positions[i]
+
+
+def lookup_range(raw):
+    """Come resolve_range, ma un range inline grande viene registrato con
+    la sua impronta come id (come POST /ranges), cosi' gli indici costruiti
+    servono anche alle chiamate successive con lo stesso range.
+
+    La entry esistente viene riusata solo se il suo etag e' l'impronta del
+    range: con PUT /ranges/<id> lo stesso id puo' contenere altri valori.
+    """
+    if isinstance(raw, list) and len(raw) >= LOOKUP_AUTO_REGISTER_CELLS:
+        etag = range_etag(raw)
+        entry = range_registry.get(etag)
+        if entry is None or entry['etag'] != etag:
+            entry = range_registry.put(etag, raw, etag)
+        return entry['column']
+    return resolve_range(raw)
+
+
+def _lookup_ranges(data, return_field='return_range'):
+    if data.get('lookup_range') is None:
+        raise ValueError('lookup_range richiesto nel payload')
+    lookup = lookup_range(data['lookup_range'])
+    if return_field is None:
+        return lookup, None
+    if data.get(return_field) is None:
+        raise ValueError(f'{return_field} richiesto nel payload')
+    result = lookup_range(data[return_field])
+    if len(result) != len(lookup):
+        raise ValueError('lookup_range e return_range devono avere la stessa lunghezza')
+    return lookup, result
+
+
+def calc_lookup(operation, data):
+    """MATCH, VLOOKUP e XLOOKUP sul payload di /calc.
+
+    Solleva ValueError per payload non validi e RangeRefError per range
+    registrati mancanti o modificati.
+    """
+    if operation == 'match':
+        match_type = parse_value(data.get('match_type', 1))
+        if not isinstance(match_type, (int, float)):
+            raise ValueError(f'match_type non valido: {match_type}')
+        mode = 'le' if match_type > 0 else 'ge' if match_type < 0 else 'exact'
+        column, _ = _lookup_ranges(data, None)
+
+        def find(value):
+            # ±1: ultima posizione a parita' di valore, come la ricerca
+            # binaria di MATCH su dati ordinati
+            i = lookup_position(column, value, mode, last=mode != 'exact',
+                                wildcards=mode == 'exact')
+            return '#N/A' if i is None else i + 1
+
+    elif operation == 'vlookup':
+        exact = parse_value(data.get('range_lookup', True)) in (False, 0)
+        if 'table' in data:
+            # Tabella per righe: servono solo la prima colonna e col_index
+            col_index = parse_value(data.get('col_index'))
+            if not isinstance(col_index, int) or isinstance(col_index, bool) or col_index < 1:
+                raise ValueError(f'col_index non valido: {col_index}')
+            table = data['table']
+            width = max((len(row) for row in table), default=0)
+            if col_index > width:
+                raise ValueError(f'col_index {col_index} oltre le {width} colonne della tabella')
+            column = lookup_range([row[0] if row else None for row in table])
+            results = lookup_range([row[col_index - 1] if len(row) >= col_index else None
+                                    for row in table])
+        else:
+            column, results = _lookup_ranges(data)
+
+        def find(value):
+            i = lookup_position(column, value, 'exact' if exact else 'le',
+                                last=not exact, wildcards=exact)
+            return '#N/A' if i is None else results.values[i]
+
+    elif operation == 'xlookup':
+        match_mode = parse_value(data.get('match_mode', 0))
+        search_mode = parse_value(data.get('search_mode', 1))
+        if match_mode not in (0, -1, 1, 2):
+            raise ValueError(f'match_mode non valido: {match_mode}')
+        if search_mode not in (1, -1, 2, -2):
+            raise ValueError(f'search_mode non valido: {search_mode}')
+        mode = {0: 'exact', 2: 'exact', -1: 'le', 1: 'ge'}[match_mode]
+        # Con gli indici la ricerca binaria (±2) non serve: stesso risultato
+        # della ricerca lineare nella stessa direzione
+        last = search_mode < 0
+        if_not_found = parse_value(data.get('if_not_found', '#N/A'))
+        column, results = _lookup_ranges(data)
+
+        def find(value):
+            i = lookup_position(column, value, mode, last=last, wildcards=match_mode == 2)
+            return if_not_found if i is None else results.values[i]
+
+    else:
+        raise ValueError(f'Unknown operation: {operation}')
+
+    if 'lookup_values' in data:
+        return [find(value) for value in parse_values(data['lookup_values'])]
+    return find(parse_value(data.get('lookup_value')))
+
+
+def evaluate_calc(data, resolve=resolve_range):
+    """Valuta un payload di /calc; ritorna (corpo della risposta, status).
+
+    `resolve` converte i range di SUMIFS & co. (vedi resolve_range).
+    """
+    operation = ''
+    try:
+        operation = str(data.get('operation') or '').lower()
         args_raw = data.get('args', [])
         
         # Valida l'operazione
         if not operation:
-            return jsonify({'error': 'Operation is required'}), 400
+            return {'error': 'Operation is required'}, 400
         
-        # SUMIFS: gestione speciale con payload strutturato
-        if operation == 'sumifs':
-            sum_range_raw = data.get('sum_range', [])
+        # SUMIFS & co.: gestione speciale con payload strutturato
+        if operation in CONDITIONAL_AGGREGATES:
+            aggregate, values_field = CONDITIONAL_AGGREGATES[operation]
+            values_raw = data.get(values_field, []) if values_field else None
             criteria_pairs_raw = data.get('criteria_pairs', [])
 
-            if not sum_range_raw or not criteria_pairs_raw:
-                return jsonify({
-                    'error': 'sumifs richiede sum_range e criteria_pairs nel payload'
-                }), 400
+            if (values_field and not values_raw) or not criteria_pairs_raw:
+                required = f'{values_field} e criteria_pairs' if values_field else 'criteria_pairs'
+                return {
+                    'error': f'{operation} richiede {required} nel payload'
+                }, 400
 
-            sum_range = [parse_value(v) for v in sum_range_raw]
+            # Range inline o registrati ({"range_id": ...})
+            values = resolve(values_raw) if values_field else None
             criteria_pairs = []
             for pair in criteria_pairs_raw:
                 criteria_pairs.append({
-                    'range': [parse_value(v) for v in pair['range']],
+                    'range': resolve(pair['range']),
                     'criteria': parse_value(pair['criteria'])
                 })
 
-            result = calc_sumifs(sum_range, criteria_pairs)
-            return jsonify({
+            result = calc_ifs(aggregate, values, criteria_pairs)
+            return {
+                'result': result,
+                'operation': operation
+            }, 200
+
+        # MATCH / VLOOKUP / XLOOKUP: una chiave o molte ("lookup_values")
+        if operation in LOOKUP_OPERATIONS:
+            try:
+                result = calc_lookup(operation, data)
+            except ValueError as e:
+                return {'error': str(e), 'operation': operation}, 400
+            return {
                 'result': result,
                 'operation': operation
-            })
+            }, 200
 
         if operation not in OPERATIONS:
-            return jsonify({
+            return {
                 'error': f'Unknown operation: {operation}',
                 'available': list(OPERATIONS.keys())
-            }), 400
+            }, 400
+
+        # Modalita' colonnare: "columns" invece di "args", un risultato per riga
+        if 'columns' in data:
+            try:
+                columns = column_arguments(data['columns'])
+            except ValueError as e:
+                return {'error': str(e), 'operation': operation}, 400
+            # Numero di argomenti verificato una volta sola, non per riga
+            inspect.signature(OPERATIONS[operation]).bind(*columns)
+            result = calc_columns(operation, columns)
+            return {
+                'result': result,
+                'operation': operation,
+                'rows': len(result)
+            }, 200
 
         # Parse degli argomenti
-        args = [parse_value(arg) for arg in args_raw]
+        args = parse_values(args_raw)
 
         # Esegui l'operazione
         result = OPERATIONS[operation](*args)
         
-        return jsonify({
+        return {
             'result': result,
             'operation': operation,
             'args': args
-        })
+        }, 200
     
+    except RangeRefError as e:
+        return {
+            'error': str(e),
+            'range_id': e.range_id,
+            'operation': operation
+        }, e.status
     except TypeError as e:
-        return jsonify({
+        return {
             'error': f'Invalid number of arguments: {str(e)}',
             'operation': operation
-        }), 400
+        }, 400
     except Exception as e:
-        return jsonify({
+        return {
             'error': str(e),
             'operation': operation
-        }), 500
+        }, 500
+
+
+@app.route('/calc', methods=['POST', 'GET'])
+def calculate():
+    try:
+        # Supporta sia GET che POST
+        if request.method == 'POST':
+            data = request.get_json()
+        else:
+            data = {
+                'operation': request.args.get('operation'),
+                'args': request.args.getlist('args')
+            }
+    except Exception as e:
+        return jsonify({'error': str(e), 'operation': ''}), 500
+    body, status = evaluate_calc(data)
+    return jsonify(body), status
+
+
+# ---------------------------------------------------------------------------
+# /calc/bulk: molti payload di /calc in una request
+# ---------------------------------------------------------------------------
+#
+# Gli elementi sono raggruppati per operazione: quelli semplici (args di
+# soli numeri) di uno stesso gruppo sono calcolati insieme con
+# calc_columns, gli altri uno per uno con evaluate_calc. I range inline
+# uguali fra elementi diversi (es. molte SUMIFS sulla stessa tabella) sono
+# convertiti una volta sola. Un elemento non valido da' errore solo per se'.
+
+def _bulk_range_resolver():
+    """resolve_range con memoria per la durata di una request bulk: range
+    inline con lo stesso contenuto condividono lo stesso CriteriaColumn."""
+    columns = {}
+
+    def resolve(raw):
+        if not isinstance(raw, list) or len(raw) < CALC_BULK_SHARED_RANGE_CELLS:
+            return resolve_range(raw)
+        etag = range_etag(raw)
+        column = columns.get(etag)
+        if column is None:
+            column = columns[etag] = resolve_range(raw)
+        return column
+    return resolve
+
+
+_BULK_JSON_SCALARS = frozenset({int, float, str, bool, type(None)})
+
+
+def _bulk_item_result(item_id, body, status):
+    """Risultato di un elemento per la risposta bulk. Un risultato che non
+    si serializza in JSON (es. power(-1, 0.5) e' complesso) diventa
+    l'errore dell'elemento, invece di un 500 per tutta la request."""
+    result = {'id': item_id}
+    result.update((k, v) for k, v in body.items() if k not in ('operation', 'args'))
+    value = result.get('result')
+    if type(value) not in _BULK_JSON_SCALARS:
+        try:
+            app.json.dumps(value)
+        except (TypeError, ValueError) as e:
+            result = {'id': item_id, 'error': str(e)}
+            status = 500
+    if status != 200:
+        result['status'] = status
+    return result
+
+
+def _bulk_numeric_args(item):
+    """Argomenti di un elemento semplice {id, operation, args} se sono tutti
+    numeri (int/float, non bool), altrimenti None."""
+    if not item.keys() <= {'id', 'operation', 'args'}:
+        return None
+    args_raw = item.get('args', [])
+    if not isinstance(args_raw, list) or not args_raw:
+        return None
+    args = parse_values(args_raw)
+    for value in args:
+        kind = type(value)
+        if kind is not int and kind is not float:
+            return None
+    return args
+
+
+def _bulk_columnar(operation, indexed_args):
+    """Calcola insieme elementi semplici della stessa operazione e arita':
+    {indice: risultato}. Le righe con un codice di errore vengono ricalcolate
+    una per una, cosi' errori e messaggi sono quelli di /calc."""
+    positions = [i for i, _ in indexed_args]
+    rows = [args for _, args in indexed_args]
+    try:
+        inspect.signature(OPERATIONS[operation]).bind(*rows[0])
+    except TypeError:
+        return {}
+    results = calc_columns(operation, [list(col) for col in zip(*rows)])
+    return {i: result for i, result in zip(positions, results)
+            if not (isinstance(result, str) and result.startswith(SHEET_ERRORS))}
+
+
+def evaluate_bulk(items):
+    """Valuta una lista di payload di /calc ({id, operation, ...}); ritorna
+    un risultato per elemento, nello stesso ordine."""
+    results = [None] * len(items)
+    groups = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = _bulk_item_result(i, {'error': 'item must be an object'}, 400)
+            continue
+        groups.setdefault(str(item.get('operation') or '').lower(), []).append(i)
+
+    resolve = _bulk_range_resolver()
+    for operation, positions in groups.items():
+        done = {}
+        if operation in OPERATIONS:
+            by_arity = {}
+            for i in positions:
+                args = _bulk_numeric_args(items[i])
+                if args is not None:
+                    by_arity.setdefault(len(args), []).append((i, args))
+            for indexed_args in by_arity.values():
+                if len(indexed_args) >= CALC_BULK_COLUMNAR_MIN_ITEMS:
+                    done.update(_bulk_columnar(operation, indexed_args))
+        for i in positions:
+            item_id = items[i].get('id', i)
+            if i in done:
+                results[i] = {'id': item_id, 'result': done[i]}
+            else:
+                body, status = evaluate_calc(items[i], resolve)
+                results[i] = _bulk_item_result(item_id, body, status)
+    return results
+
+
+@app.route('/calc/bulk', methods=['POST'])
+def calculate_bulk():
+    """Molti calcoli in una request: {"items": [{"id", "operation", "args"
+    | "columns" | payload di sumifs/lookup...}]} -> {"results": [{"id",
+    "result"} | {"id", "error", "status"}]}, nello stesso ordine."""
+    try:
+        data = request.get_json()
+        items = data.get('items')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    if not isinstance(items, list):
+        return jsonify({'error': 'items must be a list'}), 400
+    if len(items) > CALC_BULK_MAX_ITEMS:
+        return jsonify({'error': f'too many items: {len(items)} (max {CALC_BULK_MAX_ITEMS})'}), 400
+    results = evaluate_bulk(items)
+    return jsonify({
+        'results': results,
+        'count': len(results),
+        'errors': sum(1 for r in results if 'error' in r)
+    })
+
+
+def _register_range(range_id, data):
+    values = (data or {}).get('values')
+    if not isinstance(values, list):
+        return jsonify({'error': 'values must be a list'}), 400
+    try:
+        entry = range_registry.put(range_id or range_etag(values), values)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+    response = jsonify(range_info(entry))
+    response.headers['ETag'] = f'"{entry["etag"]}"'
+    return response
+
+
+@app.route('/ranges', methods=['POST'])
+def register_range_by_content():
+    """Registra un range con id = impronta del contenuto.
+
+    Payload: {"values": [...]}. Risposta: {"id", "etag", "size"}.
+    """
+    return _register_range(None, request.get_json())
+
+
+@app.route('/ranges/<range_id>', methods=['PUT'])
+def register_range(range_id):
+    """Registra (o aggiorna) un range con un id scelto dal client: un nome
+    ("Foglio1!N28:N4247") o un'impronta calcolata dal client.
+
+    Payload: {"values": [...]}. Ogni versione ha un etag diverso; /calc
+    puo' indicarlo ({"range_id", "etag"}) per rifiutare una versione vecchia.
+    """
+    return _register_range(range_id, request.get_json())
+
+
+@app.route('/ranges/<range_id>', methods=['GET'])
+def get_range(range_id):
+    entry = range_registry.get(range_id)
+    if entry is None:
+        return jsonify({'error': f'Range non registrato: {range_id}', 'range_id': range_id}), 404
+    response = jsonify(range_info(entry))
+    response.headers['ETag'] = f'"{entry["etag"]}"'
+    return response
+
+
+@app.route('/ranges/<range_id>', methods=['DELETE'])
+def delete_range(range_id):
+    if not range_registry.delete(range_id):
+        return jsonify({'error': f'Range non registrato: {range_id}', 'range_id': range_id}), 404
+    return jsonify({'deleted': range_id})
+
+
+@app.route('/ranges', methods=['GET'])
+def list_ranges():
+    return jsonify(range_registry.stats())
 
 # Mappa nomi funzione italiani -> inglesi (Google Sheets / Excel italiano)
 IT_TO_EN_FUNCTIONS = {
@@ -328,45 +1373,41 @@ IT_TO_EN_FUNCTIONS = {
 
 import re as _re
 
+# Regex unica costruita all'import: in un solo passaggio riconosce
+# - stringhe letterali "..." (lasciate intatte),
+# - nomi funzione italiani seguiti da "(" (alternative in ordine di lunghezza
+#   decrescente, es: SOMMA.PIU.SE prima di SOMMA),
+# - il separatore ";" (diventa ",").
+# Il lookbehind evita match dentro altri nomi (es: la E finale di MEDIA).
+_IT_FORMULA_TOKEN = _re.compile(
+    r'"[^"]*"?'
+    r'|(?<![A-Za-z0-9_.])('
+    + '|'.join(_re.escape(name) for name in sorted(IT_TO_EN_FUNCTIONS, key=len, reverse=True))
+    + r')\s*\('
+    r'|;',
+    _re.IGNORECASE,
+)
+
+
+def _translate_token(match):
+    name = match.group(1)
+    if name is not None:
+        return IT_TO_EN_FUNCTIONS[name.upper()] + '('
+    token = match.group(0)
+    return ',' if token == ';' else token
+
+
+@functools.lru_cache(maxsize=65536)
 def translate_formula_it_to_en(formula):
     """Traduce una formula dalla sintassi italiana a quella inglese.
     - Sostituisce nomi funzione IT -> EN
     - Sostituisce ; con , come separatore argomenti (fuori dalle stringhe)
+    Un solo passaggio di regex; i risultati sono memorizzati (LRU) perche'
+    le stesse formule si ripetono molte volte nello stesso foglio.
     """
     if not formula or not formula.startswith('='):
         return formula
-
-    result = formula
-
-    # Sostituisci nomi funzione (ordine decrescente per lunghezza
-    # per evitare sostituzioni parziali, es: SOMMA.PIU.SE prima di SOMMA)
-    sorted_funcs = sorted(IT_TO_EN_FUNCTIONS.keys(), key=len, reverse=True)
-    for it_name in sorted_funcs:
-        en_name = IT_TO_EN_FUNCTIONS[it_name]
-        # Cerca il nome funzione seguito da ( - case insensitive
-        pattern = _re.compile(_re.escape(it_name) + r'\s*\(', _re.IGNORECASE)
-        result = pattern.sub(en_name + '(', result)
-
-    # Sostituisci ; con , ma solo fuori dalle stringhe
-    translated = []
-    in_string = False
-    string_char = None
-    for ch in result:
-        if in_string:
-            translated.append(ch)
-            if ch == string_char:
-                in_string = False
-        else:
-            if ch == '"':
-                in_string = True
-                string_char = '"'
-                translated.append(ch)
-            elif ch == ';':
-                translated.append(',')
-            else:
-                translated.append(ch)
-
-    return ''.join(translated)
+    return _IT_FORMULA_TOKEN.sub(_translate_token, formula)
 
 
 def convert_formulas_value_(val):
@@ -404,6 +1445,47 @@ def convert_formulas_value_(val):
     return str(val)
 
 
+def build_excel_model(formulas_grid, values_grid, num_rows, num_cols):
+    """Costruisce un ExcelModel della libreria formulas direttamente in memoria,
+    senza salvare e rileggere un file .xlsx temporaneo.
+
+    Ritorna (xl_model, formula_count, positions), con positions =
+    {nodo del modello: (riga, colonna)} delle celle popolate, 0-based.
+    """
+    cells = {}
+    positions = {}
+    formula_count = 0
+    col_prefixes = [MODEL_CELL_PREFIX + openpyxl.utils.get_column_letter(c + 1)
+                    for c in range(num_cols)]
+
+    for r in range(num_rows):
+        formula_row = formulas_grid[r] if r < len(formulas_grid) else []
+        value_row = parse_values(values_grid[r])
+        row_n = str(r + 1)
+        for c in range(num_cols):
+            formula = formula_row[c] if c < len(formula_row) else ''
+
+            if formula:
+                # Traduci da italiano a inglese se necessario
+                value = translate_formula_it_to_en(formula)
+                formula_count += 1
+            else:
+                # Valore diretto (le celle vuote non vengono create)
+                value = value_row[c] if c < len(value_row) else None
+                if value is None:
+                    continue
+                # Stesso arrotondamento che formulas applica leggendo un .xlsx
+                if isinstance(value, float):
+                    value = round(value, 15)
+
+            ref = col_prefixes[c] + row_n
+            cells[ref] = value
+            positions[ref] = (r, c)
+
+    xl_model = formulas_lib.ExcelModel().from_dict(cells)
+    return xl_model, formula_count, positions
+
+
 @app.route('/eval_sheet', methods=['POST'])
 def eval_sheet():
     """Valuta un intero foglio: riceve formule + valori, restituisce risultati."""
@@ -412,7 +1494,6 @@ def eval_sheet():
             'error': 'Dipendenze mancanti. Installa con: pip install formulas openpyxl numpy'
         }), 501
 
-    tmp_path = None
     try:
         start = time.time()
         data = request.get_json()
@@ -429,76 +1510,22 @@ def eval_sheet():
         if num_rows == 0 or num_cols == 0:
             return jsonify({'error': 'Empty sheet'}), 400
 
-        # Crea workbook temporaneo con openpyxl
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'Model'
-
-        formula_count = 0
-
-        for r in range(num_rows):
-            for c in range(num_cols):
-                cell = ws.cell(row=r + 1, column=c + 1)
-
-                # Controlla se c'e' una formula
-                formula = ''
-                if r < len(formulas_grid) and c < len(formulas_grid[r]):
-                    formula = formulas_grid[r][c]
-
-                if formula:
-                    # Traduci da italiano a inglese se necessario
-                    cell.value = translate_formula_it_to_en(formula)
-                    formula_count += 1
-                else:
-                    # Valore diretto
-                    val = values_grid[r][c] if c < len(values_grid[r]) else None
-                    cell.value = parse_value(val)
-
-        # Salva su file temporaneo
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix='.xlsx')
-        os.close(tmp_fd)
-        wb.save(tmp_path)
-
-        # Calcola con la libreria formulas
-        xl_model = formulas_lib.ExcelModel().loads(tmp_path).finish()
+        # Costruisci il modello in memoria e calcola con la libreria formulas
+        xl_model, formula_count, positions = build_excel_model(
+            formulas_grid, values_grid, num_rows, num_cols)
         solution = xl_model.calculate()
 
-        # Costruisci un lookup normalizzato dalle chiavi della solution.
-        # La libreria formulas usa chiavi tipo "'[book.xlsx]Sheet'!A1"
-        # ma il formato esatto dipende dalla versione. Normalizziamo
-        # estraendo solo "SHEET!CELL" in uppercase per il matching.
-        import re
-        cell_pattern = re.compile(r"!([A-Z]+\d+)$", re.IGNORECASE)
-        sheet_pattern = re.compile(r"\](.+?)'!", re.IGNORECASE)
-
-        # Mappa: "SHEETNAME!CELLREF" -> valore
-        solution_map = {}
-        for key, val in solution.items():
-            cell_match = cell_pattern.search(str(key))
-            sheet_match = sheet_pattern.search(str(key))
-            if cell_match:
-                cell_name = cell_match.group(1).upper()
-                sheet_name = sheet_match.group(1).upper() if sheet_match else 'MODEL'
-                normalized_key = f"{sheet_name}!{cell_name}"
-                solution_map[normalized_key] = val
-
-        # Leggi risultati dalla soluzione
+        # Leggi risultati dalla soluzione: ogni nodo cella ha gia' la sua
+        # posizione nella griglia, nessuna normalizzazione delle chiavi.
+        # Le celle non popolate restano vuote.
         results = []
         for r in range(num_rows):
-            row = []
-            for c in range(num_cols):
-                col_letter = openpyxl.utils.get_column_letter(c + 1)
-                lookup_key = f"MODEL!{col_letter}{r + 1}"
-
-                if lookup_key in solution_map:
-                    val = solution_map[lookup_key]
-                    val = convert_formulas_value_(val)
-                    row.append(val)
-                else:
-                    # Cella senza formula: usa il valore originale
-                    val = values_grid[r][c] if c < len(values_grid[r]) else None
-                    row.append(parse_value(val) if val is not None else '')
+            row = [None if v == '' else '' for v in values_grid[r]]
+            row.extend([''] * (num_cols - len(row)))
             results.append(row)
+        for ref, (r, c) in positions.items():
+            if ref in solution:
+                results[r][c] = convert_formulas_value_(solution[ref])
 
         elapsed_ms = int((time.time() - start) * 1000)
 
@@ -506,10 +1533,12 @@ def eval_sheet():
         debug_info = {}
         if data.get('debug'):
             raw_keys = list(str(k) for k in solution.keys())
-            normalized_keys = list(solution_map.keys())
             debug_info = {
                 'raw_solution_keys': raw_keys[:50],
-                'normalized_keys': normalized_keys[:50],
+                'indexed_cells': [
+                    f"{MODEL_SHEET}!{openpyxl.utils.get_column_letter(c + 1)}{r + 1}"
+                    for r, c in list(positions.values())[:50]
+                ],
             }
 
         response_data = {
@@ -528,19 +1557,11 @@ def eval_sheet():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-    finally:
-        # Pulizia file temporaneo
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except OSError:
-                pass
-
 
 @app.route('/operations', methods=['GET'])
 def list_operations():
     """Elenca tutte le operazioni disponibili"""
-    ops = list(OPERATIONS.keys()) + ['sumifs']
+    ops = list(OPERATIONS.keys()) + list(CONDITIONAL_AGGREGATES) + list(LOOKUP_OPERATIONS)
     return jsonify({
         'operations': sorted(ops)
     })
@@ -548,7 +1569,7 @@ def list_operations():
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    return jsonify({'status': 'healthy', 'ranges': range_registry.stats()})
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
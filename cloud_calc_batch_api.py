@@ -10,28 +10,97 @@ Dipendenze:
 
 Avvio:  python cloud_calc_batch_api.py
 
+Le valutazioni vengono eseguite in un pool di processi worker pre-avviati
+(uno per core, configurabile con CLOUD_CALC_WORKERS; 0 = nel thread della
+request). CLOUD_CALC_MAX_PENDING limita le richieste in coda,
+CLOUD_CALC_TIMEOUT_S il tempo di calcolo per richiesta.
+
 Endpoint:
-    POST /eval_sheet  - valuta un intero foglio
-    GET  /health      - health check
-    GET  /operations  - lista operazioni disponibili
+    POST /eval_sheet        - valuta un intero foglio
+    POST /eval_sheet/delta  - ricalcola solo le celle a valle degli input modificati
+    POST /eval_sheet/session - valutazione a blocchi di righe per fogli grandi
+    GET  /health            - health check
+    GET  /operations        - lista operazioni disponibili
 """
 
 from __future__ import annotations
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import tempfile
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import base64
+import functools
+import gzip
+import hashlib
+import json
+import multiprocessing
 import os
+import threading
 import time
+import uuid
 import re
+import zlib
 
 import openpyxl
 import formulas as formulas_lib
+from formulas.cell import Cell, InvRangesAssembler, format_output
+from formulas.functions import replace_empty
+from formulas.tokens.operand import Error
+import schedula as sh
 import numpy as np
 
+from cloud_calc_values import parse_value, parse_values
+
+# Backend JSON piu' veloce, opzionale: pip install orjson
+# (senza, si usa il modulo json della libreria standard)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 CORS(app)
 
+# Nome del workbook/foglio virtuale in cui vengono caricate le celle.
+# Il modello viene costruito in memoria: nessun file .xlsx viene scritto.
+MODEL_BOOK = 'MODEL.XLSX'
+MODEL_SHEET = 'MODEL'
+MODEL_CELL_PREFIX = f"'[{MODEL_BOOK}]{MODEL_SHEET}'!"
+
+# Cache dei modelli compilati (riusati quando cambiano solo i valori di input)
+MODEL_CACHE_MAX_MODELS = 32        # numero massimo di modelli in cache
+MODEL_CACHE_MAX_CELLS = 500_000    # celle compilate totali in cache (limite memoria)
+
+# Formule tradotte IT -> EN memorizzate (LRU)
+TRANSLATE_CACHE_SIZE = 65_536
+
+# Pool di processi per /eval_sheet (0 = calcolo nel thread della request).
+# Ogni worker ha la sua cache dei modelli (limiti sopra, per worker).
+EVAL_WORKERS = int(os.environ.get('CLOUD_CALC_WORKERS', os.cpu_count() or 1))
+EVAL_MAX_PENDING = int(os.environ.get('CLOUD_CALC_MAX_PENDING', 4 * max(EVAL_WORKERS, 1)))
+EVAL_TIMEOUT_S = float(os.environ.get('CLOUD_CALC_TIMEOUT_S', 120))
+
+# Sessioni a blocchi (/eval_sheet/session): righe per blocco e scadenza
+SESSION_CHUNK_ROWS = 1_000         # righe per blocco consigliate al client
+SESSION_MAX_CHUNK_ROWS = 10_000    # righe massime per blocco caricato/scaricato
+SESSION_MAX_SESSIONS = 64
+SESSION_TTL_S = 15 * 60            # sessioni inattive rimosse dopo 15 minuti
+
+# Fogli con almeno queste celle popolate vengono divisi in blocchi
+# indipendenti calcolati su piu' worker (se il pool ne ha almeno 2)
+EVAL_SPLIT_MIN_CELLS = 5_000
+
+# Serializzazione: orjson se installato (CLOUD_CALC_JSON=json forza il
+# modulo standard). Le risposte piu' grandi di COMPRESS_MIN_BYTES vengono
+# compresse se il client accetta gzip/deflate.
+JSON_BACKEND = 'orjson' if orjson is not None and os.environ.get('CLOUD_CALC_JSON') != 'json' else 'json'
+COMPRESS_MIN_BYTES = 1_024
+COMPRESS_LEVEL = 5                         # velocita' prima della dimensione
+MAX_INFLATED_BYTES = 512 * 1024 * 1024     # body di richiesta decompresso
+
 # ---------------------------------------------------------------------------
 # Mappa nomi funzione italiani -> inglesi (Google Sheets / Excel italiano)
 # ---------------------------------------------------------------------------
@@ -121,93 +190,1582 @@ IT_TO_EN_FUNCTIONS = {
 # Helpers
 # ---------------------------------------------------------------------------
 
-def parse_value(value):
-    """Converte il valore nel tipo appropriato."""
-    if value is None or value == '':
-        return None
-    if isinstance(value, (int, float, bool)):
-        return value
-    s = str(value).strip()
-    if s.lower() == 'true':
-        return True
-    if s.lower() == 'false':
-        return False
-    try:
-        return float(s) if '.' in s else int(s)
-    except ValueError:
-        return s
+# Regex unica costruita all'import: in un solo passaggio riconosce
+# - stringhe letterali "..." (lasciate intatte),
+# - nomi funzione italiani seguiti da "(" (alternative in ordine di lunghezza
+#   decrescente, es: SOMMA.PIU.SE prima di SOMMA),
+# - il separatore ";" (diventa ",").
+# Il lookbehind evita match dentro altri nomi (es: la E finale di MEDIA).
+_IT_FORMULA_TOKEN = re.compile(
+    r'"[^"]*"?'
+    r'|(?<![A-Za-z0-9_.])('
+    + '|'.join(re.escape(name) for name in sorted(IT_TO_EN_FUNCTIONS, key=len, reverse=True))
+    + r')\s*\('
+    r'|;',
+    re.IGNORECASE,
+)
+
+
+def _translate_token(match):
+    name = match.group(1)
+    if name is not None:
+        return IT_TO_EN_FUNCTIONS[name.upper()] + '('
+    token = match.group(0)
+    return ',' if token == ';' else token
 
 
+@functools.lru_cache(maxsize=TRANSLATE_CACHE_SIZE)
 def translate_formula_it_to_en(formula):
     """Traduce una formula dalla sintassi italiana a quella inglese.
     - Sostituisce nomi funzione IT -> EN
     - Sostituisce ; con , come separatore argomenti (fuori dalle stringhe)
+    Un solo passaggio di regex; i risultati sono memorizzati (LRU) perche'
+    le stesse formule si ripetono molte volte nello stesso foglio.
     """
     if not formula or not formula.startswith('='):
         return formula
+    return _IT_FORMULA_TOKEN.sub(_translate_token, formula)
 
-    result = formula
-
-    # Sostituisci nomi funzione (ordine decrescente per lunghezza
-    # per evitare sostituzioni parziali, es: SOMMA.PIU.SE prima di SOMMA)
-    sorted_funcs = sorted(IT_TO_EN_FUNCTIONS.keys(), key=len, reverse=True)
-    for it_name in sorted_funcs:
-        en_name = IT_TO_EN_FUNCTIONS[it_name]
-        pattern = re.compile(re.escape(it_name) + r'\s*\(', re.IGNORECASE)
-        result = pattern.sub(en_name + '(', result)
-
-    # Sostituisci ; con , ma solo fuori dalle stringhe
-    translated = []
-    in_string = False
-    for ch in result:
-        if in_string:
-            translated.append(ch)
-            if ch == '"':
-                in_string = False
-        else:
-            if ch == '"':
-                in_string = True
-                translated.append(ch)
-            elif ch == ';':
-                translated.append(',')
-            else:
-                translated.append(ch)
 
-    return ''.join(translated)
+def convert_formulas_value(val):
+    """Converte i tipi della libreria formulas in tipi Python nativi serializzabili JSON.
+
+    Versione per un singolo valore; per molte celle usare convert_formulas_block.
+    """
+    return convert_formulas_block([val])[0]
 
 
-def convert_formulas_value(val):
-    """Converte i tipi della libreria formulas in tipi Python nativi serializzabili JSON."""
-    if val is None:
-        return ''
+# Conversione in blocco: ogni valore riceve un codice di tipo con una sola
+# passata (frompyfunc), poi ogni gruppo di tipo viene convertito con
+# operazioni NumPy sull'intero gruppo
+_KIND_BLANK, _KIND_FLOAT, _KIND_INT, _KIND_BOOL, _KIND_STR, _KIND_OTHER = range(6)
+
+_KIND_BY_TYPE = {
+    type(None): _KIND_BLANK,
+    type(sh.EMPTY): _KIND_BLANK,
+    float: _KIND_FLOAT, np.float64: _KIND_FLOAT, np.float32: _KIND_FLOAT, np.float16: _KIND_FLOAT,
+    int: _KIND_INT, np.int64: _KIND_INT, np.int32: _KIND_INT, np.int16: _KIND_INT, np.int8: _KIND_INT,
+    np.uint64: _KIND_INT, np.uint32: _KIND_INT, np.uint16: _KIND_INT, np.uint8: _KIND_INT,
+    bool: _KIND_BOOL, np.bool_: _KIND_BOOL,
+    str: _KIND_STR, np.str_: _KIND_STR,
+}
 
-    # Ranges object della libreria formulas -> prendi il primo valore
+_value_kind = np.frompyfunc(lambda v: _KIND_BY_TYPE.get(type(v), _KIND_OTHER), 1, 1)
+_value_str = np.frompyfunc(str, 1, 1)
+# int() per elemento: gli int Python oltre int64 e gli uint64 restano esatti
+_value_int = np.frompyfunc(int, 1, 1)
+
+# Float interi riportati a int solo dove la conversione e' esatta
+_FLOAT_INT_LIMIT = 2.0 ** 53
+
+
+def _unwrap_cell(val):
+    """Valore scalare di una cella: Ranges/array 1x1 -> elemento."""
     if hasattr(val, 'value'):
         val = val.value
-
-    # numpy array
     if isinstance(val, np.ndarray):
-        val = val.item() if val.size == 1 else val.tolist()
+        val = val.flat[0] if val.size == 1 else val.tolist()
+    return val
+
+
+def convert_formulas_block(values):
+    """Converte in blocco valori della libreria formulas in tipi JSON nativi.
+
+    `values` e' una sequenza (o array NumPy object) di valori di cella:
+    Ranges, array 1x1 o scalari. Ritorna una lista piatta della stessa
+    lunghezza:
+    - float interi finiti -> int (1.0 -> 1), altri float -> float
+    - interi e booleani NumPy -> int / bool Python
+    - celle vuote (None, EMPTY) -> ''
+    - errori Excel (#DIV/0!, #N/A, ...) e altri tipi -> testo
+    """
+    flat = np.empty(len(values), dtype=object)
+    flat[:] = [_unwrap_cell(v) for v in values]
+    kinds = _value_kind(flat).astype(np.int8) if len(flat) else np.empty(0, dtype=np.int8)
+    out = np.full(len(flat), '', dtype=object)
+
+    mask = kinds == _KIND_FLOAT
+    if mask.any():
+        floats = flat[mask].astype(np.float64)
+        collapse = np.isfinite(floats) & (np.floor(floats) == floats) \
+            & (np.abs(floats) < _FLOAT_INT_LIMIT)
+        converted = np.empty(len(floats), dtype=object)
+        converted[:] = floats.tolist()
+        converted[collapse] = floats[collapse].astype(np.int64).tolist()
+        out[mask] = converted
+
+    mask = kinds == _KIND_INT
+    if mask.any():
+        out[mask] = _value_int(flat[mask])
+
+    mask = kinds == _KIND_BOOL
+    if mask.any():
+        out[mask] = flat[mask].astype(bool).tolist()
+
+    # Testi (np.str_ -> str), errori Excel e altri tipi
+    mask = kinds >= _KIND_STR
+    if mask.any():
+        out[mask] = _value_str(flat[mask])
+
+    return out.tolist()
+
+
+def collect_cells(formulas_grid, values_grid, num_rows, num_cols):
+    """Separa la griglia in celle formula e celle valore, indicizzate per riferimento.
+
+    Ritorna (formula_cells, value_cells, positions):
+    - formula_cells: {ref: formula originale (non tradotta)}
+    - value_cells:   {ref: valore letterale gia' convertito}
+    - positions:     {ref: (riga, colonna)} delle celle popolate, 0-based
+    Le celle vuote non compaiono in nessuno dei dizionari.
+    """
+    formula_cells = {}
+    value_cells = {}
+    positions = {}
+
+    col_prefixes = [MODEL_CELL_PREFIX + openpyxl.utils.get_column_letter(c + 1)
+                    for c in range(num_cols)]
+
+    for r in range(num_rows):
+        formula_row = formulas_grid[r] if r < len(formulas_grid) else []
+        value_row = parse_values(values_grid[r])
+        row_n = str(r + 1)
+        for c in range(num_cols):
+            formula = formula_row[c] if c < len(formula_row) else ''
+            ref = col_prefixes[c] + row_n
+
+            if formula:
+                formula_cells[ref] = formula
+            else:
+                value = value_row[c] if c < len(value_row) else None
+                if value is None:
+                    continue
+                # Stesso arrotondamento applicato da formulas quando legge
+                # le celle numeriche da un file .xlsx
+                if isinstance(value, float):
+                    value = round(value, 15)
+                value_cells[ref] = value
+            positions[ref] = (r, c)
+
+    return formula_cells, value_cells, positions
+
+
+def collect_sparse_cells(formula_items, value_items):
+    """Come collect_cells, ma da liste sparse di triple [riga, colonna, contenuto].
+
+    Gli indici sono 0-based (come nelle griglie dense). Solo le celle
+    presenti vengono elaborate; se una posizione ha sia formula che valore
+    vince la formula.
+
+    Ritorna (formula_cells, value_cells, positions, num_rows, num_cols),
+    con positions = {ref: (riga, colonna)} per tutte le celle popolate.
+    """
+    formula_cells = {}
+    value_cells = {}
+    positions = {}
+    num_rows = num_cols = 0
+
+    for is_formula, items in ((True, formula_items), (False, value_items)):
+        for item in items:
+            if not isinstance(item, (list, tuple)) or len(item) != 3:
+                raise ValueError(f'Cella sparsa non valida: {item!r}')
+            r, c, content = item
+            if not isinstance(r, int) or not isinstance(c, int) or r < 0 or c < 0:
+                raise ValueError(f'Indici di cella non validi: {item!r}')
+
+            ref = f"{MODEL_CELL_PREFIX}{openpyxl.utils.get_column_letter(c + 1)}{r + 1}"
+            if is_formula:
+                if not content:
+                    continue
+                formula_cells[ref] = content
+            else:
+                if ref in formula_cells:
+                    continue
+                value = parse_value(content)
+                if value is None:
+                    continue
+                if isinstance(value, float):
+                    value = round(value, 15)
+                value_cells[ref] = value
+
+            positions[ref] = (r, c)
+            num_rows = max(num_rows, r + 1)
+            num_cols = max(num_cols, c + 1)
+
+    return formula_cells, value_cells, positions, num_rows, num_cols
+
+
+def parse_sheet_payload(data):
+    """Celle di un payload /eval_sheet, denso o sparso.
+
+    Ritorna (formula_cells, value_cells, positions, num_rows, num_cols, sparse);
+    ValueError se il payload non e' valido o il foglio e' vuoto.
+    """
+    formulas_grid = data.get('formulas', [])
+    values_grid = data.get('values', [])
+
+    if data.get('format') == 'sparse':
+        # Triple [riga, colonna, contenuto]: si elaborano solo le celle popolate
+        (formula_cells, value_cells, positions,
+         num_rows, num_cols) = collect_sparse_cells(formulas_grid, values_grid)
+        num_rows = max(num_rows, int(data.get('rows') or 0))
+        num_cols = max(num_cols, int(data.get('cols') or 0))
+        if not positions:
+            raise ValueError('Empty sheet')
+        return formula_cells, value_cells, positions, num_rows, num_cols, True
+
+    if not values_grid:
+        raise ValueError('values grid is required')
+
+    num_rows = len(values_grid)
+    num_cols = max(len(row) for row in values_grid) if values_grid else 0
+
+    if num_rows == 0 or num_cols == 0:
+        raise ValueError('Empty sheet')
+
+    formula_cells, value_cells, positions = collect_cells(
+        formulas_grid, values_grid, num_rows, num_cols)
+    return formula_cells, value_cells, positions, num_rows, num_cols, False
+
+
+def cell_index(positions):
+    """Indice delle celle popolate per la scrittura in blocco dei risultati.
+
+    Ritorna (refs, rows, cols): nodi del modello e loro coordinate 0-based
+    (array NumPy), nello stesso ordine.
+    """
+    refs = list(positions)
+    coords = np.array(list(positions.values()), dtype=np.int64).reshape(-1, 2)
+    return refs, coords[:, 0], coords[:, 1]
+
+
+def _indexed_values(solution, value_cells, refs):
+    """Valori JSON delle celle `refs`: dalla solution, altrimenti il letterale."""
+    return convert_formulas_block([
+        solution[ref] if ref in solution else value_cells.get(ref)
+        for ref in refs
+    ])
+
+
+def sparse_results(solution, value_cells, index):
+    """Risultati in formato sparso [riga, colonna, valore], solo celle popolate."""
+    refs, rows, cols = index
+    values = _indexed_values(solution, value_cells, refs)
+    return [list(t) for t in zip(rows.tolist(), cols.tolist(), values)]
+
+
+def blank_results_grid(values_grid, num_rows, num_cols):
+    """Griglia (object) dei risultati con le sole celle vuote: '' oppure None
+    dove il client ha inviato una stringa vuota, come parse_value."""
+    if all(len(row) == num_cols for row in values_grid):
+        raw = np.empty((num_rows, num_cols), dtype=object)
+        raw[:] = values_grid
+    else:
+        raw = np.full((num_rows, num_cols), None, dtype=object)
+        for r, value_row in enumerate(values_grid):
+            raw[r, :len(value_row)] = value_row
+    return np.where(raw == '', None, '').astype(object)
+
+
+def dense_results(solution, value_cells, index, values_grid, num_rows, num_cols):
+    """Griglia densa dei risultati: i valori della solution vengono convertiti
+    in blocco e scritti direttamente nelle posizioni indicizzate, senza
+    ricostruire il riferimento A1 di ogni cella.
+
+    Le celle non popolate restano vuote ('' oppure None se il client ha
+    inviato una stringa vuota, come parse_value).
+    """
+    grid = blank_results_grid(values_grid, num_rows, num_cols)
+    refs, rows, cols = index
+    values = np.empty(len(refs), dtype=object)
+    values[:] = _indexed_values(solution, value_cells, refs)
+    grid[rows, cols] = values
+    return grid.tolist()
+
+
+# Codifica "typed" dei risultati: le colonne solo numeriche viaggiano come
+# array binari in base64 invece che come liste di numeri JSON
+RESULT_ENCODINGS = ('json', 'typed')
+
+
+def _b64_array(array, dtype):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=dtype).tobytes()).decode('ascii')
+
+
+def typed_column(values):
+    """Colonna di risultati per la codifica "typed".
+
+    Se la colonna contiene solo numeri e celle vuote diventa
+    {"dtype": "f8", "data": base64 di float64 little-endian}: le celle vuote
+    sono NaN e "blank" indica il loro valore ('' oppure null). Altrimenti
+    (testi, booleani, vuote miste, interi oltre 2^53) resta una lista JSON.
+    """
+    col = np.empty(len(values), dtype=object)
+    col[:] = list(values)
+    if not len(col):
+        return []
+    kinds = _value_kind(col).astype(np.int8)
+    numeric = (kinds == _KIND_FLOAT) | (kinds == _KIND_INT)
+    if not numeric.any():
+        return col.tolist()
+    blank = ~numeric
+    blank_value = None
+    if blank.any():
+        if (kinds[blank] == _KIND_BLANK).all():
+            blank_value = None
+        elif (col[blank] == '').all():
+            blank_value = ''
+        else:
+            return col.tolist()
+    data = np.full(len(col), np.nan)
+    data[numeric] = col[numeric].astype(np.float64)
+    numbers = data[numeric]
+    if np.isnan(numbers).any() or (np.abs(numbers[np.isfinite(numbers)]) >= _FLOAT_INT_LIMIT).any():
+        return col.tolist()
+    column = {'dtype': 'f8', 'data': _b64_array(data, '<f8')}
+    if blank.any():
+        column['blank'] = blank_value
+    return column
+
+
+def encode_typed_results(results, sparse):
+    """Risultati di /eval_sheet nella codifica "typed".
+
+    - denso:  {"columns": [colonna, ...]}, una typed_column per colonna
+    - sparso: {"rows": ..., "cols": ..., "values": typed_column}, con righe
+      e colonne come {"dtype": "i4", "data": base64 di int32 little-endian}
+    """
+    if sparse:
+        rows, cols, values = zip(*results) if results else ((), (), ())
+        return {
+            'rows': {'dtype': 'i4', 'data': _b64_array(rows, '<i4')},
+            'cols': {'dtype': 'i4', 'data': _b64_array(cols, '<i4')},
+            'values': typed_column(values),
+        }
+    if not results:
+        return {'columns': []}
+    grid = np.empty((len(results), len(results[0])), dtype=object)
+    grid[:] = results
+    return {'columns': [typed_column(grid[:, c]) for c in range(grid.shape[1])]}
+
+
+def model_fingerprint(formula_cells, value_cells, num_rows, num_cols):
+    """Impronta della struttura del modello: forma, formule e posizione delle celle valore.
+
+    I valori letterali non entrano nell'impronta (vengono riassegnati a ogni
+    calcolo), ma la loro posizione si': una cella vuota non diventa un nodo
+    del modello compilato, quindi riempirla richiede un nuovo modello.
+    Fanno eccezione i testi "=..." che from_dict compila come formule.
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps([num_rows, num_cols, formula_cells]).encode('utf-8'))
+    h.update('|'.join(value_cells).encode('utf-8'))
+    formula_literals = {ref: v for ref, v in value_cells.items() if is_formula_literal(v)}
+    if formula_literals:
+        h.update(json.dumps(formula_literals).encode('utf-8'))
+    return h.hexdigest()
+
+
+def build_excel_model(formula_cells, value_cells):
+    """Costruisce un ExcelModel della libreria formulas direttamente in memoria.
+
+    Le celle vengono passate a ``ExcelModel.from_dict`` senza passare da
+    openpyxl + file .xlsx temporaneo (serializza/zip/unzip/parse).
+    Le celle vuote non vengono create: i riferimenti a celle mancanti
+    vengono risolti come celle vuote dalla libreria, come con il file.
+    """
+    cells = {ref: translate_formula_it_to_en(f) for ref, f in formula_cells.items()}
+    cells.update(value_cells)
+    return formulas_lib.ExcelModel().from_dict(cells)
+
+
+# ---------------------------------------------------------------------------
+# Formule ripetute: forme R1C1 compilate una volta
+# ---------------------------------------------------------------------------
+#
+# Le formule copiate in basso (=B2*C2, =B3*C3, ...) hanno la stessa forma
+# relativa, in stile R1C1: =R[0]C[-2]*R[0]C[-1]. Ogni forma viene tradotta e
+# compilata una sola volta (sulla prima cella del gruppo); le celle della
+# forma vengono calcolate fuori dal modello, a onde in ordine di dipendenza,
+# e passate al modello come valori letterali. Le forme fatte solo di
+# operatori e funzioni cella-per-cella su singole celle vengono calcolate
+# con una sola chiamata su colonne NumPy per tutto il gruppo.
+# Le formule che non rientrano (altri fogli, riferimenti circolari,
+# funzioni legate alla posizione) restano formule del modello.
+
+# Funzioni legate alla posizione della cella o volatili: la forma compilata
+# sulla prima cella non vale per le altre
+SHAPE_CONTEXT_FUNCTIONS = frozenset({
+    'ROW', 'COLUMN', 'OFFSET', 'INDIRECT', 'CELL', 'INFO',
+    'RAND', 'RANDBETWEEN', 'NOW', 'TODAY',
+})
+
+# Funzioni elemento per elemento: su colonne danno colonne, come cella per cella
+SHAPE_VECTOR_FUNCTIONS = frozenset({
+    'IF', 'IFERROR', 'IFNA', 'NOT',
+    'ABS', 'ROUND', 'ROUNDUP', 'ROUNDDOWN', 'INT', 'TRUNC', 'SIGN', 'MOD',
+    'SQRT', 'EXP', 'LN', 'LOG10', 'POWER',
+    'ISNUMBER', 'ISTEXT', 'ISBLANK', 'ISERROR', 'ISERR', 'ISNA',
+    'LEN', 'UPPER', 'LOWER', 'TRIM', 'LEFT', 'RIGHT', 'MID', 'CONCATENATE',
+})
+
+# Limite (in celle) della griglia di valori usata per calcolare le forme
+SHAPE_MAX_GRID_CELLS = 5_000_000
+
+# Stringhe letterali (saltate), riferimenti ad altri fogli (' o !) e
+# riferimenti A1 / range A1:B2, con $ opzionali
+_SHAPE_TOKEN = re.compile(
+    r'"[^"]*"?'
+    r"|(?P<sheet>[!'])"
+    r'|(?<![A-Za-z0-9_.$])'
+    r'(?P<ca1>\$?)(?P<col1>[A-Za-z]{1,3})(?P<ra1>\$?)(?P<row1>[0-9]+)'
+    r'(?::(?P<ca2>\$?)(?P<col2>[A-Za-z]{1,3})(?P<ra2>\$?)(?P<row2>[0-9]+))?'
+    r'(?![A-Za-z0-9_.(!$])'
+)
+
+_SHAPE_FUNCTION = re.compile(r'"[^"]*"?|([A-Za-z][A-Za-z0-9_.]*)\s*\(')
+
+# Parser della libreria: riconosce i testi letterali che from_dict compila come formule
+_LITERAL_PARSER = formulas_lib.Parser()
+
+
+def _shape_corner(match, n, row, col):
+    """Coordinate 0-based di un angolo del riferimento e frammento R1C1."""
+    r = int(match.group(f'row{n}')) - 1
+    c = openpyxl.utils.column_index_from_string(match.group(f'col{n}').upper()) - 1
+    abs_r = bool(match.group(f'ra{n}'))
+    abs_c = bool(match.group(f'ca{n}'))
+    text = (f'R{r}' if abs_r else f'R[{r - row}]') + (f'C{c}' if abs_c else f'C[{c - col}]')
+    return r, c, (abs_r, abs_c), text
+
+
+def formula_shape(formula, row, col):
+    """Forma relativa (stile R1C1) di una formula nella cella (row, col), 0-based.
+
+    Ritorna (chiave, riferimenti): la chiave e' il testo della formula con i
+    riferimenti A1 riscritti come offset (relativi) o coordinate ($ assoluti);
+    riferimenti = [(r1, c1, r2, c2, flag $), ...] nell'ordine del testo.
+    Formule con riferimenti ad altri fogli ritornano (None, None).
+    """
+    if not formula.startswith('='):
+        return None, None
+    parts = []
+    refs = []
+    last = 0
+    for m in _SHAPE_TOKEN.finditer(formula):
+        if m.group('col1') is None:
+            if m.group('sheet'):
+                return None, None
+            continue
+        try:
+            r1, c1, flags1, text = _shape_corner(m, 1, row, col)
+            r2, c2, flags2 = r1, c1, flags1
+            if m.group('col2') is not None:
+                r2, c2, flags2, text2 = _shape_corner(m, 2, row, col)
+                if (r2, c2) != (r1, c1):
+                    text += ':' + text2
+        except ValueError:
+            return None, None
+        parts.append(formula[last:m.start()])
+        parts.append(text)
+        last = m.end()
+        refs.append((r1, c1, r2, c2, flags1 + flags2))
+    parts.append(formula[last:])
+    return ''.join(parts), refs
+
+
+def _shape_ref_name(r1, c1, r2, c2):
+    name = f'{openpyxl.utils.get_column_letter(c1 + 1)}{r1 + 1}'
+    if (r1, c1) != (r2, c2):
+        name += f':{openpyxl.utils.get_column_letter(c2 + 1)}{r2 + 1}'
+    return name
+
+
+def compile_shape(formula, ref, refs):
+    """Compila una forma sulla sua prima cella (`ref`, formula gia' in inglese).
+
+    Ritorna None se la forma non si puo' riusare sulle altre celle del gruppo;
+    altrimenti {'func', 'inputs', 'vector'}, con inputs = indici in `refs`
+    dei riferimenti, nell'ordine degli argomenti della funzione compilata.
+    """
+    names = {}
+    for i, (r1, c1, r2, c2, flags) in enumerate(refs):
+        if r1 > r2 or c1 > c2:
+            return None  # range "al contrario" (B3:A1)
+        name = _shape_ref_name(r1, c1, r2, c2)
+        if name in names and refs[names[name]][4] != flags:
+            return None  # stessa cella con $ diversi: diverge sulle altre righe
+        names.setdefault(name, i)
+
+    functions = {m.group(1).upper() for m in _SHAPE_FUNCTION.finditer(formula) if m.group(1)}
+    if functions & SHAPE_CONTEXT_FUNCTIONS:
+        return None
+
+    try:
+        cell = Cell(ref, formula).compile()
+    except Exception:
+        return None  # l'errore (se c'e') emerge dal modello, come prima
+    if cell.func is None:
+        return None
+
+    inputs = []
+    for key in cell.func.inputs:
+        if not isinstance(key, str) or not key.startswith(MODEL_CELL_PREFIX):
+            return None
+        i = names.get(key[len(MODEL_CELL_PREFIX):])
+        if i is None:
+            return None
+        inputs.append(i)
+    if len(inputs) != len(names):
+        return None  # riferimenti che la libreria non vede come input (es: intersezioni)
+
+    vector = ('{' not in formula
+              and functions <= SHAPE_VECTOR_FUNCTIONS
+              and all(r[:2] == r[2:4] for r in refs))
+    # Funzione compilata senza il wrapper di cella: accetta array e Ranges
+    return {'func': cell.func.__wrapped__, 'inputs': inputs, 'vector': vector}
+
+
+def build_shape_plan(formula_cells, value_cells, positions, num_rows, num_cols):
+    """Raggruppa le formule per forma R1C1 e prepara il calcolo fuori dal modello.
+
+    Il piano dipende solo dalla struttura del foglio (formule e posizione dei
+    valori), quindi viene conservato nell'entry della cache insieme al modello.
+    Ritorna {'batches', 'grid_shape', 'literal_positions', 'formula_shapes',
+    'shape_cells', 'vectorized_cells'}; i batch sono in ordine di dipendenza
+    e ogni batch contiene celle della stessa forma calcolabili insieme.
+    """
+    refs = list(formula_cells)
+    count = len(refs)
+    shape_ids = [-1] * count
+    cell_refs = [None] * count
+    shapes = []
+    shape_keys = {}
+    formula_shapes = 0
+
+    for i, ref in enumerate(refs):
+        row, col = positions[ref]
+        key, tokens = formula_shape(formula_cells[ref], row, col)
+        if key is None:
+            formula_shapes += 1
+            continue
+        sid = shape_keys.get(key)
+        if sid is None:
+            sid = shape_keys[key] = len(shapes)
+            shapes.append(compile_shape(
+                translate_formula_it_to_en(formula_cells[ref]), ref, tokens))
+        if shapes[sid] is not None:
+            shape_ids[i] = sid
+            cell_refs[i] = tokens
+    formula_shapes += len(shape_keys)
+
+    # Griglia dei valori: il foglio piu' le celle vuote referenziate oltre il bordo
+    grid_rows, grid_cols = num_rows, num_cols
+    for tokens in cell_refs:
+        for r1, c1, r2, c2, _ in tokens or ():
+            grid_rows = max(grid_rows, r2 + 1)
+            grid_cols = max(grid_cols, c2 + 1)
+    if grid_rows * grid_cols > SHAPE_MAX_GRID_CELLS:
+        grid_rows, grid_cols = num_rows, num_cols
+        for i, tokens in enumerate(cell_refs):
+            if tokens and any(r2 >= num_rows or c2 >= num_cols for _, _, r2, c2, _ in tokens):
+                shape_ids[i] = -1
+    if grid_rows * grid_cols > SHAPE_MAX_GRID_CELLS:
+        shape_ids = [-1] * count
+
+    plan = {
+        'batches': [],
+        'grid_shape': (grid_rows, grid_cols),
+        'literal_positions': {ref: positions[ref] for ref in value_cells},
+        'formula_shapes': formula_shapes,
+        'shape_cells': 0,
+        'vectorized_cells': 0,
+    }
+    if all(sid < 0 for sid in shape_ids):
+        return plan
+
+    # Dipendenze tra formule tramite la griglia degli indici formula. I testi
+    # letterali "=..." sono formule per il modello: l'indice `count` non
+    # viene mai calcolato, quindi le forme che li leggono restano al modello
+    formula_index = np.full((grid_rows, grid_cols), -1, dtype=np.int64)
+    for ref, value in value_cells.items():
+        if is_formula_literal(value):
+            formula_index[positions[ref]] = count
+    for i, ref in enumerate(refs):
+        formula_index[positions[ref]] = i
+
+    range_deps = {}
+    waiting = [0] * count
+    dependents = {}
+    for i in range(count):
+        if shape_ids[i] < 0:
+            continue
+        deps = set()
+        for r1, c1, r2, c2, _ in cell_refs[i]:
+            if (r1, c1) == (r2, c2):
+                j = int(formula_index[r1, c1])
+                if j >= 0:
+                    deps.add(j)
+                continue
+            rng = (r1, c1, r2, c2)
+            found = range_deps.get(rng)
+            if found is None:
+                block = formula_index[r1:r2 + 1, c1:c2 + 1]
+                found = range_deps[rng] = np.unique(block[block >= 0]).tolist()
+            deps.update(found)
+        waiting[i] = len(deps)
+        for j in deps:
+            dependents.setdefault(j, []).append(i)
+
+    # Onde in ordine topologico (Kahn): le celle che dipendono da formule
+    # rimaste al modello, o in un ciclo, non arrivano mai a zero
+    wave = [i for i in range(count) if shape_ids[i] >= 0 and waiting[i] == 0]
+    while wave:
+        groups = {}
+        for i in wave:
+            groups.setdefault(shape_ids[i], []).append(i)
+        for sid, members in groups.items():
+            shape = shapes[sid]
+            args = [[cell_refs[i][k][:4] for k in shape['inputs']] for i in members]
+            batch = {
+                'shape': shape,
+                'refs': [refs[i] for i in members],
+                'rows': np.array([positions[refs[i]][0] for i in members], dtype=np.int64),
+                'cols': np.array([positions[refs[i]][1] for i in members], dtype=np.int64),
+                'args': args,
+            }
+            if shape['vector']:
+                # Indici di riga/colonna per argomento: un'unica lettura dalla griglia
+                batch['gather'] = [
+                    (np.array([a[k][0] for a in args], dtype=np.int64),
+                     np.array([a[k][1] for a in args], dtype=np.int64))
+                    for k in range(len(shape['inputs']))
+                ]
+                plan['vectorized_cells'] += len(members)
+            plan['batches'].append(batch)
+            plan['shape_cells'] += len(members)
+        next_wave = []
+        for i in wave:
+            for j in dependents.get(i, ()):
+                waiting[j] -= 1
+                if waiting[j] == 0:
+                    next_wave.append(j)
+        wave = next_wave
+
+    return plan
+
+
+def model_literal(value):
+    """Valore di una cella letterale come lo legge il modello (from_dict).
+
+    I testi di errore ("#N/A", "#DIV/0!", ...) diventano errori Excel; gli
+    altri valori restano invariati.
+    """
+    if isinstance(value, str):
+        match = Error._re.match(value)
+        if match:
+            return Error.errors[match.group('name').upper()]
+    return value
+
+
+def is_formula_literal(value):
+    """True per i testi letterali che from_dict compila come formule ("=...")."""
+    return (isinstance(value, str) and Error._re.match(value) is None
+            and _LITERAL_PARSER.is_formula(value) is not None)
+
+
+def model_inputs(value_cells):
+    """Valori letterali come input di ExcelModel.calculate per un modello in cache.
+
+    Stessa conversione di from_dict (model_literal); i testi "=..." sono
+    formule del modello e non vengono riassegnati.
+    """
+    return {ref: model_literal(value) for ref, value in value_cells.items()
+            if not is_formula_literal(value)}
+
+
+def _object_column(count, value):
+    """Array object di `count` copie di `value` (np.full convertirebbe i
+    Token della libreria, come sh.EMPTY o gli errori, in stringhe semplici)."""
+    column = np.empty(count, dtype=object)
+    column.fill(value)
+    return column
+
+
+def shape_grid(plan, value_cells):
+    """Griglia (object) dei valori letterali su cui vengono calcolate le forme.
+
+    Come nel modello: celle vuote (anche oltre il bordo del foglio) a
+    sh.EMPTY, testi di errore come errori Excel.
+    """
+    grid = np.empty(plan['grid_shape'], dtype=object)
+    grid.fill(sh.EMPTY)
+    for ref, pos in plan['literal_positions'].items():
+        grid[pos] = model_literal(value_cells[ref])
+    return grid
+
+
+def _run_vector_batch(batch, grid, members):
+    """Calcola un batch vettoriale con una chiamata; None se il risultato non e' una colonna."""
+    count = len(members)
+    args = [grid[rows[members], cols[members]].reshape(count, 1)
+            for rows, cols in batch['gather']]
+    res = replace_empty(batch['shape']['func'](*args))
+    if isinstance(res, formulas_lib.Ranges):
+        res = res.value
+    res = np.asarray(res, dtype=object)
+    if res.shape == (count, 1):
+        return res[:, 0]
+    if res.size == 1:
+        return _object_column(count, res.flat[0])
+    return None
+
+
+def _run_cell(batch, index, grid):
+    """Calcola una singola cella del batch con la funzione compilata della forma."""
+    args = []
+    for r1, c1, r2, c2 in batch['args'][index]:
+        args.append(formulas_lib.Ranges().push(
+            MODEL_CELL_PREFIX + _shape_ref_name(r1, c1, r2, c2),
+            grid[r1:r2 + 1, c1:c2 + 1]))
+    res = replace_empty(batch['shape']['func'](*args))
+    # Come il modello: valore riportato sulla forma (1x1) della cella
+    rng = formulas_lib.Ranges.get_range(batch['refs'][index])
+    return format_output(rng, res).value[0, 0]
+
+
+def run_shape_plan(plan, grid, dirty=None):
+    """Esegue il piano delle forme sulla griglia; ritorna {ref: valore calcolato}.
+
+    I risultati vengono scritti anche nella griglia, come input delle onde
+    successive. Con `dirty` (maschera booleana delle celle cambiate) vengono
+    ricalcolate solo le celle che leggono celle cambiate (/eval_sheet/delta).
+    """
+    results = {}
+    for batch in plan['batches']:
+        count = len(batch['refs'])
+        if dirty is None:
+            members = np.arange(count)
+        elif 'gather' in batch:
+            mask = np.zeros(count, dtype=bool)
+            for rows, cols in batch['gather']:
+                mask |= dirty[rows, cols]
+            members = np.flatnonzero(mask)
+        else:
+            members = np.array([
+                m for m in range(count)
+                if any(dirty[r1:r2 + 1, c1:c2 + 1].any() for r1, c1, r2, c2 in batch['args'][m])
+            ], dtype=np.int64)
+        if not len(members):
+            continue
+
+        values = _run_vector_batch(batch, grid, members) if 'gather' in batch else None
+        if values is None:
+            values = np.empty(len(members), dtype=object)
+            for n, m in enumerate(members):
+                values[n] = _run_cell(batch, m, grid)
+
+        rows, cols = batch['rows'][members], batch['cols'][members]
+        grid[rows, cols] = values
+        if dirty is not None:
+            dirty[rows, cols] = True
+        refs = batch['refs']
+        for m, value in zip(members.tolist(), values.tolist()):
+            results[refs[m]] = value
+    return results
+
+
+def shape_literal(value):
+    """Valore calcolato di una forma come cella letterale per ``from_dict``.
+
+    Le stringhe vengono incapsulate in [[...]]: testi come "=..." o "#N/A"
+    sarebbero altrimenti riletti dalla libreria come formule.
+    """
+    return [[value]] if isinstance(value, str) else value
+
+
+# ---------------------------------------------------------------------------
+# Cache dei modelli compilati
+# ---------------------------------------------------------------------------
+
+class ModelCache:
+    """Cache LRU dei modelli compilati, indicizzata per impronta del modello.
+
+    Il limite di memoria e' espresso in celle compilate (formule + valori):
+    quando il totale supera max_cells, o i modelli superano max_models,
+    vengono rimossi i modelli usati meno di recente.
+    """
+
+    def __init__(self, max_models=MODEL_CACHE_MAX_MODELS, max_cells=MODEL_CACHE_MAX_CELLS):
+        self.max_models = max_models
+        self.max_cells = max_cells
+        self._lock = threading.Lock()
+        self._models: OrderedDict[str, dict] = OrderedDict()   # key -> entry
+        self._cells = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> dict | None:
+        """Ritorna l'entry del modello (e la marca come usata di recente) o None."""
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._models.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: dict):
+        """Inserisce un modello ed esegue l'eviction LRU se si superano i limiti."""
+        if entry['cells'] > self.max_cells:
+            return  # troppo grande per la cache: non viene conservato
+        with self._lock:
+            old = self._models.pop(key, None)
+            if old is not None:
+                self._cells -= old['cells']
+            self._models[key] = entry
+            self._cells += entry['cells']
+            while self._models and (len(self._models) > self.max_models
+                                    or self._cells > self.max_cells):
+                _, evicted = self._models.popitem(last=False)
+                self._cells -= evicted['cells']
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'models': len(self._models),
+                'cells': self._cells,
+            }
+
+
+# Singleton
+model_cache = ModelCache()
+
+
+# ---------------------------------------------------------------------------
+# Ricalcolo incrementale (/eval_sheet/delta)
+# ---------------------------------------------------------------------------
+
+_A1_CELL_PATTERN = re.compile(r'^[A-Z]+[0-9]+$')
+
+
+def downstream_nodes(dsp, changed_refs):
+    """Nodi dato a valle delle celle modificate e funzioni che li calcolano.
+
+    Gli InvRangesAssembler (range -> singole celle) vengono saltati: ridanno
+    le celle di input da cui il range e' stato costruito, non nuovi valori.
+    Ritorna (data_nodes, function_nodes).
+    """
+    succ = dsp.dmap.succ
+    nodes = dsp.nodes
+    data_nodes = set()
+    function_nodes = set()
+    stack = list(changed_refs)
+    while stack:
+        node = stack.pop()
+        for fn in succ.get(node, ()):
+            if fn in function_nodes:
+                continue
+            if isinstance(nodes[fn].get('function'), InvRangesAssembler):
+                continue
+            function_nodes.add(fn)
+            for out in succ[fn]:
+                if out not in data_nodes:
+                    data_nodes.add(out)
+                    stack.append(out)
+    return data_nodes, function_nodes
+
+
+def recalculate_delta(entry, changed):
+    """Ricalcola solo le celle a valle di `changed` ({ref: valore}).
+
+    I nodi a monte non toccati vengono passati come input con il valore
+    della solution precedente, e il dispatcher viene ristretto (shrink)
+    alle sole funzioni interessate.
+    Ritorna (solution aggiornata, nodi ricalcolati).
+    """
+    dsp = entry['xl_model'].dsp
+    previous = entry['solution']
+    targets, functions = downstream_nodes(dsp, changed)
+
+    inputs = {}
+    pred = dsp.dmap.pred
+    for fn in functions:
+        for node in pred[fn]:
+            if node not in targets and node not in changed and node in previous:
+                inputs[node] = previous[node]
+    inputs.update(changed)
+
+    solution = dict(previous)
+    solution.update(changed)
+    if targets:
+        partial = dsp.dispatch(inputs=inputs, outputs=list(targets), shrink=True)
+        if not all(node in partial for node in targets):
+            # Grafo non ricostruibile parzialmente: ricalcolo completo
+            all_inputs = model_inputs(entry['inputs'])
+            all_inputs.update(entry['shape_values'])
+            all_inputs.update(changed)
+            return dict(entry['xl_model'].calculate(inputs=all_inputs)), targets
+        solution.update((node, partial[node]) for node in targets)
+    return solution, targets
+
+
+# ---------------------------------------------------------------------------
+# Pool di processi worker
+# ---------------------------------------------------------------------------
+#
+# Il calcolo con formulas e' Python puro: nei thread di Flask le richieste
+# concorrenti si serializzano sul GIL. Le valutazioni vengono quindi
+# eseguite in processi worker pre-avviati. Ogni worker e' un executor a un
+# solo processo, cosi' un foglio torna sempre allo stesso worker (routing
+# per formule) e trova li' il suo modello compilato in cache, anche per
+# /eval_sheet/delta.
+
+def _warm_worker():
+    """Avvio del worker: import e primo modello gia' pronti prima delle richieste."""
+    build_excel_model({MODEL_CELL_PREFIX + 'A1': '=SUM(B1:B2)'},
+                      {MODEL_CELL_PREFIX + 'B1': 1}).calculate()
+    return os.getpid()
+
+
+def _run_in_worker(fn, data):
+    """Esegue fn(data) nel worker; ritorna anche inizio e fine del calcolo."""
+    started = time.time()
+    payload, status = fn(data)
+    return payload, status, started, time.time()
+
+
+def sheet_route_key(data):
+    """Chiave di routing di un foglio: le sole formule (stesse formule -> stesso worker)."""
+    return json.dumps(data.get('formulas', []))
+
+
+class PoolBusy(Exception):
+    """Troppe valutazioni in attesa nel pool."""
+
+
+class EvalPool:
+    """Pool di processi worker con coda limitata e timeout per richiesta.
+
+    Al piu' max_pending valutazioni (in corso + in coda) alla volta: oltre,
+    la richiesta viene rifiutata subito (503). Un worker che supera il
+    timeout viene terminato e riavviato; i suoi modelli in cache si perdono.
+    Con workers=0 il calcolo avviene nel thread della request.
+    """
+
+    def __init__(self, workers=EVAL_WORKERS, max_pending=EVAL_MAX_PENDING,
+                 timeout=EVAL_TIMEOUT_S):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executors: list[ProcessPoolExecutor | None] = [None] * workers
+        self._routes: OrderedDict[str, int] = OrderedDict()   # model_id -> worker
+        self._max_routes = MODEL_CACHE_MAX_MODELS * max(workers, 1)
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    def _executor(self, worker: int) -> ProcessPoolExecutor:
+        with self._lock:
+            executor = self._executors[worker]
+            if executor is None:
+                executor = ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+                self._executors[worker] = executor
+            return executor
+
+    def start(self):
+        """Avvia tutti i worker e attende che siano pronti."""
+        futures = [self._executor(i).submit(_warm_worker) for i in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def _restart(self, worker: int, executor: ProcessPoolExecutor):
+        """Termina il worker (es: calcolo oltre il timeout) e ne avvia uno nuovo.
+
+        Non fa nulla se `executor` e' gia' stato sostituito (riavvio gia' fatto).
+        """
+        with self._lock:
+            if self._executors[worker] is not executor:
+                return
+            self._executors[worker] = None
+            for model_id in [m for m, w in self._routes.items() if w == worker]:
+                del self._routes[model_id]
+            self.restarts += 1
+        # ProcessPoolExecutor non ha un terminate pubblico
+        for proc in list((getattr(executor, '_processes', None) or {}).values()):
+            proc.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Il nuovo worker si avvia subito, non alla prossima richiesta
+        self._executor(worker).submit(_warm_worker)
+
+    def close(self):
+        """Chiude tutti i worker."""
+        with self._lock:
+            executors, self._executors = self._executors, [None] * self.workers
+            self._routes.clear()
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def worker_for(self, route_key: str) -> int:
+        if self.workers == 0:
+            return 0
+        digest = hashlib.sha1(route_key.encode('utf-8')).digest()
+        return int.from_bytes(digest[:4], 'big') % self.workers
+
+    def remember(self, model_id: str, worker: int):
+        """Registra il worker che ha in cache il modello (per /eval_sheet/delta)."""
+        with self._lock:
+            self._routes[model_id] = worker
+            self._routes.move_to_end(model_id)
+            while len(self._routes) > self._max_routes:
+                self._routes.popitem(last=False)
+
+    def worker_for_model(self, model_id: str) -> int | None:
+        if self.workers == 0:
+            return 0
+        with self._lock:
+            return self._routes.get(model_id)
+
+    def run(self, fn, data, worker: int):
+        """Esegue fn(data) sul worker; ritorna (risposta, status HTTP).
+
+        In stats.pool della risposta: worker, attesa in coda e tempo di calcolo.
+        """
+        return self.run_many(fn, [(data, worker)])[0]
+
+    def run_many(self, fn, jobs):
+        """Esegue fn(data) per ogni (data, worker) di `jobs`, in parallelo.
+
+        Ritorna la lista dei (risposta, status HTTP), nello stesso ordine.
+        Le valutazioni occupano un posto in coda ciascuna: se non ci sono
+        posti per tutte, nessuna viene eseguita (503).
+        """
+        acquired = 0
+        while acquired < len(jobs) and self._slots.acquire(blocking=False):
+            acquired += 1
+        if acquired < len(jobs):
+            for _ in range(acquired):
+                self._slots.release()
+            with self._lock:
+                self.rejected += 1
+            return [({'error': 'Server occupato, riprova tra poco', 'retry': True}, 503)] * len(jobs)
+
+        outputs = []
+        try:
+            submitted = time.time()
+            pending = []
+            for data, worker in jobs:
+                if self.workers == 0:
+                    pending.append((None, None))
+                else:
+                    executor = self._executor(worker)
+                    pending.append((executor, executor.submit(_run_in_worker, fn, data)))
+            deadline = submitted + self.timeout
+            for (data, worker), (executor, future) in zip(jobs, pending):
+                outputs.append(self._collect(
+                    fn, data, worker, executor, future, submitted, deadline))
+        finally:
+            for _ in jobs:
+                self._slots.release()
+        return outputs
+
+    def _collect(self, fn, data, worker, executor, future, submitted, deadline):
+        if future is None:
+            payload, status, started, finished = _run_in_worker(fn, data)
+        else:
+            try:
+                payload, status, started, finished = future.result(
+                    timeout=max(deadline - time.time(), 0))
+            except (FutureTimeout, CancelledError):
+                # Cancellata: in coda su un worker riavviato per un altro timeout
+                with self._lock:
+                    self.timeouts += 1
+                self._restart(worker, executor)
+                return {'error': f'Calcolo oltre il limite di {self.timeout:g} s'}, 504
+            except BrokenProcessPool:
+                self._restart(worker, executor)
+                return {'error': 'Worker di calcolo terminato inaspettatamente'}, 500
+
+        with self._lock:
+            self.completed += 1
+        if isinstance(payload.get('stats'), dict):
+            payload['stats']['pool'] = {
+                'worker': worker,
+                'queue_wait_ms': int(max(started - submitted, 0) * 1000),
+                'compute_ms': int((finished - started) * 1000),
+            }
+        return payload, status
 
-    # Tipi numpy scalari
-    if isinstance(val, (np.integer,)):
-        return int(val)
-    if isinstance(val, (np.floating,)):
-        f = float(val)
-        return int(f) if f == int(f) else f
-    if isinstance(val, (np.bool_,)):
-        return bool(val)
-    if isinstance(val, (np.str_,)):
-        return str(val)
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'timeout_s': self.timeout,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+            }
 
-    # Booleani Python nativi (prima di int, perche' bool e' subclass di int)
-    if isinstance(val, bool):
-        return val
-    if isinstance(val, (int, float, str)):
-        return val
 
-    # Fallback
-    return str(val)
+# Singleton
+eval_pool = EvalPool()
+
+
+# ---------------------------------------------------------------------------
+# Blocchi indipendenti dello stesso foglio su piu' worker
+# ---------------------------------------------------------------------------
+#
+# Un foglio grande contiene spesso blocchi di calcolo che non si leggono a
+# vicenda. Le celle popolate vengono divise nelle componenti (debolmente)
+# connesse del grafo "formula -> celle che legge"; le componenti vengono
+# raggruppate in al piu' un job per worker, ogni job e' un sotto-foglio
+# sparso valutato (e messo in cache) da evaluate_sheet su un worker diverso,
+# e i risultati vengono riuniti in un'unica griglia. Se anche una sola
+# formula ha dipendenze non ricavabili dal testo il foglio non viene diviso.
+# I testi "=..." delle celle valore sono formule del modello: contano come
+# formule anche qui. Lettura del payload, impronta e piano restano nel
+# processo principale (sotto il GIL, una volta per richiesta; il piano e'
+# in cache per impronta): il guadagno riguarda solo il calcolo dei blocchi.
+
+# Nomi senza "(" rimasti dopo aver tolto stringhe e riferimenti A1: nomi
+# definiti, errori come #N/A, colonne/righe intere... dipendenze non note
+_BARE_NAME = re.compile(r'(?<![A-Za-z0-9_.])[A-Za-z_][A-Za-z0-9_.]*(?![A-Za-z0-9_.]|\s*\()')
+
+_CALL_NAME = re.compile(r'([A-Za-z][A-Za-z0-9_.]*)\s*\(')
+
+
+def formula_references(formula):
+    """Range letti da una formula, come [(r1, c1, r2, c2), ...] 0-based.
+
+    None se le dipendenze non si ricavano con certezza dal testo: altri
+    fogli, nomi definiti, colonne/righe intere (A:A), funzioni come
+    INDIRECT/OFFSET (SHAPE_CONTEXT_FUNCTIONS).
+    """
+    formula = translate_formula_it_to_en(formula)
+    if not formula.startswith('='):
+        return []
+    refs = []
+    residue = []
+    last = 0
+    for m in _SHAPE_TOKEN.finditer(formula):
+        residue.append(formula[last:m.start()])
+        last = m.end()
+        if m.group('sheet'):
+            return None
+        if m.group('col1') is None:
+            continue  # stringa letterale
+        try:
+            r1, c1, _, _ = _shape_corner(m, 1, 0, 0)
+            r2, c2 = r1, c1
+            if m.group('col2') is not None:
+                r2, c2, _, _ = _shape_corner(m, 2, 0, 0)
+        except ValueError:
+            return None
+        refs.append((min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2)))
+    residue.append(formula[last:])
+    rest = ' '.join(residue)
+
+    if ':' in rest:
+        return None
+    if {name.upper() for name in _CALL_NAME.findall(rest)} & SHAPE_CONTEXT_FUNCTIONS:
+        return None
+    if {name.upper() for name in _BARE_NAME.findall(rest)} - {'TRUE', 'FALSE'}:
+        return None
+    return refs
+
+
+def sheet_components(formula_cells, value_cells, positions, num_rows, num_cols):
+    """Componenti connesse delle celle popolate tramite i riferimenti delle formule.
+
+    Le celle valore con testo "=..." (is_formula_literal) contano come
+    formule. Ritorna (components, loose): components = liste di ref con
+    almeno una formula, loose = celle valore non lette da nessuna formula.
+    None se qualche formula non e' analizzabile (vedi formula_references).
+    """
+    sources = dict(formula_cells)
+    sources.update((ref, value) for ref, value in value_cells.items() if is_formula_literal(value))
+    refs = list(positions)
+    index = {ref: i for i, ref in enumerate(refs)}
+    grid = np.full((num_rows, num_cols), -1, dtype=np.int64)
+    for i, ref in enumerate(refs):
+        grid[positions[ref]] = i
+    parent = list(range(len(refs)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Range gia' visti -> una cella rappresentante (le altre sono gia' unite)
+    range_rep = {}
+    for ref, formula in sources.items():
+        ranges = formula_references(formula)
+        if ranges is None:
+            return None
+        root = find(index[ref])
+        for rng in ranges:
+            r1, c1, r2, c2 = rng
+            if r1 >= num_rows or c1 >= num_cols:
+                continue  # solo celle vuote
+            rep = range_rep.get(rng)
+            if rep is None:
+                block = grid[r1:r2 + 1, c1:c2 + 1]
+                members = block[block >= 0].tolist()
+                rep = range_rep[rng] = members[0] if members else -1
+                for j in members[1:]:
+                    rj, rr = find(j), find(rep)
+                    if rj != rr:
+                        parent[rj] = rr
+            if rep >= 0:
+                rr = find(rep)
+                if rr != root:
+                    parent[rr] = root
+
+    groups = {}
+    for i in range(len(refs)):
+        groups.setdefault(find(i), []).append(refs[i])
+    components = []
+    loose = []
+    for members in groups.values():
+        if any(ref in sources for ref in members):
+            components.append(members)
+        else:
+            loose.extend(members)
+    return components, loose
+
+
+def plan_sheet_split(formula_cells, value_cells, positions, num_rows, num_cols, workers):
+    """Divide le celle popolate in al piu' `workers` job bilanciati per numero di celle.
+
+    Ritorna None se il foglio non si divide (una sola componente o formule
+    non analizzabili), altrimenti {'parts': [[ref, ...], ...], 'components': N}.
+    """
+    found = sheet_components(formula_cells, value_cells, positions, num_rows, num_cols)
+    if found is None:
+        return None
+    components, loose = found
+    if len(components) < 2:
+        return None
+    parts = [[] for _ in range(min(workers, len(components)))]
+    for members in sorted(components, key=len, reverse=True):
+        min(parts, key=len).extend(members)
+    # Le celle valore isolate restano input modificabili (/eval_sheet/delta)
+    min(parts, key=len).extend(loose)
+    return {'parts': parts, 'components': len(components)}
+
+
+# Piani di divisione, per impronta del modello intero. Ogni entry tiene
+# anche i sotto-modelli (model_id, worker, version) per /eval_sheet/delta.
+split_cache = ModelCache(max_models=4 * MODEL_CACHE_MAX_MODELS)
+
+
+def _split_entry(data):
+    """Entry di split_cache per il foglio del payload; None se non va diviso."""
+    if eval_pool.workers < 2:
+        return None
+    try:
+        (formula_cells, value_cells, positions,
+         num_rows, num_cols, sparse) = parse_sheet_payload(data)
+    except ValueError:
+        return None  # l'errore lo riporta evaluate_sheet
+    if len(positions) < EVAL_SPLIT_MIN_CELLS:
+        return None
+
+    model_id = model_fingerprint(formula_cells, value_cells, num_rows, num_cols)
+    entry = split_cache.get(model_id)
+    if entry is None:
+        plan = plan_sheet_split(formula_cells, value_cells, positions, num_rows, num_cols,
+                                eval_pool.workers)
+        entry = {
+            'plan': plan,
+            'cells': len(positions) if plan else 0,
+            'lock': threading.Lock(),
+            'version': 0,
+            'models': [None] * len(plan['parts']) if plan else [],
+        }
+        if plan:
+            prefix_len = len(MODEL_CELL_PREFIX)
+            entry['cell_part'] = {ref[prefix_len:]: i
+                                  for i, part in enumerate(plan['parts']) for ref in part}
+        split_cache.put(model_id, entry)
+    if entry['plan'] is None:
+        return None
+    return model_id, entry, (formula_cells, positions, num_rows, num_cols, sparse)
+
+
+def evaluate_sheet_split(data):
+    """Valuta un foglio diviso in blocchi indipendenti su piu' worker.
+
+    Solo il calcolo dei blocchi e' parallelo: lettura del payload e impronta
+    (in _split_entry) restano nel processo principale, sotto il GIL.
+    Ritorna (risposta, status HTTP) come evaluate_sheet, oppure None se il
+    foglio non va diviso.
+    """
+    found = _split_entry(data)
+    if found is None:
+        return None
+    start = time.time()
+    model_id, entry, (formula_cells, positions, num_rows, num_cols, sparse) = found
+
+    # Contenuto originale delle celle valore (parse_value lo rielabora nel worker)
+    values_grid = data.get('values', [])
+    if sparse:
+        raw_values = {(item[0], item[1]): item[2] for item in values_grid}
+    base = eval_pool.worker_for(sheet_route_key(data))
+    jobs = []
+    for i, part in enumerate(entry['plan']['parts']):
+        formulas_items = []
+        values_items = []
+        for ref in part:
+            r, c = positions[ref]
+            if ref in formula_cells:
+                formulas_items.append([r, c, formula_cells[ref]])
+            else:
+                raw = raw_values[(r, c)] if sparse else values_grid[r][c]
+                values_items.append([r, c, raw])
+        payload = {'format': 'sparse', 'formulas': formulas_items, 'values': values_items}
+        jobs.append((payload, (base + i) % eval_pool.workers))
+
+    with entry['lock']:
+        outputs = eval_pool.run_many(evaluate_sheet, jobs)
+        for payload, status in outputs:
+            if status != 200:
+                return payload, status
+        entry['models'] = [(payload['model_id'], worker, payload['version'])
+                           for (payload, _), (_, worker) in zip(outputs, jobs)]
+        entry['version'] += 1
+        model_version = entry['version']
+
+    items = [item for payload, _ in outputs for item in payload['results']]
+    if sparse:
+        results = items
+    else:
+        grid = blank_results_grid(values_grid, num_rows, num_cols)
+        if items:
+            rows, cols, values = zip(*items)
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+            grid[list(rows), list(cols)] = column
+        results = grid.tolist()
+    encoding = data.get('encoding', 'json')
+    if encoding == 'typed':
+        results = encode_typed_results(results, sparse)
+
+    part_stats = [payload['stats'] for payload, _ in outputs]
+    return {
+        'results': results,
+        'format': 'sparse' if sparse else 'dense',
+        'encoding': encoding,
+        'rows': num_rows,
+        'cols': num_cols,
+        'model_id': model_id,
+        'version': model_version,
+        'stats': {
+            'total_cells': num_rows * num_cols,
+            'formula_cells': len(formula_cells),
+            'formula_shapes': sum(st['formula_shapes'] for st in part_stats),
+            'shape_cells': sum(st['shape_cells'] for st in part_stats),
+            'vectorized_cells': sum(st['vectorized_cells'] for st in part_stats),
+            'eval_time_ms': int((time.time() - start) * 1000),
+            'model_cache': {'hit': all(st['model_cache']['hit'] for st in part_stats)},
+            'split': {
+                'components': entry['plan']['components'],
+                'jobs': [dict(st['pool'], cells=len(part))
+                         for st, part in zip(part_stats, entry['plan']['parts'])],
+            },
+        }
+    }, 200
+
+
+def evaluate_split_delta(data, entry):
+    """/eval_sheet/delta per un foglio diviso: ogni blocco ricalcola le sue modifiche."""
+    start = time.time()
+    changes = {}
+    for change in data.get('changes', []):
+        cell = str(change.get('cell', '')).replace('$', '').upper().strip()
+        if not _A1_CELL_PATTERN.match(cell):
+            return {'error': f'Cella non valida: {cell}'}, 400
+        part = entry['cell_part'].get(cell)
+        if part is None:
+            return {'error': f'La cella {cell} non e\' un input modificabile del modello',
+                    'full_eval_required': True}, 409
+        changes.setdefault(part, []).append(change)
+
+    with entry['lock']:
+        if data.get('version') != entry['version'] or None in entry['models']:
+            return {'error': 'Versione del modello non aggiornata',
+                    'full_eval_required': True}, 409
+        parts = sorted(changes)
+        jobs = []
+        for i in parts:
+            sub_id, worker, version = entry['models'][i]
+            jobs.append(({'model_id': sub_id, 'version': version, 'changes': changes[i]}, worker))
+        outputs = eval_pool.run_many(evaluate_sheet_delta, jobs)
+        for payload, status in outputs:
+            if status != 200:
+                # Blocchi ormai disallineati: serve una valutazione completa
+                entry['models'] = [None] * len(entry['models'])
+                return payload, status
+        for i, (payload, _) in zip(parts, outputs):
+            sub_id, worker, _ = entry['models'][i]
+            entry['models'][i] = (sub_id, worker, payload['version'])
+        entry['version'] += 1
+        model_version = entry['version']
+
+    part_stats = [payload['stats'] for payload, _ in outputs]
+    return {
+        'changes': sorted((c for payload, _ in outputs for c in payload['changes']),
+                          key=lambda c: c['cell']),
+        'model_id': data.get('model_id'),
+        'version': model_version,
+        'stats': {
+            'changed_inputs': sum(st['changed_inputs'] for st in part_stats),
+            'recalculated_shape_cells': sum(st['recalculated_shape_cells'] for st in part_stats),
+            'recalculated_nodes': sum(st['recalculated_nodes'] for st in part_stats),
+            'eval_time_ms': int((time.time() - start) * 1000),
+            'split': {'jobs': [st['pool'] for st in part_stats]},
+        }
+    }, 200
+
+
+def dispatch_eval_sheet(data):
+    """Valuta un payload /eval_sheet: a blocchi su piu' worker se il foglio
+    si divide, altrimenti sul worker del foglio. Ritorna (risposta, status)."""
+    split = evaluate_sheet_split(data)
+    if split is not None:
+        return split
+    worker = eval_pool.worker_for(sheet_route_key(data))
+    payload, status = eval_pool.run(evaluate_sheet, data, worker)
+    if status == 200:
+        eval_pool.remember(payload['model_id'], worker)
+    return payload, status
+
+
+# ---------------------------------------------------------------------------
+# Sessioni a blocchi (/eval_sheet/session)
+# ---------------------------------------------------------------------------
+#
+# Per fogli grandi il client non invia un unico JSON: apre una sessione,
+# carica le righe a blocchi, avvia il calcolo e scarica i risultati a
+# blocchi di righe (a pagine o in streaming NDJSON). Il server conserva
+# solo le celle popolate (triple sparse) fino al calcolo e poi solo i
+# risultati delle celle popolate, ordinati per riga: ogni richiesta
+# costruisce al piu' un blocco di righe denso.
+
+class EvalSession:
+    """Stato di una sessione: celle caricate, poi risultati calcolati."""
+
+    def __init__(self, num_rows, num_cols):
+        self.id = uuid.uuid4().hex
+        self.rows = num_rows
+        self.cols = num_cols
+        self.formulas = []     # [riga, colonna, formula]
+        self.values = []       # [riga, colonna, valore]
+        self.results = None    # (righe, colonne, valori) ordinati per riga
+        self.lock = threading.Lock()
+        self.touched = time.time()
+
+    def add_rows(self, start_row, formulas_block, values_block):
+        """Aggiunge un blocco di righe dense; ritorna il numero di righe."""
+        num = max(len(formulas_block), len(values_block))
+        if start_row < 0 or start_row + num > self.rows:
+            raise ValueError(f'Righe {start_row}-{start_row + num - 1} fuori dal foglio '
+                             f'({self.rows} righe)')
+        if num > SESSION_MAX_CHUNK_ROWS:
+            raise ValueError(f'Blocco di {num} righe: massimo {SESSION_MAX_CHUNK_ROWS}')
+        for i in range(num):
+            formula_row = formulas_block[i] if i < len(formulas_block) else []
+            value_row = values_block[i] if i < len(values_block) else []
+            if len(formula_row) > self.cols or len(value_row) > self.cols:
+                raise ValueError(f'Riga {start_row + i} con piu\' di {self.cols} colonne')
+            r = start_row + i
+            self.formulas.extend([r, c, f] for c, f in enumerate(formula_row) if f)
+            self.values.extend([r, c, v] for c, v in enumerate(value_row)
+                               if v is not None and v != '')
+        return num
+
+    def set_results(self, items):
+        """Conserva i risultati sparsi ordinati per riga e libera le celle caricate."""
+        self.formulas = []
+        self.values = []
+        rows = np.array([item[0] for item in items], dtype=np.int64)
+        cols = np.array([item[1] for item in items], dtype=np.int64)
+        values = np.empty(len(items), dtype=object)
+        values[:] = [item[2] for item in items]
+        order = np.lexsort((cols, rows))
+        self.results = (rows[order], cols[order], values[order])
+
+    def result_rows(self, start_row, num):
+        """Blocco denso di risultati per le righe [start_row, start_row + num)."""
+        end = min(start_row + num, self.rows)
+        rows, cols, values = self.results
+        i0, i1 = np.searchsorted(rows, [start_row, end])
+        grid = np.full((max(end - start_row, 0), self.cols), '', dtype=object)
+        grid[rows[i0:i1] - start_row, cols[i0:i1]] = values[i0:i1]
+        return grid.tolist()
+
+
+class SessionStore:
+    """Sessioni aperte, con scadenza per inattivita' e numero massimo (LRU)."""
+
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, ttl=SESSION_TTL_S):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, EvalSession] = OrderedDict()
+
+    def _expire(self):
+        now = time.time()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.touched <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def open(self, num_rows, num_cols) -> EvalSession:
+        session = EvalSession(num_rows, num_cols)
+        with self._lock:
+            self._sessions[session.id] = session
+            self._expire()
+        return session
+
+    def get(self, session_id: str) -> EvalSession | None:
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touched = time.time()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+# Singleton
+session_store = SessionStore()
+
+
+def _session_or_404(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        return None, (jsonify({'error': 'Sessione non trovata o scaduta'}), 404)
+    return session, None
 
 
 # ---------------------------------------------------------------------------
@@ -227,107 +1785,199 @@ def _log_request_time(response):
 
 
 # ---------------------------------------------------------------------------
-# Endpoints
+# Serializzazione JSON e compressione HTTP
 # ---------------------------------------------------------------------------
 
-@app.route('/eval_sheet', methods=['POST'])
-def eval_sheet():
-    """Valuta un intero foglio: riceve formule + valori, restituisce risultati.
+def json_dumps(obj, default=None):
+    """Serializza `obj` in JSON compatto (bytes UTF-8) con il backend configurato.
 
-    Payload atteso:
-    {
-        "formulas": [["=SUM(A1:A2)", "", ...], ...],
-        "values":   [[null, 42, "hello", ...], ...]
-    }
+    orjson rifiuta gli interi oltre 64 bit: in quel caso (TypeError, come
+    orjson.JSONEncodeError) la serializzazione passa al modulo standard.
+    Entrambi i backend accettano i tipi NumPy.
+    """
+    if JSON_BACKEND == 'orjson':
+        try:
+            return orjson.dumps(obj, default=default,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, default=functools.partial(_json_default_numpy, default),
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
-    - formulas[r][c]: stringa formula (es "=SUM(A1:A2)") o "" se non e' formula
-    - values[r][c]:   valore letterale della cella (usato dove formulas e' "")
 
-    Risposta:
-    {
-        "results": [[...], ...],
-        "stats": {"total_cells": N, "formula_cells": N, "eval_time_ms": N}
-    }
+def _json_default_numpy(default, obj):
+    """default di json.dumps che accetta anche i tipi NumPy (come
+    OPT_SERIALIZE_NUMPY di orjson)."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if default is not None:
+        return default(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def json_loads(data):
+    """Deserializza JSON (bytes o str) con il backend configurato."""
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify e request.get_json tramite json_dumps / json_loads.
+
+    Le chiavi non vengono ordinate e la risposta e' costruita direttamente
+    dai bytes, senza passare da una stringa intermedia.
     """
-    tmp_path = None
+
+    def dumps(self, obj, **kwargs):
+        return json_dumps(obj, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_dumps(obj, default=self.default),
+                                        mimetype=self.mimetype)
+
+
+app.json = CodecJSONProvider(app)
+
+# Content-Encoding supportati -> wbits di zlib
+_ZLIB_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def inflate_body(body, encoding):
+    """Decomprime un body gzip/deflate; ValueError se supera MAX_INFLATED_BYTES."""
     try:
-        start = time.time()
-        data = request.get_json()
+        inflater = zlib.decompressobj(_ZLIB_WBITS[encoding])
+        data = inflater.decompress(body, MAX_INFLATED_BYTES + 1)
+    except zlib.error:
+        if encoding != 'deflate':
+            raise
+        # "deflate" senza intestazione zlib (inviato da alcuni client)
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        data = inflater.decompress(body, MAX_INFLATED_BYTES + 1)
+    if len(data) > MAX_INFLATED_BYTES or inflater.unconsumed_tail:
+        raise ValueError('Body decompresso troppo grande')
+    return data
 
-        formulas_grid = data.get('formulas', [])
-        values_grid = data.get('values', [])
 
-        if not values_grid:
-            return jsonify({'error': 'values grid is required'}), 400
+def deflate_body(body, encoding):
+    """Comprime un body di risposta con gzip o deflate (formato zlib)."""
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
+    return zlib.compress(body, COMPRESS_LEVEL)
+
+
+@app.before_request
+def _inflate_request():
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding not in _ZLIB_WBITS:
+        return jsonify({'error': f'Content-Encoding non supportato: {encoding}'}), 415
+    try:
+        body = inflate_body(request.get_data(cache=False), encoding)
+    except (ValueError, zlib.error) as e:
+        return jsonify({'error': f'Body {encoding} non valido: {e}'}), 400
+    # get_json() legge il body gia' decompresso
+    request._cached_data = body
+    return None
+
 
-        num_rows = len(values_grid)
-        num_cols = max(len(row) for row in values_grid) if values_grid else 0
+@app.after_request
+def _compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(deflate_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
 
-        if num_rows == 0 or num_cols == 0:
-            return jsonify({'error': 'Empty sheet'}), 400
 
-        # ----- Costruisci workbook temporaneo con openpyxl -----
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'Model'
+# ---------------------------------------------------------------------------
+# Valutazione (eseguita nei processi worker del pool)
+# ---------------------------------------------------------------------------
 
-        formula_count = 0
+def evaluate_sheet(data):
+    """Valuta il payload di /eval_sheet; ritorna (risposta, status HTTP)."""
+    try:
+        start = time.time()
 
-        for r in range(num_rows):
-            for c in range(num_cols):
-                cell = ws.cell(row=r + 1, column=c + 1)
+        values_grid = data.get('values', [])
+        try:
+            (formula_cells, value_cells, positions,
+             num_rows, num_cols, sparse) = parse_sheet_payload(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
-                # Controlla se c'e' una formula
-                formula = ''
-                if r < len(formulas_grid) and c < len(formulas_grid[r]):
-                    formula = formulas_grid[r][c]
+        # ----- Recupera il modello compilato (o costruiscilo) e calcola -----
+        formula_count = len(formula_cells)
 
-                if formula:
-                    cell.value = translate_formula_it_to_en(formula)
-                    formula_count += 1
-                else:
-                    val = values_grid[r][c] if c < len(values_grid[r]) else None
-                    cell.value = parse_value(val)
-
-        # ----- Salva su file temporaneo e calcola -----
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix='.xlsx')
-        os.close(tmp_fd)
-        wb.save(tmp_path)
-
-        xl_model = formulas_lib.ExcelModel().loads(tmp_path).finish()
-        solution = xl_model.calculate()
-
-        # ----- Costruisci lookup normalizzato dalla solution -----
-        # La libreria formulas usa chiavi tipo "'[book.xlsx]Sheet'!A1"
-        cell_pattern = re.compile(r"!([A-Z]+\d+)$", re.IGNORECASE)
-        sheet_pattern = re.compile(r"\](.+?)'!", re.IGNORECASE)
-
-        solution_map = {}
-        for key, val in solution.items():
-            cell_match = cell_pattern.search(str(key))
-            sheet_match = sheet_pattern.search(str(key))
-            if cell_match:
-                cell_name = cell_match.group(1).upper()
-                sheet_name = sheet_match.group(1).upper() if sheet_match else 'MODEL'
-                normalized_key = f"{sheet_name}!{cell_name}"
-                solution_map[normalized_key] = val
-
-        # ----- Leggi risultati -----
-        results = []
-        for r in range(num_rows):
-            row = []
-            for c in range(num_cols):
-                col_letter = openpyxl.utils.get_column_letter(c + 1)
-                lookup_key = f"MODEL!{col_letter}{r + 1}"
-
-                if lookup_key in solution_map:
-                    val = solution_map[lookup_key]
-                    val = convert_formulas_value(val)
-                    row.append(val)
-                else:
-                    val = values_grid[r][c] if c < len(values_grid[r]) else None
-                    row.append(parse_value(val) if val is not None else '')
-            results.append(row)
+        model_key = model_fingerprint(formula_cells, value_cells, num_rows, num_cols)
+        entry = model_cache.get(model_key)
+        cache_hit = entry is not None
+
+        if not cache_hit:
+            # Formule ripetute: una compilazione per forma, calcolo fuori dal
+            # modello; al modello restano solo le altre formule
+            plan = build_shape_plan(formula_cells, value_cells, positions, num_rows, num_cols)
+            grid = shape_grid(plan, value_cells)
+            shape_values = run_shape_plan(plan, grid)
+            model_cells = dict(value_cells)
+            model_cells.update((ref, shape_literal(v)) for ref, v in shape_values.items())
+            entry = {
+                'xl_model': build_excel_model(
+                    {ref: f for ref, f in formula_cells.items() if ref not in shape_values},
+                    model_cells),
+                'plan': plan,
+                'grid': grid,
+                'shape_values': shape_values,
+                # Indice nodo -> (riga, colonna) delle celle popolate: le
+                # posizioni fanno parte dell'impronta, quindi valgono per
+                # tutte le richieste servite da questo modello
+                'positions': positions,
+                'cell_index': cell_index(positions),
+                'cells': len(formula_cells) + len(value_cells),
+                'lock': threading.Lock(),
+                'version': 0,
+            }
+            model_cache.put(model_key, entry)
+
+        # Lo stesso modello non viene calcolato da due request in parallelo.
+        # L'ultima valutazione resta nell'entry come base per /eval_sheet/delta.
+        with entry['lock']:
+            inputs = None
+            if cache_hit:
+                # Stesse formule: ricalcola le forme e riassegna solo i valori
+                entry['grid'] = shape_grid(entry['plan'], value_cells)
+                entry['shape_values'] = run_shape_plan(entry['plan'], entry['grid'])
+                inputs = model_inputs(value_cells)
+                inputs.update(entry['shape_values'])
+            solution = entry['xl_model'].calculate(inputs=inputs)
+            entry['solution'] = dict(solution)
+            entry['inputs'] = value_cells
+            entry['version'] += 1
+            model_version = entry['version']
+
+        if sparse:
+            results = sparse_results(solution, value_cells, entry['cell_index'])
+        else:
+            results = dense_results(solution, value_cells, entry['cell_index'],
+                                    values_grid, num_rows, num_cols)
+        encoding = data.get('encoding', 'json')
+        if encoding == 'typed':
+            results = encode_typed_results(results, sparse)
 
         elapsed_ms = int((time.time() - start) * 1000)
 
@@ -336,36 +1986,372 @@ def eval_sheet():
         if data.get('debug'):
             debug_info = {
                 'raw_solution_keys': [str(k) for k in list(solution.keys())[:50]],
-                'normalized_keys': list(solution_map.keys())[:50],
+                'indexed_cells': [
+                    f"{MODEL_SHEET}!{openpyxl.utils.get_column_letter(c + 1)}{r + 1}"
+                    for r, c in list(entry['positions'].values())[:50]
+                ],
             }
 
         response_data = {
             'results': results,
+            'format': 'sparse' if sparse else 'dense',
+            'encoding': encoding,
+            'rows': num_rows,
+            'cols': num_cols,
+            'model_id': model_key,
+            'version': model_version,
             'stats': {
                 'total_cells': num_rows * num_cols,
                 'formula_cells': formula_count,
-                'eval_time_ms': elapsed_ms
+                'formula_shapes': entry['plan']['formula_shapes'],
+                'shape_cells': entry['plan']['shape_cells'],
+                'vectorized_cells': entry['plan']['vectorized_cells'],
+                'eval_time_ms': elapsed_ms,
+                'model_cache': dict(model_cache.stats(), hit=cache_hit),
             }
         }
         if debug_info:
             response_data['debug'] = debug_info
 
-        return jsonify(response_data)
+        return response_data, 200
+
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+def evaluate_sheet_delta(data):
+    """Valuta il payload di /eval_sheet/delta; ritorna (risposta, status HTTP)."""
+    try:
+        start = time.time()
+
+        model_id = data.get('model_id', '')
+        changes_raw = data.get('changes', [])
+        if not model_id:
+            return {'error': 'model_id is required'}, 400
+
+        entry = model_cache.get(model_id)
+        if entry is None:
+            return {'error': 'Modello non in cache', 'full_eval_required': True}, 409
+
+        changed = {}
+        for change in changes_raw:
+            cell = str(change.get('cell', '')).replace('$', '').upper().strip()
+            if not _A1_CELL_PATTERN.match(cell):
+                return {'error': f'Cella non valida: {cell}'}, 400
+            value = parse_value(change.get('value'))
+            if isinstance(value, float):
+                value = round(value, 15)
+            changed[MODEL_CELL_PREFIX + cell] = (cell, value)
+
+        with entry['lock']:
+            if data.get('version') != entry['version']:
+                return {'error': 'Versione del modello non aggiornata',
+                        'full_eval_required': True}, 409
+            for ref, (cell, value) in changed.items():
+                if (ref not in entry['inputs'] or value is None
+                        or is_formula_literal(value) or is_formula_literal(entry['inputs'][ref])):
+                    # Celle vuote/formule (anche testi "=...") non sono nodi
+                    # input del modello compilato
+                    return {'error': f'La cella {cell} non e\' un input modificabile del modello',
+                            'full_eval_required': True}, 409
+
+            changed = {ref: value for ref, (_, value) in changed.items()}
+
+            # Prima le forme calcolate fuori dal modello che leggono le celle
+            # modificate; i nuovi valori entrano nel modello come input,
+            # convertiti come in from_dict
+            plan, grid = entry['plan'], entry['grid']
+            dirty = np.zeros(grid.shape, dtype=bool)
+            model_changes = model_inputs(changed)
+            for ref, value in model_changes.items():
+                pos = plan['literal_positions'][ref]
+                grid[pos] = value
+                dirty[pos] = True
+            shape_changes = run_shape_plan(plan, grid, dirty) if plan['batches'] else {}
+            model_changes.update(shape_changes)
+
+            previous = entry['solution']
+            solution, recalculated = recalculate_delta(entry, model_changes)
+
+            entry['solution'] = solution
+            entry['inputs'] = dict(entry['inputs'], **changed)
+            entry['shape_values'].update(shape_changes)
+            entry['version'] += 1
+            model_version = entry['version']
+
+        # Solo le celle popolate del foglio (non i range ne' le celle vuote
+        # referenziate) il cui valore e' cambiato
+        result_changes = []
+        prefix_len = len(MODEL_CELL_PREFIX)
+        positions = entry['positions']
+        refs = [ref for ref in sorted(set(model_changes) | recalculated, key=str)
+                if ref in positions]
+        values = convert_formulas_block([solution[ref] for ref in refs])
+        old_values = convert_formulas_block([previous.get(ref) for ref in refs])
+        for ref, value, old_value in zip(refs, values, old_values):
+            if ref not in previous or old_value != value:
+                result_changes.append({'cell': ref[prefix_len:], 'value': value})
+
+        return {
+            'changes': result_changes,
+            'model_id': model_id,
+            'version': model_version,
+            'stats': {
+                'changed_inputs': len(changed),
+                'recalculated_shape_cells': len(shape_changes),
+                'recalculated_nodes': len(recalculated),
+                'eval_time_ms': int((time.time() - start) * 1000),
+            }
+        }, 200
+
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+# ---------------------------------------------------------------------------
+# Endpoints
+# ---------------------------------------------------------------------------
+
+@app.route('/eval_sheet', methods=['POST'])
+def eval_sheet():
+    """Valuta un intero foglio: riceve formule + valori, restituisce risultati.
+
+    Payload atteso:
+    {
+        "formulas": [["=SUM(A1:A2)", "", ...], ...],
+        "values":   [[null, 42, "hello", ...], ...]
+    }
+
+    - formulas[r][c]: stringa formula (es "=SUM(A1:A2)") o "" se non e' formula
+    - values[r][c]:   valore letterale della cella (usato dove formulas e' "")
+
+    Formato sparso (consigliato per fogli con molte celle vuote):
+    {
+        "format": "sparse",
+        "rows": R, "cols": C,                      # opzionali
+        "formulas": [[0, 2, "=SUM(A1:B1)"], ...],  # [riga, colonna, formula]
+        "values":   [[0, 0, 42], ...]              # [riga, colonna, valore]
+    }
+    Indici 0-based; in risposta "results" e' allora una lista di triple
+    [riga, colonna, valore] con le sole celle popolate.
+
+    Con "encoding": "typed" le colonne solo numeriche dei risultati arrivano
+    come array float64 in base64 (vedi encode_typed_results). Il body puo'
+    essere inviato compresso (Content-Encoding: gzip/deflate) e la risposta
+    viene compressa se il client invia Accept-Encoding.
+
+    Risposta:
+    {
+        "results": [[...], ...],
+        "format": "dense" | "sparse", "encoding": "json" | "typed",
+        "rows": R, "cols": C,
+        "model_id": "...", "version": N,    # da usare con /eval_sheet/delta
+        "stats": {"total_cells": N, "formula_cells": N,
+                  "formula_shapes": N,      # forme R1C1 distinte
+                  "shape_cells": N,         # celle calcolate per forma (fuori dal modello)
+                  "vectorized_cells": N,    # di cui su colonne NumPy
+                  "eval_time_ms": N,
+                  "model_cache": {"hit": bool, "hits": N, "misses": N, ...},
+                  "pool": {"worker": N, "queue_wait_ms": N, "compute_ms": N}}
+    }
+
+    Il modello compilato viene messo in cache (vedi ModelCache): se le formule
+    non cambiano, le richieste successive riassegnano solo i valori di input.
+    Il calcolo avviene in un processo worker (vedi EvalPool): 503 se il pool
+    e' pieno, 504 se il calcolo supera il timeout.
+    """
+    try:
+        data = request.get_json()
+        if data.get('encoding', 'json') not in RESULT_ENCODINGS:
+            return jsonify({'error': f"encoding deve essere uno di {', '.join(RESULT_ENCODINGS)}"}), 400
+        payload, status = dispatch_eval_sheet(data)
+        return jsonify(payload), status
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/eval_sheet/delta', methods=['POST'])
+def eval_sheet_delta():
+    """Ricalcolo incrementale di un foglio gia' valutato con /eval_sheet.
+
+    Payload atteso:
+    {
+        "model_id": "...",          # restituito da /eval_sheet
+        "version": N,               # ultima versione ricevuta
+        "changes": [{"cell": "A10", "value": 42}, ...]
+    }
+
+    Solo celle valore gia' presenti nel modello possono cambiare. Se il modello
+    non e' piu' in cache, la versione non corrisponde (un altro client ha
+    ricalcolato lo stesso modello) o una modifica tocca una cella vuota o una
+    formula, la risposta e' 409 con "full_eval_required": true e il client
+    deve rinviare il foglio intero a /eval_sheet.
+
+    Risposta:
+    {
+        "changes": [{"cell": "D10", "value": ...}, ...],   # solo celle cambiate
+        "model_id": "...", "version": N + 1,
+        "stats": {"changed_inputs": N, "recalculated_shape_cells": N,
+                  "recalculated_nodes": N, "eval_time_ms": N,
+                  "pool": {"worker": N, "queue_wait_ms": N, "compute_ms": N}}
+    }
+    """
+    try:
+        data = request.get_json()
+        split = split_cache.get(data.get('model_id', ''))
+        if split is not None and split['plan'] is not None:
+            payload, status = evaluate_split_delta(data, split)
+            return jsonify(payload), status
+        worker = eval_pool.worker_for_model(data.get('model_id', ''))
+        if worker is None:
+            return jsonify({'error': 'Modello non in cache', 'full_eval_required': True}), 409
+        payload, status = eval_pool.run(evaluate_sheet_delta, data, worker)
+        return jsonify(payload), status
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/eval_sheet/session', methods=['POST'])
+def eval_sheet_session_open():
+    """Apre una sessione di valutazione a blocchi (fogli grandi).
+
+    Payload: {"rows": R, "cols": C}
+    Risposta: {"session_id": "...", "chunk_rows": N, "max_chunk_rows": N}
+
+    Protocollo:
+    1. POST /eval_sheet/session/<id>/rows       - carica un blocco di righe
+       {"start_row": r, "formulas": [[...], ...], "values": [[...], ...]}
+       (righe dense come in /eval_sheet, indici 0-based)
+    2. POST /eval_sheet/session/<id>/calculate  - calcola il foglio caricato;
+       risposta con model_id, version e stats di /eval_sheet, senza risultati
+    3. GET  /eval_sheet/session/<id>/results?start_row=r&rows=n
+       -> {"start_row": r, "results": [[...], ...], "next_row": r + n | null}
+       Con ?format=ndjson i risultati arrivano tutti in streaming, una riga
+       JSON {"start_row": r, "results": [[...], ...]} per blocco.
+       Con ?encoding=typed ogni blocco e' codificato come in /eval_sheet.
+    4. DELETE /eval_sheet/session/<id>          - chiude la sessione
+    Le celle vuote nei risultati sono ''. Le sessioni inattive scadono.
+    """
+    try:
+        data = request.get_json()
+        num_rows = int(data.get('rows') or 0)
+        num_cols = int(data.get('cols') or 0)
+        if num_rows <= 0 or num_cols <= 0:
+            return jsonify({'error': 'rows e cols sono obbligatori'}), 400
+        session = session_store.open(num_rows, num_cols)
+        return jsonify({
+            'session_id': session.id,
+            'chunk_rows': SESSION_CHUNK_ROWS,
+            'max_chunk_rows': SESSION_MAX_CHUNK_ROWS,
+        })
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
+
+@app.route('/eval_sheet/session/<session_id>/rows', methods=['POST'])
+def eval_sheet_session_rows(session_id):
+    """Carica un blocco di righe nella sessione."""
+    try:
+        session, error = _session_or_404(session_id)
+        if error:
+            return error
+        data = request.get_json()
+        with session.lock:
+            if session.results is not None:
+                return jsonify({'error': 'Sessione gia\' calcolata'}), 409
             try:
-                os.unlink(tmp_path)
-            except OSError:
-                pass
+                received = session.add_rows(int(data.get('start_row') or 0),
+                                            data.get('formulas', []), data.get('values', []))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        return jsonify({'received_rows': received})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/eval_sheet/session/<session_id>/calculate', methods=['POST'])
+def eval_sheet_session_calculate(session_id):
+    """Calcola il foglio caricato nella sessione (come /eval_sheet, formato sparso)."""
+    try:
+        session, error = _session_or_404(session_id)
+        if error:
+            return error
+        with session.lock:
+            if session.results is not None:
+                return jsonify({'error': 'Sessione gia\' calcolata'}), 409
+            payload, status = dispatch_eval_sheet({
+                'format': 'sparse',
+                'rows': session.rows,
+                'cols': session.cols,
+                'formulas': session.formulas,
+                'values': session.values,
+            })
+            if status != 200:
+                return jsonify(payload), status
+            session.set_results(payload.pop('results'))
+        payload['session_id'] = session.id
+        return jsonify(payload)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/eval_sheet/session/<session_id>/results', methods=['GET'])
+def eval_sheet_session_results(session_id):
+    """Scarica i risultati a blocchi di righe, a pagine o in streaming NDJSON."""
+    try:
+        session, error = _session_or_404(session_id)
+        if error:
+            return error
+        if session.results is None:
+            return jsonify({'error': 'Sessione non ancora calcolata'}), 409
+        num = min(int(request.args.get('rows') or SESSION_CHUNK_ROWS), SESSION_MAX_CHUNK_ROWS)
+        if num <= 0:
+            return jsonify({'error': 'rows deve essere positivo'}), 400
+        encoding = request.args.get('encoding', 'json')
+        if encoding not in RESULT_ENCODINGS:
+            return jsonify({'error': f"encoding deve essere uno di {', '.join(RESULT_ENCODINGS)}"}), 400
+
+        def result_rows(start_row):
+            rows = session.result_rows(start_row, num)
+            return encode_typed_results(rows, False) if encoding == 'typed' else rows
+
+        if request.args.get('format') == 'ndjson':
+            def stream():
+                for start_row in range(0, session.rows, num):
+                    block = {'start_row': start_row, 'results': result_rows(start_row)}
+                    yield json_dumps(block) + b'\n'
+            return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+        start_row = int(request.args.get('start_row') or 0)
+        if start_row < 0 or start_row >= session.rows:
+            return jsonify({'error': f'start_row fuori dal foglio ({session.rows} righe)'}), 400
+        next_row = start_row + num
+        return jsonify({
+            'start_row': start_row,
+            'results': result_rows(start_row),
+            'next_row': next_row if next_row < session.rows else None,
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/eval_sheet/session/<session_id>', methods=['DELETE'])
+def eval_sheet_session_close(session_id):
+    """Chiude la sessione e libera i risultati."""
+    if not session_store.close(session_id):
+        return jsonify({'error': 'Sessione non trovata o scaduta'}), 404
+    return jsonify({'closed': True})
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'healthy', 'mode': 'batch_sheet'})
+    return jsonify({'status': 'healthy', 'mode': 'batch_sheet', 'pool': eval_pool.stats()})
 
 
 @app.route('/operations', methods=['GET'])
@@ -381,7 +2367,12 @@ def list_operations():
 if __name__ == '__main__':
     print("Cloud Calc Batch API - Valutazione fogli interi")
     print("Endpoints:")
-    print("  POST /eval_sheet  - valuta un intero foglio")
+    print("  POST /eval_sheet        - valuta un intero foglio")
+    print("  POST /eval_sheet/delta  - ricalcolo incrementale")
+    print("  POST /eval_sheet/session - valutazione a blocchi (fogli grandi)")
     print("  GET  /health")
     print("  GET  /operations")
+    if eval_pool.workers:
+        print(f"Avvio di {eval_pool.workers} worker di calcolo...")
+        eval_pool.start()
     app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -7,31 +7,61 @@ corretto (topological sort).
 
 Flusso:
 1. Ogni cella con CLOUD_CALC invia: cell, operation, args [{ref, value}]
-2. Il server accumula le richieste in un batch (finestra di BATCH_WINDOW_S
-   secondi senza nuove richieste).
-3. Scaduta la finestra, costruisce il grafo di dipendenze, esegue
-   topological sort e calcola ogni cella nell'ordine giusto, propagando
+   e sheet_id (spreadsheet + foglio di provenienza)
+2. Il server accumula le richieste in un batch per foglio. Il batch viene
+   risolto al primo di: BATCH_WINDOW_S secondi senza nuove celle dal
+   foglio, BATCH_MAX_AGE_S secondi dalla prima cella, BATCH_MAX_CELLS celle.
+3. Al momento della risoluzione aggiorna il grafo di dipendenze del foglio
+   (conservato fra un batch e l'altro), esegue topological sort e calcola
+   nell'ordine giusto le celle del batch e tutte quelle a valle, propagando
    i risultati alle celle dipendenti.
 4. Ogni request HTTP riceve la propria risposta.
 
-Avvio:  python cloud_calc_batch_api.py
+In alternativa /batch_calc/bulk riceve in una sola request tutte le celle
+di un range ({cell, operation, args} ciascuna) e le risolve subito, senza
+finestra, con lo stesso grafo e lo stesso ordinamento: una sola andata e
+ritorno invece di una request per cella.
+
+Le celle in attesa non sono legate a un thread: il batch manager notifica
+ogni cella risolta tramite callback. Sotto WSGI (Flask) ogni request attende
+comunque nel proprio thread; la variante ASGI `asgi_app` attende con un
+future sull'event loop, quindi decine di migliaia di celle in attesa non
+occupano thread.
+
+Avvio:  python cloud_calc_dependencies_api.py
+ASGI:   uvicorn cloud_calc_dependencies_api:asgi_app --port 5000   (pip install uvicorn)
 """
 
 from __future__ import annotations
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
 import threading
 import time
 import math
 import re
 import fnmatch
 
+from cloud_calc_values import parse_value, parse_values
+
 # ---------------------------------------------------------------------------
 # Configurazione
 # ---------------------------------------------------------------------------
-BATCH_WINDOW_S = 2.0   # secondi di silenzio prima di risolvere il batch
-CACHE_TTL_S = 30.0     # secondi di validita' della cache risultati
+BATCH_WINDOW_S = 1.0   # secondi di silenzio prima di risolvere il batch
+BATCH_MAX_AGE_S = 4.0  # eta' massima del batch (dalla prima cella) anche sotto traffico
+BATCH_MAX_CELLS = 5_000  # celle oltre le quali il batch viene risolto subito
+BATCH_LATENCY_SAMPLES = 1_000  # ultimi batch usati per p50/p99 della latenza
+BATCH_RESOLVE_WORKERS = 4  # fogli risolti in parallelo (un foglio grande non blocca gli altri)
+CACHE_TTL_S = 600.0    # secondi di validita' della cache risultati
+CACHE_MAX_ENTRIES = 200_000  # risultati in cache (LRU)
+SHEET_IDLE_TTL_S = 3600.0    # grafo di un foglio senza richieste rimosso dopo 1 ora
+BATCH_TIMEOUT_S = 30.0 # attesa massima di una cella prima dell'errore di timeout
+DEFAULT_SHEET_ID = ''  # partizione dei client che non inviano sheet_id
+BULK_MAX_CELLS = 100_000     # celle massime in una request /batch_calc/bulk
 
 app = Flask(__name__)
 CORS(app)
@@ -72,201 +102,649 @@ OPERATIONS = {
     'len':        lambda s: len(str(s)),
 }
 
+
+def evaluate_operation(func, rows):
+    """Applica una funzione di OPERATIONS a piu' celle in blocco.
+
+    `rows` contiene gli argomenti risolti di ogni cella. Ritorna per ogni
+    cella (True, risultato) oppure (False, eccezione).
+    """
+    outcomes = []
+    for args in rows:
+        try:
+            outcomes.append((True, func(*args)))
+        except Exception as e:
+            outcomes.append((False, e))
+    return outcomes
+
+
 # ---------------------------------------------------------------------------
 # Parse helpers
 # ---------------------------------------------------------------------------
-def parse_value(value):
-    if value is None or value == '':
-        return None
-    if isinstance(value, (int, float, bool)):
-        return value
-    s = str(value).strip()
-    if s.lower() == 'true':
-        return True
-    if s.lower() == 'false':
-        return False
-    try:
-        return float(s) if '.' in s else int(s)
-    except ValueError:
-        return s
-
-
 def normalize_cell(ref):
     """Normalizza un riferimento cella in maiuscolo senza $: '$A$1' -> 'A1'."""
     return ref.replace('$', '').upper().strip()
 
 
+# ---------------------------------------------------------------------------
+# Cache dei risultati
+# ---------------------------------------------------------------------------
+class ResultCache:
+    """Cache LRU dei risultati, indicizzata per (foglio, cella, operazione,
+    argomenti).
+
+    Gli argomenti fanno parte della chiave: se un input a monte cambia, la
+    cella arriva con valori diversi e non trova il risultato vecchio. Il TTL
+    serve solo a liberare memoria; le entry scadute vengono rimosse da
+    expire() (chiamato dal thread scheduler del BatchManager).
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_s=CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()  # key -> (scadenza, risultato)
+        self._expiry: deque[tuple[float, tuple]] = deque()   # (scadenza, key) in ordine di inserimento
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(sheet_id: str, cell: str, operation: str, values) -> tuple:
+        """Chiave di cache; `values` sono le coppie (ref, valore) degli argomenti."""
+        # True e 1 hanno lo stesso hash: il tipo bool resta nella chiave
+        return (sheet_id, cell, operation.lower(),
+                tuple((ref, value, isinstance(value, bool)) for ref, value in values))
+
+    def get(self, key: tuple) -> dict | None:
+        """Ritorna il risultato (e lo marca come usato di recente) o None."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= time.time():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: tuple, result: dict):
+        """Inserisce un risultato ed esegue l'eviction LRU oltre max_entries."""
+        self.put_many([(key, result)])
+
+    def put_many(self, items):
+        """Inserisce piu' coppie (key, risultato) con una sola acquisizione del lock."""
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            for key, result in items:
+                self._entries[key] = (expires_at, result)
+                self._entries.move_to_end(key)
+                self._expiry.append((expires_at, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def expire(self) -> int:
+        """Rimuove le entry scadute; ritorna quante ne ha rimosse."""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, key = self._expiry.popleft()
+                item = self._entries.get(key)
+                # Entry reinserita dopo questa scadenza: resta
+                if item is not None and item[0] == expires_at:
+                    del self._entries[key]
+                    removed += 1
+            self.expirations += removed
+        return removed
+
+    def next_expiry(self) -> float | None:
+        """Prossima scadenza da controllare (None se la cache e' vuota)."""
+        with self._lock:
+            return self._expiry[0][0] if self._expiry else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+            }
+
+
 # ---------------------------------------------------------------------------
 # Batch manager
 # ---------------------------------------------------------------------------
+def _same_value(a, b) -> bool:
+    """Stesso valore di cella (True e 1 sono valori diversi)."""
+    return a == b and isinstance(a, bool) == isinstance(b, bool)
+
+
+def _discard_reader(readers, ref, cell):
+    """Rimuove l'arco ref -> cell; i ref senza piu' lettori escono dall'indice."""
+    cells = readers.get(ref)
+    if cells is not None:
+        cells.discard(cell)
+        if not cells:
+            del readers[ref]
+
+
+def _set_future_result(future, result):
+    """Completa un future di submit_async (se non e' gia' scaduto)."""
+    if not future.done():
+        future.set_result(result)
+
+
 class BatchManager:
-    """Accumula le request in arrivo e le risolve quando la finestra scade."""
+    """Accumula le request in arrivo e le risolve quando la finestra scade.
+
+    Batch e risultati sono separati per foglio (sheet_id): i fogli si
+    risolvono in modo indipendente e il traffico di un foglio non sposta
+    la finestra di un altro. Un solo thread scheduler individua i batch
+    scaduti (silenzio, eta' massima o dimensione massima) e li affida a un
+    pool di BATCH_RESOLVE_WORKERS thread, un batch per foglio alla volta:
+    un foglio grande non ritarda la risoluzione degli altri.
+
+    Ogni cella in attesa registra una callback (waiter) chiamata con il
+    risultato: submit() la attende bloccando il thread, submit_async() con
+    un future sull'event loop del chiamante.
+    """
 
-    def __init__(self, window_s=BATCH_WINDOW_S):
+    def __init__(self, window_s=BATCH_WINDOW_S, max_age_s=BATCH_MAX_AGE_S,
+                 max_cells=BATCH_MAX_CELLS, resolve_workers=BATCH_RESOLVE_WORKERS):
         self.window_s = window_s
+        self.max_age_s = max_age_s
+        self.max_cells = max_cells
+        self.resolve_workers = resolve_workers
         self._lock = threading.Lock()
-        self._batch: dict[str, dict] = {}      # cell -> entry
-        self._timer: threading.Timer | None = None
-        # Cache: cell -> (timestamp, result_dict)
-        self._cache: dict[str, tuple[float, dict]] = {}
+        self._wakeup = threading.Condition(self._lock)   # risveglia lo scheduler
+        self._scheduler: threading.Thread | None = None
+        self._resolver: ThreadPoolExecutor | None = None
+        self._closed = False
+        # sheet_id -> {'batch': {cell: entry}, 'first_at': ts, 'last_at': ts,
+        #              'resolving': batch in risoluzione nel pool,
+        #              'graph': {cell: node}, 'readers': {ref: {celle che la leggono}},
+        #              'graph_lock': Lock}
+        # Il grafo resta fra un batch e l'altro: node = {'operation', 'args'
+        # [(ref, valore inviato)], 'value' (ultimo calcolato), 'computed'}
+        self._sheets: dict[str, dict] = {}
+        self._cache = ResultCache()
+        # Latenza dei batch (prima cella -> risposte inviate) e cause di risoluzione
+        self._latencies: deque[float] = deque(maxlen=BATCH_LATENCY_SAMPLES)
+        self._triggers = {'idle': 0, 'max_age': 0, 'max_cells': 0, 'bulk': 0}
+        self._downstream = 0   # celle di batch precedenti ricalcolate dal server
+
+    def _sheet(self, sheet_id):
+        """Stato del foglio (creato al primo uso). Da chiamare con il lock."""
+        state = self._sheets.get(sheet_id)
+        if state is None:
+            state = {'batch': {}, 'first_at': 0.0, 'last_at': 0.0, 'resolving': False,
+                     'graph': {}, 'readers': {}, 'graph_lock': threading.Lock()}
+            self._sheets[sheet_id] = state
+        return state
+
+    def stats(self) -> dict:
+        """Contatori per tarare la finestra: latenza p50/p99 e cause di risoluzione."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            pending = sum(len(state['batch']) for state in self._sheets.values())
+            graph_cells = sum(len(state['graph']) for state in self._sheets.values())
+            resolving = sum(1 for state in self._sheets.values() if state['resolving'])
+            triggers = dict(self._triggers)
+            downstream = self._downstream
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000)
+
+        return {
+            'sheets': len(self._sheets),
+            'pending_cells': pending,
+            'resolving_sheets': resolving,
+            'resolve_workers': self.resolve_workers,
+            'window_s': self.window_s,
+            'max_age_s': self.max_age_s,
+            'max_cells': self.max_cells,
+            'triggers': triggers,
+            'graph_cells': graph_cells,
+            'downstream_recomputed': downstream,
+            'latency_ms': {'p50': percentile(0.50), 'p99': percentile(0.99),
+                           'samples': len(latencies)},
+            'cache': self._cache.stats(),
+        }
+
+    def close(self):
+        """Ferma il thread scheduler (i batch ancora in attesa non vengono risolti)."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+            resolver = self._resolver
+        if resolver is not None:
+            resolver.shutdown(wait=False)
 
     # -- public API (chiamato dal thread Flask per ogni request) ------------
 
-    def submit(self, cell: str, operation: str, args: list[dict]) -> dict:
-        """Aggiunge una cella al batch corrente e blocca fino alla risoluzione.
+    def submit(self, cell: str, operation: str, args: list[dict],
+               sheet_id: str = DEFAULT_SHEET_ID) -> dict:
+        """Aggiunge una cella al batch del suo foglio e blocca fino alla risoluzione.
 
         Ritorna il dict {'result': ...} oppure {'error': ...}.
         """
-        cell = normalize_cell(cell)
+        resolved = threading.Event()
+        box = {}
+
+        def waiter(result):
+            box['result'] = result
+            resolved.set()
+
+        cached = self._enqueue(sheet_id, cell, operation, args, waiter)
+        if cached is not None:
+            return cached
+
+        # Blocca fino a risoluzione (timeout di sicurezza)
+        if not resolved.wait(timeout=BATCH_TIMEOUT_S):
+            return {'error': f'Timeout: batch non risolto entro {BATCH_TIMEOUT_S:.0f}s'}
+        return box['result']
+
+    async def submit_async(self, cell: str, operation: str, args: list[dict],
+                           sheet_id: str = DEFAULT_SHEET_ID) -> dict:
+        """Come submit(), ma attende con un future sull'event loop corrente:
+        nessun thread resta bloccato per la cella."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def waiter(result):
+            loop.call_soon_threadsafe(_set_future_result, future, result)
+
+        cached = self._enqueue(sheet_id, cell, operation, args, waiter)
+        if cached is not None:
+            return cached
+
+        try:
+            return await asyncio.wait_for(future, BATCH_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            return {'error': f'Timeout: batch non risolto entro {BATCH_TIMEOUT_S:.0f}s'}
+
+    def submit_bulk(self, cells: list[tuple[str, str, list[dict]]],
+                    sheet_id: str = DEFAULT_SHEET_ID) -> dict[str, dict]:
+        """Risolve subito, nel thread chiamante, un gruppo di celle
+        (cell, operation, args) dello stesso foglio, senza finestra.
+
+        Le celle aggiornano il grafo del foglio come un batch normale (anche
+        le celle a valle gia' note vengono ricalcolate). Ritorna
+        {cella: {'result': ...} oppure {'error': ...}}; se una cella compare
+        piu' volte vale l'ultima.
+        """
+        # Valori di tutti gli argomenti convertiti in un solo passaggio
+        values = parse_values([arg.get('value') for _, _, args in cells for arg in args])
+        batch = {}
+        start = 0
+        for cell, operation, args in cells:
+            end = start + len(args)
+            entry = self._new_entry(sheet_id, cell, operation, args, [], values[start:end])
+            batch[entry['cell']] = entry
+            start = end
 
-        # Cache hit: se questa cella e' stata calcolata di recente,
-        # rispondi subito senza aspettare il batch.
-        # Questo evita le cascate di ricalcolo di Sheets.
         with self._lock:
-            if cell in self._cache:
-                ts, cached_result = self._cache[cell]
-                if time.time() - ts < CACHE_TTL_S:
-                    print(f"[CACHE]  {cell} -> {cached_result.get('result', '?')} (age: {time.time()-ts:.1f}s)")
-                    return cached_result
-
-        event = threading.Event()
-        entry = {
+            state = self._sheet(sheet_id)
+            state['last_at'] = time.time()
+            self._triggers['bulk'] += 1
+
+        self._compute_batch(sheet_id, state, batch)
+        return {cell: entry['result'] for cell, entry in batch.items()}
+
+    # -- internals ----------------------------------------------------------
+
+    @staticmethod
+    def _new_entry(sheet_id, cell, operation, args, waiters, values=None):
+        """Entry di batch di una cella, con gli argomenti convertiti e la
+        chiave di cache. `values`: valori degli argomenti gia' passati da
+        parse_value, se disponibili."""
+        cell = normalize_cell(cell)
+        if values is None:
+            values = [parse_value(arg.get('value')) for arg in args]
+        parsed = [(normalize_cell(arg.get('ref', '')), value) for arg, value in zip(args, values)]
+        return {
             'cell': cell,
             'operation': operation,
             'args': args,           # [{ref: "A1", value: 10}, ...]
-            'event': event,
+            'parsed_args': parsed,  # [("A1", 10), ...]
+            'cache_key': ResultCache.key(sheet_id, cell, operation, parsed),
+            'waiters': waiters,
             'result': None,
         }
 
-        with self._lock:
-            self._batch[cell] = entry
-            self._reset_timer()
-
-        # Blocca fino a risoluzione (timeout di sicurezza)
-        event.wait(timeout=30)
+    def _enqueue(self, sheet_id, cell, operation, args, waiter):
+        """Aggiunge la cella al batch del foglio con la sua callback.
 
-        if entry['result'] is None:
-            return {'error': 'Timeout: batch non risolto entro 30s'}
-        return entry['result']
+        Ritorna il risultato in cache se la cella e' gia' stata calcolata
+        con gli stessi argomenti (la callback non viene registrata),
+        altrimenti None.
+        """
+        entry = self._new_entry(sheet_id, cell, operation, args, [waiter])
+        cell = entry['cell']
 
-    # -- internals ----------------------------------------------------------
+        # Cache hit: stessa cella con gli stessi argomenti, rispondi subito
+        # senza aspettare il batch. Questo evita le cascate di ricalcolo di Sheets.
+        cached_result = self._cache.get(entry['cache_key'])
+        if cached_result is not None:
+            print(f"[CACHE]  {sheet_id}:{cell} -> {cached_result.get('result', '?')}")
+            return cached_result
 
-    def _reset_timer(self):
-        """Resetta (o avvia) il timer della finestra di batch."""
-        if self._timer is not None:
-            self._timer.cancel()
-        self._timer = threading.Timer(self.window_s, self._resolve_batch)
-        self._timer.daemon = True
-        self._timer.start()
+        with self._lock:
+            state = self._sheet(sheet_id)
+            now = time.time()
+            if not state['batch']:
+                state['first_at'] = now
+            state['last_at'] = now
+            # Stessa cella reinviata prima della risoluzione: vale l'ultima
+            # versione, e anche chi attendeva la precedente riceve il risultato
+            previous = state['batch'].get(cell)
+            if previous is not None:
+                entry['waiters'] = previous['waiters'] + entry['waiters']
+            state['batch'][cell] = entry
+            # Lo scheduler va svegliato solo se la scadenza si avvicina: un
+            # nuovo batch o il limite di celle (il silenzio la sposta avanti)
+            if len(state['batch']) == 1 or len(state['batch']) >= self.max_cells:
+                self._start_scheduler()
+                self._wakeup.notify()
+        return None
 
-    def _resolve_batch(self):
-        """Scaduta la finestra: risolvi tutto il batch."""
+    @staticmethod
+    def _notify(entry):
+        """Consegna il risultato dell'entry a tutte le celle in attesa."""
+        for waiter in entry['waiters']:
+            waiter(entry['result'])
+
+    def _start_scheduler(self):
+        """Avvia il thread scheduler (e il pool) al primo batch. Da chiamare con il lock."""
+        if self._scheduler is None:
+            self._resolver = ThreadPoolExecutor(max_workers=self.resolve_workers,
+                                                thread_name_prefix='batch-resolve')
+            self._scheduler = threading.Thread(target=self._run_scheduler,
+                                               name='batch-scheduler', daemon=True)
+            self._scheduler.start()
+
+    def _deadline(self, state):
+        """Istante di risoluzione del batch di un foglio."""
+        if len(state['batch']) >= self.max_cells:
+            return state['last_at']
+        return min(state['last_at'] + self.window_s, state['first_at'] + self.max_age_s)
+
+    def _run_scheduler(self):
+        """Thread scheduler: dorme fino alla prossima scadenza e affida al
+        pool i batch scaduti. Un foglio con un batch gia' in risoluzione
+        aspetta la fine di quello (i batch di un foglio restano in ordine)."""
+        with self._lock:
+            while not self._closed:
+                now = time.time()
+                due = []
+                next_at = None
+                for sheet_id, state in self._sheets.items():
+                    if not state['batch'] or state['resolving']:
+                        continue
+                    at = self._deadline(state)
+                    if at <= now:
+                        due.append(sheet_id)
+                    elif next_at is None or at < next_at:
+                        next_at = at
+                if due:
+                    for sheet_id in due:
+                        self._sheets[sheet_id]['resolving'] = True
+                        self._resolver.submit(self._resolve_in_pool, sheet_id)
+                    continue
+
+                # Fra un batch e l'altro: fogli inattivi (grafo e archi
+                # readers compresi) ed entry di cache scadute vengono rimossi
+                for sheet_id in [sheet_id for sheet_id, state in self._sheets.items()
+                                 if not state['batch'] and not state['resolving']
+                                 and state['last_at'] + SHEET_IDLE_TTL_S <= now]:
+                    del self._sheets[sheet_id]
+                self._lock.release()
+                try:
+                    self._cache.expire()
+                    expiry_at = self._cache.next_expiry()
+                finally:
+                    self._lock.acquire()
+                if expiry_at is not None and (next_at is None or expiry_at < next_at):
+                    next_at = expiry_at
+                self._wakeup.wait(None if next_at is None else max(next_at - time.time(), 0))
+
+    def _resolve_in_pool(self, sheet_id):
+        """Thread del pool: risolve il batch del foglio, poi risveglia lo
+        scheduler (nel frattempo puo' essere scaduto un altro batch del foglio)."""
+        try:
+            self._resolve_batch(sheet_id)
+        finally:
+            with self._lock:
+                self._sheets[sheet_id]['resolving'] = False
+                self._wakeup.notify()
+
+    def _resolve_batch(self, sheet_id=DEFAULT_SHEET_ID):
+        """Batch scaduto: risolvi tutto il batch del foglio."""
         with self._lock:
-            batch = self._batch
-            self._batch = {}
-            self._timer = None
+            state = self._sheet(sheet_id)
+            batch = state['batch']
+            state['batch'] = {}
+            first_at = state['first_at']
+            if batch:
+                if len(batch) >= self.max_cells:
+                    trigger = 'max_cells'
+                elif time.time() >= first_at + self.max_age_s:
+                    trigger = 'max_age'
+                else:
+                    trigger = 'idle'
+                self._triggers[trigger] += 1
 
         if not batch:
             return
 
-        cells_in_batch = set(batch.keys())
-        print(f"\n[BATCH] Risoluzione di {len(batch)} celle: {sorted(cells_in_batch)}")
-
-        # 1. Costruisci il grafo di dipendenze (solo fra celle nel batch)
-        #    deps[cell] = set di celle nel batch da cui dipende
-        deps: dict[str, set[str]] = {}
-        for cell, entry in batch.items():
-            cell_deps = set()
-            for arg in entry['args']:
-                ref = normalize_cell(arg.get('ref', ''))
-                if ref in cells_in_batch and ref != cell:
-                    cell_deps.add(ref)
-            deps[cell] = cell_deps
-
-        # 2. Topological sort (Kahn's algorithm)
-        order = self._topological_sort(deps)
-        if order is None:
-            # Ciclo nelle dipendenze
-            for entry in batch.values():
-                entry['result'] = {'error': 'Dipendenza circolare rilevata nel batch'}
-                entry['event'].set()
-            return
-
-        print(f"[BATCH] Ordine di esecuzione: {order}")
-
-        # 3. Esegui in ordine, propagando i risultati
-        computed: dict[str, any] = {}   # cell -> valore calcolato
-
-        for cell in order:
-            entry = batch[cell]
-            op = entry['operation'].lower()
-
-            # Sostituisci i valori degli argomenti che dipendono da celle
-            # gia' calcolate in questo batch
-            resolved_args = []
-            for arg in entry['args']:
-                ref = normalize_cell(arg.get('ref', ''))
-                if ref in computed:
-                    # Usa il valore appena calcolato
-                    resolved_args.append(parse_value(computed[ref]))
-                else:
-                    resolved_args.append(parse_value(arg.get('value')))
-
-            # Calcola
-            try:
-                if op not in OPERATIONS:
-                    entry['result'] = {'error': f'Operazione sconosciuta: {op}'}
+        try:
+            self._compute_batch(sheet_id, state, batch)
+        finally:
+            with self._lock:
+                self._latencies.append(time.time() - first_at)
+
+    def _compute_batch(self, sheet_id, state, batch):
+        """Aggiorna il grafo del foglio con le celle del batch, ricalcola in
+        ordine di dipendenza le celle cambiate e tutte quelle a valle (anche
+        arrivate in batch precedenti) e notifica i risultati del batch."""
+        start = time.time()
+        with state['graph_lock']:
+            graph = state['graph']
+            readers = state['readers']
+
+            # 1. Aggiorna la definizione (operazione, argomenti) delle celle
+            #    del batch e gli archi ref -> celle che la leggono. I nodi
+            #    precedenti restano in `previous` per annullare un batch con
+            #    un ciclo
+            previous = {}
+            for cell, entry in batch.items():
+                node = graph.get(cell)
+                previous[cell] = None if node is None else dict(node)
+                if node is None:
+                    node = graph[cell] = {'value': None, 'computed': False}
                 else:
-                    result = OPERATIONS[op](*resolved_args)
-                    computed[cell] = result
-                    result_dict = {'result': result, 'cell': cell}
-                    entry['result'] = result_dict
-                    # Salva in cache
-                    with self._lock:
-                        self._cache[cell] = (time.time(), result_dict)
-                    print(f"[BATCH]   {cell} = {result}")
-            except Exception as e:
-                entry['result'] = {'error': f'Errore calcolo {cell}: {str(e)}'}
-
-            entry['event'].set()
+                    for ref, _ in node['args']:
+                        _discard_reader(readers, ref, cell)
+                node['operation'] = entry['operation'].lower()
+                node['args'] = list(entry['parsed_args'])
+                for ref, _ in node['args']:
+                    if ref:
+                        readers.setdefault(ref, set()).add(cell)
+
+            # 2. Per le celle fuori dal batch vale il valore inviato dal client:
+            #    il server non sa se sono ancora celle CLOUD_CALC (la formula
+            #    puo' essere stata sostituita da un valore o da altro). Il loro
+            #    nodo viene rimosso con i suoi archi e la cella torna un input;
+            #    se e' ancora CLOUD_CALC rientra nel grafo al prossimo invio
+            for cell in batch:
+                for ref, _ in graph[cell]['args']:
+                    upstream = graph.get(ref) if ref and ref != cell else None
+                    if upstream is not None and ref not in batch:
+                        for arg_ref, _ in upstream['args']:
+                            _discard_reader(readers, arg_ref, ref)
+                        del graph[ref]
+
+            # 3. Input (celle senza CLOUD_CALC) arrivati con un valore nuovo:
+            #    anche le celle di batch precedenti che li leggono sono cambiate
+            stale = set()
+            for cell in batch:
+                for ref, value in graph[cell]['args']:
+                    if not ref or ref in graph:
+                        continue
+                    for reader in readers.get(ref, ()):
+                        if reader in batch:
+                            continue
+                        args = graph[reader]['args']
+                        for i, (arg_ref, old) in enumerate(args):
+                            if arg_ref == ref and not _same_value(old, value):
+                                args[i] = (arg_ref, value)
+                                stale.add(reader)
+
+            # 4. Chiusura a valle delle celle cambiate e ordine di calcolo
+            dirty = set(batch) | stale
+            queue = deque(dirty)
+            while queue:
+                for reader in readers.get(queue.popleft(), ()):
+                    if reader not in dirty:
+                        dirty.add(reader)
+                        queue.append(reader)
+            deps = {cell: [ref for ref, _ in graph[cell]['args'] if ref in dirty and ref != cell]
+                    for cell in dirty}
+            levels = self._topological_levels(deps)
+            if levels is None:
+                # Ciclo nelle dipendenze: le celle del batch tornano come prima
+                # (nodi e archi), cosi' il prossimo batch corretto si risolve
+                for cell, node in previous.items():
+                    for ref, _ in graph[cell]['args']:
+                        _discard_reader(readers, ref, cell)
+                    if node is None:
+                        del graph[cell]
+                        continue
+                    graph[cell] = node
+                    for ref, _ in node['args']:
+                        if ref:
+                            readers.setdefault(ref, set()).add(cell)
+                for cell in dirty - set(batch):
+                    graph[cell]['computed'] = False
+                for entry in batch.values():
+                    entry['result'] = {'error': 'Dipendenza circolare rilevata nel batch'}
+                    self._notify(entry)
+                return
+
+            # 5. Esegui livello per livello: le celle di un livello sono
+            #    indipendenti fra loro e vengono calcolate in blocco per
+            #    operazione. Gli argomenti che puntano a celle del grafo (del
+            #    batch o ricalcolate a valle) usano il valore calcolato dal
+            #    server, non quello inviato.
+            cache_items = []
+            for level in levels:
+                by_operation: dict[str, list] = {}
+                for cell in level:
+                    node = graph[cell]
+                    resolved = node['args']
+                    for i, (ref, value) in enumerate(node['args']):
+                        upstream = graph.get(ref) if ref and ref != cell else None
+                        if upstream is not None and upstream['computed']:
+                            if resolved is node['args']:
+                                resolved = list(resolved)
+                            resolved[i] = (ref, parse_value(upstream['value']))
+                    by_operation.setdefault(node['operation'], []).append((cell, resolved))
+
+                for op, items in by_operation.items():
+                    func = OPERATIONS.get(op)
+                    if func is None:
+                        outcomes = [(False, None)] * len(items)
+                    else:
+                        outcomes = evaluate_operation(func, [[v for _, v in resolved]
+                                                             for _, resolved in items])
+                    for (cell, resolved), (ok, value) in zip(items, outcomes):
+                        node = graph[cell]
+                        entry = batch.get(cell)
+                        node['computed'] = ok
+                        if ok:
+                            node['value'] = value
+                            result_dict = {'result': value, 'cell': cell}
+                            # In cache con gli argomenti usati e con quelli
+                            # inviati: quando Sheets reinvia la cella con i
+                            # valori a monte aggiornati trova gia' il risultato
+                            if entry is not None:
+                                cache_items.append((entry['cache_key'], result_dict))
+                            if entry is None or resolved is not node['args']:
+                                cache_items.append(
+                                    (ResultCache.key(sheet_id, cell, op, resolved), result_dict))
+                        elif func is None:
+                            result_dict = {'error': f'Operazione sconosciuta: {op}'}
+                        else:
+                            result_dict = {'error': f'Errore calcolo {cell}: {str(value)}'}
+                        if entry is not None:
+                            entry['result'] = result_dict
+                            self._notify(entry)
+            self._cache.put_many(cache_items)
+
+            with self._lock:
+                self._downstream += len(dirty) - len(batch)
+
+        print(f"[BATCH] {sheet_id or '-'}: {len(batch)} celle, {len(dirty) - len(batch)} a valle, "
+              f"{len(levels)} livelli, {(time.time() - start) * 1000:.0f}ms")
 
         # Sblocca eventuali celle non nell'ordine (non dovrebbe succedere)
         for entry in batch.values():
-            if not entry['event'].is_set():
+            if entry['result'] is None:
                 entry['result'] = {'error': 'Cella non risolta'}
-                entry['event'].set()
+                self._notify(entry)
 
     @staticmethod
-    def _topological_sort(deps: dict[str, set[str]]) -> list[str] | None:
-        """Kahn's algorithm. Ritorna l'ordine o None se c'e' un ciclo."""
-        in_degree = {n: 0 for n in deps}
+    def _topological_levels(deps: dict[str, list[str]]) -> list[list[str]] | None:
+        """Kahn's algorithm per livelli, O(V+E) su id interi.
+
+        `deps[cell]` elenca le celle da cui dipende. Ogni livello contiene
+        celle che dipendono solo da livelli precedenti. Ritorna i livelli o
+        None se c'e' un ciclo.
+        """
+        ids: dict[str, int] = {}
         for node, node_deps in deps.items():
+            ids.setdefault(node, len(ids))
             for d in node_deps:
-                if d not in in_degree:
-                    in_degree[d] = 0
+                ids.setdefault(d, len(ids))
+        cells = list(ids)
+        n = len(cells)
 
-        # Calcola in-degree (quante celle dipendono da me -> irrilevante,
-        # ci serve quante dipendenze ha ogni cella)
-        # in_degree[cell] = numero di dipendenze non ancora risolte
-        adj: dict[str, list[str]] = {n: [] for n in in_degree}
+        # in_degree[i] = numero di dipendenze non ancora risolte della cella i
+        in_degree = [0] * n
+        dependents: list[list[int]] = [[] for _ in range(n)]
         for node, node_deps in deps.items():
-            in_degree[node] = len(node_deps)
+            i = ids[node]
+            in_degree[i] = len(node_deps)
             for d in node_deps:
-                adj.setdefault(d, []).append(node)
+                dependents[ids[d]].append(i)
 
-        queue = [n for n, deg in in_degree.items() if deg == 0]
+        # Livello di una cella = 1 + livello massimo delle sue dipendenze
+        depth = [0] * n
+        queue = deque(i for i, deg in enumerate(in_degree) if deg == 0)
         order = []
         while queue:
-            node = queue.pop(0)
-            order.append(node)
-            for neighbor in adj.get(node, []):
-                in_degree[neighbor] -= 1
-                if in_degree[neighbor] == 0:
-                    queue.append(neighbor)
-
-        if len(order) != len(in_degree):
+            i = queue.popleft()
+            order.append(i)
+            next_depth = depth[i] + 1
+            for j in dependents[i]:
+                if depth[j] < next_depth:
+                    depth[j] = next_depth
+                in_degree[j] -= 1
+                if in_degree[j] == 0:
+                    queue.append(j)
+
+        if len(order) != n:
             return None  # ciclo
-        return order
+        levels: list[list[str]] = [[] for _ in range(max(depth, default=-1) + 1)]
+        for i in order:
+            levels[depth[i]].append(cells[i])
+        return levels
 
 
 # Singleton
@@ -277,6 +755,48 @@ batch_manager = BatchManager()
 # Endpoints
 # ---------------------------------------------------------------------------
 
+def batch_request_fields(data):
+    """Campi di una richiesta /batch_calc: (cell, operation, args, sheet_id).
+
+    Solleva ValueError se mancano cell o operation.
+    """
+    cell = data.get('cell', '')
+    operation = data.get('operation', '')
+    if not cell:
+        raise ValueError('cell is required')
+    if not operation:
+        raise ValueError('operation is required')
+    return cell, operation, data.get('args', []), str(data.get('sheet_id') or DEFAULT_SHEET_ID)
+
+
+def bulk_request_fields(data):
+    """Campi di una richiesta /batch_calc/bulk: ([(cell, operation, args)], sheet_id).
+
+    Solleva ValueError se cells non e' una lista valida.
+    """
+    cells = data.get('cells')
+    if not isinstance(cells, list) or not cells:
+        raise ValueError('cells must be a non-empty list')
+    if len(cells) > BULK_MAX_CELLS:
+        raise ValueError(f'too many cells: {len(cells)} (max {BULK_MAX_CELLS})')
+    items = []
+    for i, item in enumerate(cells):
+        if not isinstance(item, dict):
+            raise ValueError(f'cells[{i}] must be an object')
+        try:
+            cell, operation, args, _ = batch_request_fields(item)
+        except ValueError as e:
+            raise ValueError(f'cells[{i}]: {e}') from None
+        items.append((cell, operation, args))
+    return items, str(data.get('sheet_id') or DEFAULT_SHEET_ID)
+
+
+def bulk_response(results):
+    """Corpo della risposta di /batch_calc/bulk."""
+    errors = sum(1 for result in results.values() if 'result' not in result)
+    return {'results': results, 'cells': len(results), 'errors': errors}
+
+
 @app.before_request
 def _start_timer():
     request._start_time = time.time()
@@ -295,6 +815,7 @@ def batch_calc():
 
     Payload atteso:
     {
+        "sheet_id": "<spreadsheet id>!<sheet id>",   # opzionale
         "cell": "C3",
         "operation": "sum",
         "args": [
@@ -304,17 +825,12 @@ def batch_calc():
     }
     """
     try:
-        data = request.get_json()
-        cell = data.get('cell', '')
-        operation = data.get('operation', '')
-        args = data.get('args', [])
+        try:
+            cell, operation, args, sheet_id = batch_request_fields(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        if not cell:
-            return jsonify({'error': 'cell is required'}), 400
-        if not operation:
-            return jsonify({'error': 'operation is required'}), 400
-
-        result = batch_manager.submit(cell, operation, args)
+        result = batch_manager.submit(cell, operation, args, sheet_id)
         status = 200 if 'result' in result else 500
         return jsonify(result), status
 
@@ -322,9 +838,38 @@ def batch_calc():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/batch_calc/bulk', methods=['POST'])
+def batch_calc_bulk():
+    """Risolve in una sola request tutte le celle di un range.
+
+    Payload atteso:
+    {
+        "sheet_id": "<spreadsheet id>!<sheet id>",   # opzionale
+        "cells": [
+            {"cell": "C1", "operation": "plus", "args": [{"ref": "A1", "value": 10}]},
+            {"cell": "C2", "operation": "multiply",
+             "args": [{"ref": "C1", "value": null}, {"value": 2}]}
+        ]
+    }
+
+    Risposta: {"results": {"C1": {"result": ...}, "C2": {"error": ...}},
+               "cells": 2, "errors": 1}
+    """
+    try:
+        try:
+            cells, sheet_id = bulk_request_fields(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify(bulk_response(batch_manager.submit_bulk(cells, sheet_id)))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'healthy', 'mode': 'batch'})
+    return jsonify({'status': 'healthy', 'mode': 'batch', 'batch': batch_manager.stats()})
 
 
 @app.route('/operations', methods=['GET'])
@@ -332,10 +877,108 @@ def list_operations():
     return jsonify({'operations': sorted(OPERATIONS.keys())})
 
 
+# ---------------------------------------------------------------------------
+# Variante ASGI
+# ---------------------------------------------------------------------------
+#
+# Stessi endpoint dell'app Flask, ma /batch_calc attende il batch con
+# submit_async(): ogni cella in attesa e' un future sull'unico event loop
+# invece di un thread bloccato. Da avviare con un solo processo (il batch
+# vive in memoria), es. uvicorn cloud_calc_dependencies_api:asgi_app
+
+_ASGI_HEADERS = [
+    (b'content-type', b'application/json'),
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+]
+
+
+async def _asgi_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _asgi_json(send, payload, status=200):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': _ASGI_HEADERS + [(b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+    return status
+
+
+async def _asgi_batch_calc(receive, send):
+    try:
+        try:
+            cell, operation, args, sheet_id = batch_request_fields(
+                json.loads(await _asgi_body(receive)))
+        except ValueError as e:
+            return await _asgi_json(send, {'error': str(e)}, 400)
+
+        result = await batch_manager.submit_async(cell, operation, args, sheet_id)
+        return await _asgi_json(send, result, 200 if 'result' in result else 500)
+
+    except Exception as e:
+        return await _asgi_json(send, {'error': str(e)}, 500)
+
+
+async def _asgi_batch_calc_bulk(receive, send):
+    try:
+        try:
+            cells, sheet_id = bulk_request_fields(json.loads(await _asgi_body(receive)))
+        except ValueError as e:
+            return await _asgi_json(send, {'error': str(e)}, 400)
+
+        # Calcolo CPU-bound: in un thread del pool, l'event loop resta libero
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, batch_manager.submit_bulk, cells, sheet_id)
+        return await _asgi_json(send, bulk_response(results))
+
+    except Exception as e:
+        return await _asgi_json(send, {'error': str(e)}, 500)
+
+
+async def asgi_app(scope, receive, send):
+    """Applicazione ASGI con /batch_calc, /batch_calc/bulk, /health e /operations."""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    start = time.time()
+    method, path = scope['method'], scope['path']
+    if method == 'OPTIONS':
+        status = await _asgi_json(send, {}, 200)
+    elif method == 'POST' and path == '/batch_calc':
+        status = await _asgi_batch_calc(receive, send)
+    elif method == 'POST' and path == '/batch_calc/bulk':
+        status = await _asgi_batch_calc_bulk(receive, send)
+    elif method == 'GET' and path == '/health':
+        status = await _asgi_json(send, {'status': 'healthy', 'mode': 'batch_async',
+                                         'batch': batch_manager.stats()})
+    elif method == 'GET' and path == '/operations':
+        status = await _asgi_json(send, {'operations': sorted(OPERATIONS.keys())})
+    else:
+        status = await _asgi_json(send, {'error': 'Not found'}, 404)
+    print(f"[{method} {path}] {status} - {(time.time() - start)*1000:.0f}ms")
+
+
 if __name__ == '__main__':
-    print(f"Batch Cloud Calc API - finestra batch: {BATCH_WINDOW_S}s")
+    print(f"Batch Cloud Calc API - finestra batch: {BATCH_WINDOW_S}s "
+          f"(max {BATCH_MAX_AGE_S}s / {BATCH_MAX_CELLS} celle)")
     print("Endpoints:")
     print("  POST /batch_calc  - calcolo con dipendenze (batch)")
+    print("  POST /batch_calc/bulk - tutte le celle di un range in una request")
     print("  GET  /health")
     print("  GET  /operations")
     app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -0,0 +1,77 @@
+"""
+Cloud Calc Values
+=================
+Conversione dei valori ricevuti dai client (argomenti, range, celle delle
+griglie) nei tipi usati per il calcolo, comune a cloud_calc_api.py,
+cloud_calc_batch_api.py e cloud_calc_dependencies_api.py.
+
+parse_value converte un valore; parse_values converte una lista intera con
+lo stesso risultato elemento per elemento:
+- numeri, booleani e null JSON passano cosi' come sono (nessun ciclo per
+  valore oltre al controllo dei tipi);
+- una colonna di sole stringhe numeriche e' convertita con float()/int()
+  applicati all'intera lista;
+- le altre stringhe sono convertite una volta per valore distinto.
+"""
+
+_PLAIN_TYPES = frozenset({int, float, bool, type(None)})
+_MISSING = object()
+
+
+def parse_value(value):
+    """Converte il valore nel tipo appropriato."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float, bool)):
+        return value
+    s = str(value).strip()
+    if s.lower() == 'true':
+        return True
+    if s.lower() == 'false':
+        return False
+    try:
+        return float(s) if '.' in s else int(s)
+    except ValueError:
+        return s
+
+
+def _parse_numeric_strings(values):
+    """Stringhe tutte numeriche: float() con il punto, int() senza, come
+    parse_value (float/int ignorano gli spazi iniziali e finali, come
+    strip). None se almeno una stringa non e' un numero."""
+    dots = ['.' in s for s in values]
+    try:
+        if all(dots):
+            return list(map(float, values))
+        if not any(dots):
+            return list(map(int, values))
+        return [float(s) if dot else int(s) for s, dot in zip(values, dots)]
+    except ValueError:
+        return None
+
+
+def parse_values(values) -> list:
+    """parse_value applicato a una lista (o colonna) intera."""
+    types = set(map(type, values))
+    if types <= _PLAIN_TYPES:
+        return list(values)
+    if types == {str}:
+        parsed = _parse_numeric_strings(values)
+        if parsed is not None:
+            return parsed
+
+    cache = {}
+    result = []
+    append = result.append
+    for value in values:
+        kind = type(value)
+        if kind is str:
+            parsed = cache.get(value, _MISSING)
+            if parsed is _MISSING:
+                parsed = cache[value] = parse_value(value)
+            append(parsed)
+        elif kind in _PLAIN_TYPES:
+            append(value)
+        else:
+            append(parse_value(value))
+    return result
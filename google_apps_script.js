@@ -13,6 +13,11 @@
 // const API_BASE_URL = 'http://18.153.39.218:5000/calc';
 const API_BASE_URL = 'http://35.159.123.184:5000/calc';
 
+// I range con almeno questo numero di celle vengono registrati sul server
+// (/ranges) e inviati per impronta: cinquanta CLOUD_SUMIFS sulla stessa
+// tabella la caricano una volta sola
+const RANGE_REGISTRY_MIN_CELLS = 1000;
+
 /**
  * Esegue calcoli su cloud tramite API
  * 
@@ -105,6 +110,94 @@ function CLOUD_CALC(operation) {
 }
 
 
+/**
+ * Applica un'operazione riga per riga a colonne di argomenti con una sola
+ * chiamata API: il risultato e' un array che si espande (spill) nelle celle
+ * sotto (o a destra, se il primo range e' una riga).
+ * Gli argomenti singoli valgono per tutte le righe; le righe con un
+ * argomento in errore restituiscono l'errore (es: #DIV/0!, #N/A).
+ *
+ * @param {string} operation - Nome dell'operazione (es: 'multiply', 'divide')
+ * @param {...any} columns - Range della stessa dimensione o valori singoli
+ * @return {any[][]} Un risultato per riga
+ * @customfunction
+ */
+function CLOUD_CALC_ARRAY(operation) {
+  if (operation === null || operation === undefined || operation === '') {
+    throw new Error('Operazione mancante. Specificare il nome dell\'operazione come primo argomento.');
+  }
+  if (typeof operation !== 'string') {
+    throw new Error('L\'operazione deve essere una stringa (es: "plus", "multiply").');
+  }
+
+  var columns = [];
+  var isRow = null;
+  for (var i = 1; i < arguments.length; i++) {
+    var arg = arguments[i];
+    if (Array.isArray(arg)) {
+      if (isRow === null) isRow = arg.length === 1 && arg[0].length > 1;
+      columns.push(flattenRange_(arg));
+    } else {
+      columns.push(arg === "" ? null : arg);
+    }
+  }
+
+  var result = callApi_({ 'operation': operation, 'columns': columns });
+  if (!Array.isArray(result)) return result;
+
+  // Risultati vuoti (null) come celle vuote
+  var cells = result.map(function(v) { return (v === null || v === undefined) ? "" : v; });
+  if (isRow) return [cells];
+  return cells.map(function(v) { return [v]; });
+}
+
+
+/**
+ * Molti calcoli diversi con una sola chiamata (/calc/bulk): ogni riga del
+ * range e' operazione seguita dagli argomenti. Restituisce un risultato per
+ * riga; una riga non valida da' "#ERROR: <messaggio>" solo per se'.
+ *
+ * Esempio: =CLOUD_CALC_BULK(A2:D500) con A2 = "plus", B2 = 1, C2 = 2
+ *
+ * @param {A2:D500} rows - Righe [operazione, argomento1, argomento2, ...]
+ * @return {any[][]} Un risultato per riga
+ * @customfunction
+ */
+function CLOUD_CALC_BULK(rows) {
+  if (!Array.isArray(rows)) rows = [[rows]];
+
+  var items = [];
+  rows.forEach(function(row, i) {
+    if (row[0] === "" || row[0] === null) return;  // riga vuota
+    var args = row.slice(1);
+    while (args.length && args[args.length - 1] === "") args.pop();
+    items.push({
+      'id': i,
+      'operation': String(row[0]),
+      'args': args.map(function(v) { return v === "" ? null : v; })
+    });
+  });
+
+  var cells = rows.map(function() { return [""]; });
+  if (!items.length) return cells;
+
+  var response = UrlFetchApp.fetch(API_BASE_URL + '/bulk', {
+    'method': 'post',
+    'contentType': 'application/json',
+    'payload': JSON.stringify({ 'items': items }),
+    'muteHttpExceptions': true
+  });
+  var data = JSON.parse(response.getContentText());
+  if (response.getResponseCode() !== 200) {
+    throw new Error(data.error);
+  }
+
+  data.results.forEach(function(item) {
+    var value = item.error !== undefined ? '#ERROR: ' + item.error : item.result;
+    cells[item.id] = [(value === null || value === undefined) ? "" : value];
+  });
+  return cells;
+}
 
 /**
  * Appiattisce un range di Google Sheets in un array monodimensionale
@@ -178,9 +271,13 @@ function findSheetErrorInRange_(flatRange) {
 }
 
 /**
- * Esegue la chiamata API e restituisce il risultato
+ * Esegue la chiamata API e restituisce il risultato.
+ *
+ * `ranges` (opzionale) contiene i valori dei range inviati per id
+ * ({id: valori}, vedi rangeArg_): se il server non ha ancora un range lo
+ * registra e ripete la chiamata.
  */
-function callApi_(payload) {
+function callApi_(payload, ranges) {
   var options = {
     'method': 'post',
     'contentType': 'application/json',
@@ -189,25 +286,32 @@ function callApi_(payload) {
   };
 
   try {
-    var response = UrlFetchApp.fetch(API_BASE_URL, options);
-    var responseCode = response.getResponseCode();
-    var responseBody = response.getContentText();
-    var contentType = response.getHeaders()['Content-Type'] || '';
-
-    if (contentType.indexOf('application/json') === -1) {
-      throw new Error('Il server non ha risposto con JSON (HTTP ' + responseCode + ').');
-    }
+    var uploads = ranges ? Object.keys(ranges).length : 0;
+    for (var attempt = 0; ; attempt++) {
+      var response = UrlFetchApp.fetch(API_BASE_URL, options);
+      var responseCode = response.getResponseCode();
+      var responseBody = response.getContentText();
+      var contentType = response.getHeaders()['Content-Type'] || '';
+
+      if (contentType.indexOf('application/json') === -1) {
+        throw new Error('Il server non ha risposto con JSON (HTTP ' + responseCode + ').');
+      }
 
-    if (responseCode === 200) {
       var data = JSON.parse(responseBody);
-      var result = data.result;
-      if (result === null || result === undefined) {
-        return "";
+      if (responseCode === 200) {
+        var result = data.result;
+        if (result === null || result === undefined) {
+          return "";
+        }
+        return result;
       }
-      return result;
-    } else {
-      var errorData = JSON.parse(responseBody);
-      throw new Error(errorData.error);
+
+      // Range non (piu') registrato sul server: caricalo e riprova
+      if (responseCode === 404 && ranges && ranges.hasOwnProperty(data.range_id) && attempt < uploads) {
+        registerRange_(data.range_id, ranges[data.range_id]);
+        continue;
+      }
+      throw new Error(data.error);
     }
   } catch (error) {
     if (error instanceof Error) throw error;
@@ -215,6 +319,37 @@ function callApi_(payload) {
   }
 }
 
+/**
+ * Argomento range per il payload: la lista dei valori se piccola, altrimenti
+ * il riferimento {range_id} alla sua impronta SHA-256 (i valori restano in
+ * `ranges` per registrarli se il server non li ha).
+ */
+function rangeArg_(values, ranges) {
+  if (values.length < RANGE_REGISTRY_MIN_CELLS) return values;
+  var digest = Utilities.computeDigest(Utilities.DigestAlgorithm.SHA_256,
+                                       JSON.stringify(values), Utilities.Charset.UTF_8);
+  var id = 'sha256-' + digest.map(function(b) {
+    return ('0' + (b & 0xff).toString(16)).slice(-2);
+  }).join('');
+  ranges[id] = values;
+  return { 'range_id': id };
+}
+
+/**
+ * Registra un range sul server (PUT /ranges/<id>).
+ */
+function registerRange_(id, values) {
+  var response = UrlFetchApp.fetch(API_BASE_URL.replace('/calc', '/ranges/') + encodeURIComponent(id), {
+    'method': 'put',
+    'contentType': 'application/json',
+    'payload': JSON.stringify({ 'values': values }),
+    'muteHttpExceptions': true
+  });
+  if (response.getResponseCode() !== 200) {
+    throw new Error('Registrazione del range non riuscita (HTTP ' + response.getResponseCode() + ').');
+  }
+}
+
 /**
  * SUMIFS su cloud: somma condizionale con criteri multipli.
  * Equivalente a SOMMA.PIÙ.SE / SUMIFS di Google Sheets.
@@ -228,65 +363,263 @@ function callApi_(payload) {
  * @customfunction
  */
 function CLOUD_SUMIFS(sum_range, criteria_range1, criteria1) {
-  // Validazione: sum_range obbligatorio
-  if (sum_range === undefined || sum_range === null) {
-    throw new Error('sum_range mancante. Specificare il range dei valori da sommare.');
+  return conditionalAggregate_('sumifs', 'sum_range', arguments);
+}
+
+/**
+ * COUNTIFS su cloud: conta le righe che soddisfano tutti i criteri.
+ * Equivalente a CONTA.PIÙ.SE / COUNTIFS di Google Sheets.
+ *
+ * @param {B1:B100} criteria_range1 - Primo range di criteri
+ * @param {string} criteria1 - Primo criterio (es: "metano", ">10", "<>0")
+ * @param {C1:C100} criteria_range2 - (Opzionale) Secondo range di criteri
+ * @param {string} criteria2 - (Opzionale) Secondo criterio
+ * @return {number} Numero di righe che soddisfano tutti i criteri
+ * @customfunction
+ */
+function CLOUD_COUNTIFS(criteria_range1, criteria1) {
+  return conditionalAggregate_('countifs', null, arguments);
+}
+
+/**
+ * AVERAGEIFS su cloud: media condizionale con criteri multipli.
+ * Equivalente a MEDIA.PIÙ.SE / AVERAGEIFS di Google Sheets.
+ *
+ * @param {A1:A100} average_range - Range dei valori di cui fare la media
+ * @param {B1:B100} criteria_range1 - Primo range di criteri
+ * @param {string} criteria1 - Primo criterio
+ * @return {number} Media dei valori che soddisfano tutti i criteri
+ * @customfunction
+ */
+function CLOUD_AVERAGEIFS(average_range, criteria_range1, criteria1) {
+  return conditionalAggregate_('averageifs', 'average_range', arguments);
+}
+
+/**
+ * MAXIFS su cloud: massimo condizionale con criteri multipli.
+ *
+ * @param {A1:A100} max_range - Range dei valori
+ * @param {B1:B100} criteria_range1 - Primo range di criteri
+ * @param {string} criteria1 - Primo criterio
+ * @return {number} Massimo dei valori che soddisfano tutti i criteri
+ * @customfunction
+ */
+function CLOUD_MAXIFS(max_range, criteria_range1, criteria1) {
+  return conditionalAggregate_('maxifs', 'max_range', arguments);
+}
+
+/**
+ * MINIFS su cloud: minimo condizionale con criteri multipli.
+ *
+ * @param {A1:A100} min_range - Range dei valori
+ * @param {B1:B100} criteria_range1 - Primo range di criteri
+ * @param {string} criteria1 - Primo criterio
+ * @return {number} Minimo dei valori che soddisfano tutti i criteri
+ * @customfunction
+ */
+function CLOUD_MINIFS(min_range, criteria_range1, criteria1) {
+  return conditionalAggregate_('minifs', 'min_range', arguments);
+}
+
+/**
+ * Valida gli argomenti di una funzione *IFS (range dei valori, se previsto,
+ * seguito da coppie criteria_range/criteria) e chiama l'API.
+ */
+function conditionalAggregate_(operation, valuesField, args) {
+  var first = valuesField ? 1 : 0;
+  var rangeName = valuesField || 'criteria_range 1';
+
+  // Validazione: range dei valori obbligatorio
+  if (valuesField && (args[0] === undefined || args[0] === null)) {
+    throw new Error(valuesField + ' mancante. Specificare il range dei valori.');
   }
 
   // Validazione: almeno una coppia criteria_range/criteria
-  if (arguments.length < 3) {
-    throw new Error('Servono almeno sum_range, criteria_range e criteria. Forniti solo ' + arguments.length + ' argomenti.');
+  if (args.length < first + 2) {
+    throw new Error('Servono almeno ' + (valuesField ? valuesField + ', ' : '') + 'criteria_range e criteria. Forniti solo ' + args.length + ' argomenti.');
   }
 
   // Validazione: argomenti a coppie (criteria_range + criteria)
-  if ((arguments.length - 1) % 2 !== 0) {
-    throw new Error('Gli argomenti dopo sum_range devono essere a coppie (criteria_range, criteria). Numero di argomenti non valido.');
+  if ((args.length - first) % 2 !== 0) {
+    throw new Error('Gli argomenti' + (valuesField ? ' dopo ' + valuesField : '') + ' devono essere a coppie (criteria_range, criteria). Numero di argomenti non valido.');
   }
 
-  var flatSumRange = flattenRange_(sum_range);
+  var payload = { 'operation': operation };
+  var ranges = {};
+  var expectedLength = null;
+
+  if (valuesField) {
+    var flatValues = flattenRange_(args[0]);
 
-  // Validazione: errori di Sheets nel sum_range
-  var sumRangeError = findSheetErrorInRange_(flatSumRange);
-  if (sumRangeError) {
-    throw new Error('sum_range contiene un errore di Sheets (' + sumRangeError + '). Verificare le celle di input.');
+    // Validazione: errori di Sheets nel range dei valori
+    var valuesError = findSheetErrorInRange_(flatValues);
+    if (valuesError) {
+      throw new Error(valuesField + ' contiene un errore di Sheets (' + valuesError + '). Verificare le celle di input.');
+    }
+    payload[valuesField] = rangeArg_(flatValues, ranges);
+    expectedLength = flatValues.length;
   }
 
   var criteriaPairs = [];
 
-  // Argomenti a coppie: criteria_range, criteria (a partire dall'indice 1)
-  for (var i = 1; i < arguments.length; i += 2) {
-    var criteriaRange = flattenRange_(arguments[i]);
-    var criteria = arguments[i + 1];
+  // Argomenti a coppie: criteria_range, criteria
+  for (var i = first; i < args.length; i += 2) {
+    var n = (i - first) / 2 + 1;
+    var criteriaRange = flattenRange_(args[i]);
+    var criteria = args[i + 1];
 
     // Validazione: errori di Sheets nel criteria_range
     var criteriaRangeError = findSheetErrorInRange_(criteriaRange);
     if (criteriaRangeError) {
-      throw new Error('criteria_range ' + Math.ceil(i / 2) + ' contiene un errore di Sheets (' + criteriaRangeError + '). Verificare le celle di input.');
+      throw new Error('criteria_range ' + n + ' contiene un errore di Sheets (' + criteriaRangeError + '). Verificare le celle di input.');
     }
 
-    // Validazione: criteria_range deve avere la stessa lunghezza di sum_range
-    if (criteriaRange.length !== flatSumRange.length) {
-      throw new Error('criteria_range ' + Math.ceil(i / 2) + ' ha ' + criteriaRange.length + ' elementi, ma sum_range ne ha ' + flatSumRange.length + '. I range devono avere la stessa lunghezza.');
+    // Validazione: tutti i range devono avere la stessa lunghezza
+    if (expectedLength === null) {
+      expectedLength = criteriaRange.length;
+    } else if (criteriaRange.length !== expectedLength) {
+      throw new Error('criteria_range ' + n + ' ha ' + criteriaRange.length + ' elementi, ma ' + rangeName + ' ne ha ' + expectedLength + '. I range devono avere la stessa lunghezza.');
     }
 
     // Validazione: errori di Sheets nel criterio
     if (containsSheetError_(criteria)) {
-      throw new Error('Il criterio ' + Math.ceil(i / 2) + ' contiene un errore di Sheets (' + criteria + ').');
+      throw new Error('Il criterio ' + n + ' contiene un errore di Sheets (' + criteria + ').');
     }
 
     criteriaPairs.push({
-      'range': criteriaRange,
+      'range': rangeArg_(criteriaRange, ranges),
       'criteria': criteria === "" ? null : criteria
     });
   }
 
+  payload['criteria_pairs'] = criteriaPairs;
+  return callApi_(payload, ranges);
+}
+
+/**
+ * MATCH su cloud: posizione di search_key nel range.
+ * Equivalente a CONFRONTA / MATCH di Google Sheets. Con un range di chiavi
+ * risponde a tutte in una sola chiamata (una posizione per chiave).
+ *
+ * @param {any} search_key - Valore (o range di valori) da cercare
+ * @param {A1:A100} range - Range monodimensionale in cui cercare
+ * @param {number} search_type - (Opzionale) 1 (default, ordinato crescente), 0 (esatto), -1 (ordinato decrescente)
+ * @return {number} Posizione (da 1) o "#N/A"
+ * @customfunction
+ */
+function CLOUD_MATCH(search_key, range, search_type) {
+  var ranges = {};
+  var payload = {
+    'operation': 'match',
+    'lookup_range': lookupRangeArg_('range', range, ranges),
+    'match_type': search_type === undefined || search_type === "" ? 1 : search_type
+  };
+  return lookupCall_(payload, search_key, ranges);
+}
+
+/**
+ * VLOOKUP su cloud: cerca search_key nella prima colonna di range e
+ * restituisce il valore della colonna index.
+ * Equivalente a CERCA.VERT / VLOOKUP di Google Sheets.
+ *
+ * @param {any} search_key - Valore (o range di valori) da cercare
+ * @param {A1:C100} range - Tabella: la ricerca avviene sulla prima colonna
+ * @param {number} index - Colonna (da 1) del valore da restituire
+ * @param {boolean} is_sorted - (Opzionale) TRUE (default) ricerca approssimata su dati ordinati, FALSE esatta
+ * @return {any} Valore trovato o "#N/A"
+ * @customfunction
+ */
+function CLOUD_VLOOKUP(search_key, range, index, is_sorted) {
+  if (!Array.isArray(range)) {
+    throw new Error('range deve essere un intervallo di celle.');
+  }
+  if (typeof index !== 'number' || index < 1 || index % 1 !== 0) {
+    throw new Error('index deve essere un intero maggiore o uguale a 1.');
+  }
+  if (index > range[0].length) {
+    throw new Error('index ' + index + ' oltre le ' + range[0].length + ' colonne di range.');
+  }
+
+  // Al server servono solo la prima colonna e la colonna index
+  var ranges = {};
   var payload = {
-    'operation': 'sumifs',
-    'sum_range': flatSumRange,
-    'criteria_pairs': criteriaPairs
+    'operation': 'vlookup',
+    'lookup_range': lookupRangeArg_('range', range.map(function(row) { return [row[0]]; }), ranges),
+    'return_range': rangeArg_(flattenRange_(range.map(function(row) { return [row[index - 1]]; })), ranges),
+    'range_lookup': is_sorted === undefined || is_sorted === "" ? true : is_sorted
   };
+  return lookupCall_(payload, search_key, ranges);
+}
 
-  return callApi_(payload);
+/**
+ * XLOOKUP su cloud: cerca search_key in lookup_range e restituisce il valore
+ * corrispondente di result_range.
+ * Equivalente a CERCA.X / XLOOKUP di Google Sheets.
+ *
+ * @param {any} search_key - Valore (o range di valori) da cercare
+ * @param {A1:A100} lookup_range - Range monodimensionale in cui cercare
+ * @param {B1:B100} result_range - Range dei risultati, della stessa dimensione
+ * @param {any} missing_value - (Opzionale) Valore se non trovato (default "#N/A")
+ * @param {number} match_mode - (Opzionale) 0 esatto (default), -1 esatto o minore, 1 esatto o maggiore, 2 caratteri jolly
+ * @param {number} search_mode - (Opzionale) 1 dal primo (default), -1 dall'ultimo
+ * @return {any} Valore trovato
+ * @customfunction
+ */
+function CLOUD_XLOOKUP(search_key, lookup_range, result_range, missing_value, match_mode, search_mode) {
+  var ranges = {};
+  var lookupValues = lookupRangeArg_('lookup_range', lookup_range, ranges);
+  var resultValues = flattenRange_(result_range);
+  var resultError = findSheetErrorInRange_(resultValues);
+  if (resultError) {
+    throw new Error('result_range contiene un errore di Sheets (' + resultError + '). Verificare le celle di input.');
+  }
+  if (resultValues.length !== flattenRange_(lookup_range).length) {
+    throw new Error('lookup_range e result_range devono avere la stessa dimensione.');
+  }
+
+  var payload = {
+    'operation': 'xlookup',
+    'lookup_range': lookupValues,
+    'return_range': rangeArg_(resultValues, ranges),
+    'match_mode': match_mode === undefined || match_mode === "" ? 0 : match_mode,
+    'search_mode': search_mode === undefined || search_mode === "" ? 1 : search_mode
+  };
+  if (missing_value !== undefined) payload['if_not_found'] = missing_value === "" ? null : missing_value;
+  return lookupCall_(payload, search_key, ranges);
+}
+
+/**
+ * Range in cui cercare: validato, appiattito e passato per valori o per id.
+ */
+function lookupRangeArg_(name, range, ranges) {
+  var values = flattenRange_(range);
+  var error = findSheetErrorInRange_(values);
+  if (error) {
+    throw new Error(name + ' contiene un errore di Sheets (' + error + '). Verificare le celle di input.');
+  }
+  return rangeArg_(values, ranges);
+}
+
+/**
+ * Chiama l'API di ricerca per una chiave o per un range di chiavi
+ * ("lookup_values": una sola chiamata, risultati in colonna o in riga).
+ */
+function lookupCall_(payload, searchKey, ranges) {
+  if (!Array.isArray(searchKey)) {
+    if (containsSheetError_(searchKey)) {
+      throw new Error('search_key contiene un errore di Sheets (' + searchKey + ').');
+    }
+    payload['lookup_value'] = searchKey === "" ? null : searchKey;
+    return callApi_(payload, ranges);
+  }
+
+  var isRow = searchKey.length === 1 && searchKey[0].length > 1;
+  payload['lookup_values'] = flattenRange_(searchKey);
+  var cells = callApi_(payload, ranges).map(function(v) {
+    return (v === null || v === undefined) ? "" : v;
+  });
+  if (isRow) return [cells];
+  return cells.map(function(v) { return [v]; });
 }
 
 /**
@@ -321,12 +654,21 @@ function CLOUD_CALC_OPERATIONS() {
 // =CLOUD_CALC("max"; D1; D2; D3; D4)
 // =CLOUD_CALC("concat"; E1; " "; E2)
 //
+// --- Colonne (una sola chiamata, risultato in colonna) ---
+// =CLOUD_CALC_ARRAY("multiply"; A2:A5000; B2:B5000)
+// =CLOUD_CALC_ARRAY("divide"; C2:C5000; 1,22)
+//
 // --- IFERROR (usa il nativo SE.ERRORE / IFERROR di Sheets) ---
 // =SE.ERRORE(CLOUD_CALC("divide"; A1; B1); 0)
 //
 // --- SUMIFS ---
 // =CLOUD_SUMIFS(P1:P100; N1:N100; "H Rilevate"; H1:H100; "metano")
 //
+// --- COUNTIFS / AVERAGEIFS / MAXIFS / MINIFS ---
+// =CLOUD_COUNTIFS(N1:N100; "H Rilevate"; H1:H100; "metano")
+// =CLOUD_AVERAGEIFS(P1:P100; N1:N100; "H Rilevate")
+// =CLOUD_MAXIFS(P1:P100; H1:H100; "met*")
+//
 // Esempio completo (equivale a =SE.ERRORE(SOMMA.PIÙ.SE(...)/SOMMA.PIÙ.SE(...);0)):
 // =SE.ERRORE(CLOUD_SUMIFS(P$28:P$4247; $N$28:$N$4247; "H Rilevate"; $H$28:$H$4247; "metano") / CLOUD_SUMIFS(P$28:P$4247; $N$28:$N$4247; "H Rif"; $H$28:$H$4247; "metano"); 0)
 //
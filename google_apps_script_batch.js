@@ -16,11 +16,21 @@
 // 3. "Congela formule" (o selezione) -> le formule diventano testo, Sheets smette di calcolare
 // 4. "Calcola tutto" -> invia le formule congelate al cloud
 //    I risultati vanno in un foglio "<nome_foglio>_RES" con lo stesso stile del sorgente
+// 5. "Ricalcola modifiche" -> invia solo le celle valore cambiate dall'ultimo
+//    "Calcola tutto" e aggiorna solo le celle risultato cambiate
+// 6. "Calcola CLOUD_CALC_BATCH" -> invia in una sola request tutte le formule
+//    CLOUD_CALC_BATCH / CLOUD del foglio (o della selezione) a /batch_calc/bulk
+//    e scrive i risultati nel foglio "<nome_foglio>_RES"
 
 // ⚠️ CONFIGURA IL TUO ENDPOINT QUI
 // var BATCH_API_URL = 'http://18.153.39.218:5000';
 var BATCH_API_URL = 'http://35.159.123.184:5000';
 
+// Oltre questo numero di celle "Calcola tutto" usa le sessioni a blocchi
+// (/eval_sheet/session): righe inviate e risultati scaricati a blocchi,
+// senza un unico payload JSON grande quanto il foglio
+var EVAL_CHUNK_MIN_CELLS = 200000;
+
 
 // ⚠️ PREREQUISITO: Abilita il servizio avanzato "Google Sheets API"
 // 1. In Apps Script, vai su Servizi (icona +) nel pannello a sinistra
@@ -34,6 +44,9 @@ function onOpen() {
   SpreadsheetApp.getUi()
     .createMenu('Cloud Calc')
     .addItem('Calcola tutto', 'evaluateSheet')
+    .addItem('Ricalcola modifiche', 'evaluateSheetDelta')
+    .addItem('Calcola CLOUD_CALC_BATCH (tutto il foglio)', 'evaluateBatchCells')
+    .addItem('Calcola CLOUD_CALC_BATCH (selezione)', 'evaluateBatchSelection')
     .addSeparator()
     .addItem('Congela formule (tutto il foglio)', 'freezeAll')
     .addItem('Scongela formule (tutto il foglio)', 'unfreezeAll')
@@ -228,54 +241,37 @@ function evaluateSheet() {
     return;
   }
 
-  var startTime = new Date().getTime();
+  if (dataRange.getNumRows() * dataRange.getNumColumns() > EVAL_CHUNK_MIN_CELLS) {
+    evaluateSheetChunked_(sourceSheet, dataRange, resName);
+    return;
+  }
 
-  var rawValues = dataRange.getValues();
-  var realFormulas = dataRange.getFormulas();
+  var startTime = new Date().getTime();
 
   // 2. Separa formule dai valori
-  var formulas = [];
-  var values = [];
-
-  for (var r = 0; r < rawValues.length; r++) {
-    var formulaRow = [];
-    var valueRow = [];
-    for (var c = 0; c < rawValues[r].length; c++) {
-      var val = rawValues[r][c];
-      var realFormula = realFormulas[r][c];
-
-      if (realFormula) {
-        formulaRow.push(realFormula);
-        valueRow.push(null);
-      } else if (typeof val === 'string' && val.charAt(0) === '=') {
-        formulaRow.push(val);
-        valueRow.push(null);
-      } else {
-        formulaRow.push('');
-        if (val instanceof Date) {
-          valueRow.push(val.toISOString());
-        } else if (val === '') {
-          valueRow.push(null);
-        } else {
-          valueRow.push(val);
-        }
-      }
-    }
-    formulas.push(formulaRow);
-    values.push(valueRow);
-  }
+  var grids = readSheetForEval_(dataRange);
+  var formulas = grids.formulas;
+  var values = grids.values;
 
-  // 3. Prepara il payload
+  // 3. Prepara il payload in formato sparso: solo le celle popolate,
+  //    come triple [riga, colonna, contenuto] (indici 0-based)
+  var numRows = formulas.length;
+  var numCols = numRows > 0 ? formulas[0].length : 0;
   var payload = {
-    'formulas': formulas,
-    'values': values
+    'format': 'sparse',
+    'rows': numRows,
+    'cols': numCols,
+    'formulas': toSparse_(formulas, function (f) { return f !== ''; }),
+    'values': toSparse_(values, function (v) { return v !== null; })
   };
 
-  // 4. Invia al server
+  // 4. Invia al server (body compresso gzip: il server lo decomprime
+  //    da Content-Encoding; la risposta compressa e' decodificata da UrlFetchApp)
   var options = {
     'method': 'post',
     'contentType': 'application/json',
-    'payload': JSON.stringify(payload),
+    'headers': { 'Content-Encoding': 'gzip' },
+    'payload': Utilities.gzip(Utilities.newBlob(JSON.stringify(payload))).getBytes(),
     'muteHttpExceptions': true
   };
 
@@ -299,7 +295,9 @@ function evaluateSheet() {
     }
 
     var data = JSON.parse(responseBody);
-    var results = data.results;
+    var results = data.format === 'sparse'
+      ? fromSparse_(data.results, data.rows, data.cols)
+      : data.results;
 
     if (!results || results.length === 0) {
       ui.alert('Errore', 'Il server ha restituito risultati vuoti.', ui.ButtonSet.OK);
@@ -332,6 +330,9 @@ function evaluateSheet() {
     // Scrivi i valori (sovrascrive formule e testo, mantiene la formattazione)
     resultsSheet.getRange(1, 1, results.length, maxCols).setValues(results);
 
+    // Ricorda il modello valutato: "Ricalcola modifiche" inviera' solo le differenze
+    saveEvalState_(sourceSheet, data, formulas);
+
     // 7. Report
     var elapsed = new Date().getTime() - startTime;
     var stats = data.stats || {};
@@ -350,6 +351,325 @@ function evaluateSheet() {
 }
 
 
+/**
+ * "Calcola tutto" per fogli grandi: apre una sessione sul server, invia le
+ * righe a blocchi, avvia il calcolo e scarica i risultati a blocchi di
+ * righe, scrivendoli nel foglio "<nome>_RES" man mano che arrivano.
+ */
+function evaluateSheetChunked_(sourceSheet, dataRange, resName) {
+  var ui = SpreadsheetApp.getUi();
+  var ss = SpreadsheetApp.getActiveSpreadsheet();
+  var startTime = new Date().getTime();
+  var numRows = dataRange.getNumRows();
+  var numCols = dataRange.getNumColumns();
+  var sessionUrl = null;
+
+  try {
+    // 1. Apri la sessione
+    var session = fetchJson_('post', BATCH_API_URL + '/eval_sheet/session', { rows: numRows, cols: numCols });
+    sessionUrl = BATCH_API_URL + '/eval_sheet/session/' + session.session_id;
+    var chunkRows = session.chunk_rows;
+
+    // 2. Invia le righe a blocchi (le formule servono anche per l'impronta
+    //    usata da "Ricalcola modifiche")
+    var formulas = [];
+    for (var start = 0; start < numRows; start += chunkRows) {
+      var count = Math.min(chunkRows, numRows - start);
+      ss.toast('Invio righe ' + (start + 1) + '-' + (start + count) + ' di ' + numRows + '...', 'Cloud Calc', -1);
+      var grids = readSheetForEval_(sourceSheet.getRange(start + 1, 1, count, numCols));
+      fetchJson_('post', sessionUrl + '/rows', {
+        start_row: start,
+        formulas: grids.formulas,
+        values: grids.values
+      });
+      Array.prototype.push.apply(formulas, grids.formulas);
+    }
+
+    // 3. Calcola
+    ss.toast('Calcolo in corso...', 'Cloud Calc', -1);
+    var data = fetchJson_('post', sessionUrl + '/calculate', {});
+
+    // 4. Ricrea il foglio risultati con lo stile del sorgente
+    var resultsSheet = ss.getSheetByName(resName);
+    if (resultsSheet) {
+      ss.deleteSheet(resultsSheet);
+    }
+    resultsSheet = sourceSheet.copyTo(ss);
+    resultsSheet.setName(resName);
+
+    // 5. Scarica e scrivi i risultati un blocco di righe alla volta
+    var nextRow = 0;
+    while (nextRow !== null) {
+      var page = fetchJson_('get', sessionUrl + '/results?start_row=' + nextRow + '&rows=' + chunkRows);
+      resultsSheet.getRange(page.start_row + 1, 1, page.results.length, numCols).setValues(page.results);
+      nextRow = page.next_row;
+    }
+
+    saveEvalState_(sourceSheet, data, formulas);
+
+    var elapsed = new Date().getTime() - startTime;
+    var stats = data.stats || {};
+    ss.toast(
+      'Risultati scritti in "' + resName + '" (' + (elapsed / 1000).toFixed(1) + 's)'
+        + '\nFormule calcolate: ' + stats.formula_cells
+        + '\nCelle totali: ' + stats.total_cells,
+      'Cloud Calc', 5
+    );
+
+  } catch (error) {
+    ui.alert('Errore', error.message || error.toString(), ui.ButtonSet.OK);
+  } finally {
+    if (sessionUrl) {
+      UrlFetchApp.fetch(sessionUrl, { 'method': 'delete', 'muteHttpExceptions': true });
+    }
+  }
+}
+
+
+/**
+ * Richiesta JSON al server; ritorna la risposta decodificata o lancia un
+ * Error con il messaggio del server.
+ */
+function fetchJson_(method, url, payload) {
+  var options = { 'method': method, 'muteHttpExceptions': true };
+  if (payload !== undefined) {
+    options.contentType = 'application/json';
+    options.payload = JSON.stringify(payload);
+  }
+  var response = UrlFetchApp.fetch(url, options);
+  var responseCode = response.getResponseCode();
+  var contentType = response.getHeaders()['Content-Type'] || '';
+  if (contentType.indexOf('application/json') === -1) {
+    throw new Error('Il server non ha risposto con JSON (HTTP ' + responseCode + '). Verifica che l\'endpoint sia raggiungibile.');
+  }
+  var data = JSON.parse(response.getContentText());
+  if (responseCode !== 200) {
+    throw new Error(data.error || 'Errore sconosciuto (HTTP ' + responseCode + ')');
+  }
+  return data;
+}
+
+
+/**
+ * Ricalcolo incrementale: confronta le celle valore del foglio attivo con
+ * quelle scritte nel foglio "<nome>_RES" all'ultimo "Calcola tutto" e invia
+ * al server (/eval_sheet/delta) solo le celle modificate.
+ * Il server ricalcola solo le celle a valle e restituisce solo quelle cambiate.
+ *
+ * Se le formule sono cambiate, il foglio _RES non esiste o il server non ha
+ * piu' il modello, ripiega su evaluateSheet().
+ */
+function evaluateSheetDelta() {
+  var ss = SpreadsheetApp.getActiveSpreadsheet();
+  var sourceSheet = ss.getActiveSheet();
+  var resName = sourceSheet.getName() + '_RES';
+  var resultsSheet = ss.getSheetByName(resName);
+  var state = loadEvalState_(sourceSheet);
+
+  if (!state || !resultsSheet) {
+    evaluateSheet();
+    return;
+  }
+
+  var startTime = new Date().getTime();
+  var dataRange = sourceSheet.getDataRange();
+  var grids = readSheetForEval_(dataRange);
+  var numRows = grids.values.length;
+  var numCols = numRows > 0 ? grids.values[0].length : 0;
+
+  // Formule o dimensioni cambiate: serve un ricalcolo completo
+  if (numRows !== state.rows || numCols !== state.cols
+      || formulasDigest_(grids.formulas) !== state.formulas_digest) {
+    evaluateSheet();
+    return;
+  }
+
+  // Confronta le celle valore con quelle nel foglio _RES
+  var resValues = resultsSheet.getRange(1, 1, numRows, numCols).getValues();
+  var changes = [];
+  for (var r = 0; r < numRows; r++) {
+    for (var c = 0; c < numCols; c++) {
+      if (grids.formulas[r][c]) continue;
+      var val = grids.values[r][c];
+      if (val !== normalizeEvalValue_(resValues[r][c])) {
+        changes.push({ cell: columnToLetter_(c + 1) + (r + 1), value: val });
+      }
+    }
+  }
+
+  if (changes.length === 0) {
+    ss.toast('Nessuna modifica da ricalcolare.', 'Cloud Calc', 3);
+    return;
+  }
+
+  var options = {
+    'method': 'post',
+    'contentType': 'application/json',
+    'payload': JSON.stringify({
+      'model_id': state.model_id,
+      'version': state.version,
+      'changes': changes
+    }),
+    'muteHttpExceptions': true
+  };
+
+  try {
+    var response = UrlFetchApp.fetch(BATCH_API_URL + '/eval_sheet/delta', options);
+    var responseCode = response.getResponseCode();
+
+    if (responseCode === 409) {
+      // Modello scaduto o modificato da un altro utente: ricalcolo completo
+      evaluateSheet();
+      return;
+    }
+
+    var data = JSON.parse(response.getContentText());
+    if (responseCode !== 200) {
+      SpreadsheetApp.getUi().alert('Errore dal server', data.error || 'Errore sconosciuto (HTTP ' + responseCode + ')', SpreadsheetApp.getUi().ButtonSet.OK);
+      return;
+    }
+
+    for (var i = 0; i < data.changes.length; i++) {
+      resultsSheet.getRange(data.changes[i].cell).setValue(data.changes[i].value);
+    }
+
+    state.version = data.version;
+    PropertiesService.getDocumentProperties().setProperty(
+      evalStateKey_(sourceSheet), JSON.stringify(state)
+    );
+
+    var elapsed = new Date().getTime() - startTime;
+    ss.toast(
+      'Celle modificate: ' + changes.length + '\nCelle aggiornate in "' + resName + '": '
+        + data.changes.length + ' (' + (elapsed / 1000).toFixed(1) + 's)',
+      'Cloud Calc', 5
+    );
+
+  } catch (error) {
+    SpreadsheetApp.getUi().alert('Errore di connessione', 'Impossibile contattare il server:\n' + error.toString(), SpreadsheetApp.getUi().ButtonSet.OK);
+  }
+}
+
+
+/**
+ * Legge un range e separa le formule (vere o congelate come testo "=...")
+ * dai valori, nel formato atteso da /eval_sheet.
+ */
+function readSheetForEval_(dataRange) {
+  var rawValues = dataRange.getValues();
+  var realFormulas = dataRange.getFormulas();
+  var formulas = [];
+  var values = [];
+
+  for (var r = 0; r < rawValues.length; r++) {
+    var formulaRow = [];
+    var valueRow = [];
+    for (var c = 0; c < rawValues[r].length; c++) {
+      var val = rawValues[r][c];
+      var realFormula = realFormulas[r][c];
+
+      if (realFormula) {
+        formulaRow.push(realFormula);
+        valueRow.push(null);
+      } else if (typeof val === 'string' && val.charAt(0) === '=') {
+        formulaRow.push(val);
+        valueRow.push(null);
+      } else {
+        formulaRow.push('');
+        valueRow.push(normalizeEvalValue_(val));
+      }
+    }
+    formulas.push(formulaRow);
+    values.push(valueRow);
+  }
+  return { formulas: formulas, values: values };
+}
+
+
+/**
+ * Converte una griglia densa in triple [riga, colonna, valore] per le sole
+ * celle per cui keep(valore) e' vero.
+ */
+function toSparse_(grid, keep) {
+  var out = [];
+  for (var r = 0; r < grid.length; r++) {
+    for (var c = 0; c < grid[r].length; c++) {
+      if (keep(grid[r][c])) out.push([r, c, grid[r][c]]);
+    }
+  }
+  return out;
+}
+
+
+/**
+ * Ricostruisce una griglia densa (celle vuote = '') da triple [riga, colonna, valore].
+ */
+function fromSparse_(triples, numRows, numCols) {
+  var grid = [];
+  for (var r = 0; r < numRows; r++) {
+    var row = [];
+    for (var c = 0; c < numCols; c++) row.push('');
+    grid.push(row);
+  }
+  for (var i = 0; i < triples.length; i++) {
+    grid[triples[i][0]][triples[i][1]] = triples[i][2];
+  }
+  return grid;
+}
+
+
+/**
+ * Normalizza un valore di cella come viene inviato al server
+ * (date in ISO, celle vuote a null).
+ */
+function normalizeEvalValue_(val) {
+  if (val instanceof Date) return val.toISOString();
+  if (val === '') return null;
+  return val;
+}
+
+
+/**
+ * Impronta (SHA-1 esadecimale) della griglia delle formule.
+ */
+function formulasDigest_(formulas) {
+  var bytes = Utilities.computeDigest(Utilities.DigestAlgorithm.SHA_1, JSON.stringify(formulas));
+  var hex = '';
+  for (var i = 0; i < bytes.length; i++) {
+    var b = (bytes[i] + 256) % 256;
+    hex += (b < 16 ? '0' : '') + b.toString(16);
+  }
+  return hex;
+}
+
+
+function evalStateKey_(sheet) {
+  return 'CLOUD_CALC_EVAL_' + sheet.getSheetId();
+}
+
+
+/**
+ * Salva (nelle proprieta' del documento) il modello restituito da /eval_sheet.
+ */
+function saveEvalState_(sheet, data, formulas) {
+  if (!data.model_id) return;
+  var state = {
+    model_id: data.model_id,
+    version: data.version,
+    rows: formulas.length,
+    cols: formulas.length > 0 ? formulas[0].length : 0,
+    formulas_digest: formulasDigest_(formulas)
+  };
+  PropertiesService.getDocumentProperties().setProperty(evalStateKey_(sheet), JSON.stringify(state));
+}
+
+
+function loadEvalState_(sheet) {
+  var raw = PropertiesService.getDocumentProperties().getProperty(evalStateKey_(sheet));
+  return raw ? JSON.parse(raw) : null;
+}
+
+
 // ============================================
 // CUSTOM FUNCTION BATCH - CLOUD_CALC_BATCH
 // ============================================
@@ -423,6 +743,7 @@ function CLOUD_CALC_BATCH(operation) {
 
   // -- 6. Chiamata al server batch ---------------------------------------
   var payload = {
+    sheet_id: batchSheetId_(),
     cell: callingCell,
     operation: operation,
     args: payload_args
@@ -460,10 +781,213 @@ function CLOUD_CALC_BATCH(operation) {
 }
 
 
+// =========================================================================
+// CLOUD_CALC_BATCH in una sola request (/batch_calc/bulk)
+// =========================================================================
+//
+// Invece di una request per cella (una per ogni custom function) il menu
+// legge tutte le formule CLOUD_CALC_BATCH / CLOUD del foglio o della
+// selezione, anche congelate come testo, e le invia insieme: il server le
+// risolve subito in ordine di dipendenza e restituisce la mappa dei risultati.
+
+var BATCH_FORMULA_PATTERN = /^=\s*(CLOUD_CALC_BATCH|CLOUD)\s*\(/i;
+
+/**
+ * Calcola in una request tutte le formule CLOUD_CALC_BATCH del foglio attivo.
+ */
+function evaluateBatchCells() {
+  var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
+  evaluateBatchRange_(sheet, sheet.getDataRange());
+}
+
+/**
+ * Calcola in una request le formule CLOUD_CALC_BATCH della selezione.
+ */
+function evaluateBatchSelection() {
+  var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
+  var range = sheet.getActiveRange();
+  if (!range) {
+    SpreadsheetApp.getUi().alert('Seleziona un intervallo di celle.');
+    return;
+  }
+  evaluateBatchRange_(sheet, range);
+}
+
+/**
+ * Invia a /batch_calc/bulk le formule CLOUD_CALC_BATCH di `range` e scrive
+ * i risultati nelle stesse celle del foglio "<nome>_RES".
+ * Le formule con argomenti non semplici (funzioni annidate, operazione non
+ * letterale) o non composte dalla sola chiamata vengono saltate.
+ */
+function evaluateBatchRange_(sheet, range) {
+  var ui = SpreadsheetApp.getUi();
+  var ss = SpreadsheetApp.getActiveSpreadsheet();
+  var sourceName = sheet.getName();
+  var resName = sourceName + '_RES';
+
+  if (sourceName.indexOf('_RES') === sourceName.length - 4) {
+    ui.alert('Errore', 'Non puoi eseguire il calcolo su un foglio risultati (_RES). Seleziona il foglio sorgente.', ui.ButtonSet.OK);
+    return;
+  }
+
+  var startTime = new Date().getTime();
+
+  // 1. Formule e valori di tutto il foglio: i riferimenti possono puntare
+  //    fuori dalla selezione
+  var grids = readSheetForEval_(sheet.getDataRange());
+  var numRows = Math.min(range.getLastRow(), grids.formulas.length);
+  var numCols = grids.formulas.length > 0 ? Math.min(range.getLastColumn(), grids.formulas[0].length) : 0;
+
+  // 2. Una entry {cell, operation, args} per ogni formula del range
+  var cells = [];
+  var skipped = 0;
+  for (var r = range.getRow() - 1; r < numRows; r++) {
+    for (var c = range.getColumn() - 1; c < numCols; c++) {
+      var formula = grids.formulas[r][c];
+      if (!formula || !BATCH_FORMULA_PATTERN.test(formula)) continue;
+      var cell = batchCellFromFormula_(formula, grids);
+      if (cell === null) {
+        skipped++;
+        continue;
+      }
+      cell.cell = columnToLetter_(c + 1) + (r + 1);
+      cells.push(cell);
+    }
+  }
+
+  if (cells.length === 0) {
+    ui.alert('Cloud Calc', 'Nessuna formula CLOUD_CALC_BATCH da calcolare'
+      + (skipped ? ' (' + skipped + ' non supportate).' : '.'), ui.ButtonSet.OK);
+    return;
+  }
+
+  try {
+    ss.toast('Invio di ' + cells.length + ' celle al server...', 'Cloud Calc', -1);
+
+    // 3. Una sola request per tutte le celle
+    var data = fetchJson_('post', BATCH_CALC_URL + '/bulk', {
+      sheet_id: batchSheetId_(sheet),
+      cells: cells
+    });
+
+    // 4. Scrivi i risultati nel foglio _RES (creato copiando il sorgente)
+    var resultsSheet = ss.getSheetByName(resName);
+    if (!resultsSheet) {
+      resultsSheet = sheet.copyTo(ss);
+      resultsSheet.setName(resName);
+    }
+    var top = range.getRow();
+    var left = range.getColumn();
+    var target = resultsSheet.getRange(top, left, numRows - top + 1, numCols - left + 1);
+    var out = target.getValues();
+    for (var i = 0; i < cells.length; i++) {
+      var result = data.results[cells[i].cell] || { error: 'Cella non risolta' };
+      var pos = parseCellRef_(cells[i].cell);
+      out[pos.row - top][pos.col - left] = result.error !== undefined
+        ? '#ERROR: ' + result.error
+        : (result.result === null || result.result === undefined ? '' : result.result);
+    }
+    target.setValues(out);
+
+    // 5. Report
+    var elapsed = new Date().getTime() - startTime;
+    var msg = 'Risultati scritti in "' + resName + '" (' + (elapsed / 1000).toFixed(1) + 's)'
+      + '\nCelle calcolate: ' + data.cells;
+    if (data.errors) msg += '\nErrori: ' + data.errors;
+    if (skipped) msg += '\nFormule non supportate: ' + skipped;
+    ss.toast(msg, 'Cloud Calc', 5);
+
+  } catch (error) {
+    ui.alert('Errore', 'Calcolo non riuscito:\n' + error.toString(), ui.ButtonSet.OK);
+  }
+}
+
+/**
+ * Converte una formula CLOUD_CALC_BATCH in {operation, args} per
+ * /batch_calc/bulk, leggendo i valori dei riferimenti da `grids`
+ * (readSheetForEval_). Un intervallo (A1:B3) diventa un argomento per cella.
+ * Ritorna null se la formula non e' convertibile.
+ */
+function batchCellFromFormula_(formula, grids) {
+  var call = batchFormulaArgs_(formula);
+  if (!call || call.rest.trim() !== '' || call.args.length === 0) return null;
+
+  var operation = batchLiteral_(call.args[0].trim());
+  if (operation === undefined || typeof operation !== 'string' || operation === '') return null;
+
+  var cellRefPattern = /^\$?([A-Z]{1,3})\$?([0-9]+)(?::\$?([A-Z]{1,3})\$?([0-9]+))?$/i;
+  var args = [];
+  for (var i = 1; i < call.args.length; i++) {
+    var raw = call.args[i].trim();
+    var m = raw.match(cellRefPattern);
+    if (m) {
+      var c1 = letterToColumn_(m[1]), r1 = parseInt(m[2], 10);
+      var c2 = m[3] ? letterToColumn_(m[3]) : c1, r2 = m[4] ? parseInt(m[4], 10) : r1;
+      for (var r = Math.min(r1, r2); r <= Math.max(r1, r2); r++) {
+        for (var c = Math.min(c1, c2); c <= Math.max(c1, c2); c++) {
+          args.push({ ref: columnToLetter_(c) + r, value: batchGridValue_(grids, r, c) });
+        }
+      }
+      continue;
+    }
+    var literal = batchLiteral_(raw);
+    if (literal === undefined) return null;
+    args.push({ value: literal });
+  }
+  return { operation: operation, args: args };
+}
+
+/**
+ * Valore di una cella (riga e colonna 1-based) come lo vede il server:
+ * null per celle vuote o formule (il server usa il valore calcolato).
+ */
+function batchGridValue_(grids, row, col) {
+  var values = grids.values[row - 1];
+  if (!values || col > values.length) return null;
+  var val = values[col - 1];
+  return val === undefined ? null : val;
+}
+
+/**
+ * Valore di un argomento letterale: "testo", numero, TRUE/FALSE/VERO/FALSO.
+ * Ritorna undefined se non e' un letterale.
+ */
+function batchLiteral_(raw) {
+  if (raw.length >= 2 && raw.charAt(0) === '"' && raw.charAt(raw.length - 1) === '"') {
+    return raw.substring(1, raw.length - 1).replace(/""/g, '"');
+  }
+  if (/^-?\d+(\.\d+)?$/.test(raw)) return parseFloat(raw);
+  if (/^(TRUE|VERO)(\(\))?$/i.test(raw)) return true;
+  if (/^(FALSE|FALSO)(\(\))?$/i.test(raw)) return false;
+  return undefined;
+}
+
+/**
+ * Scompone un riferimento ("C12") in {row: 12, col: 3}.
+ */
+function parseCellRef_(ref) {
+  var m = ref.match(/^([A-Z]+)([0-9]+)$/);
+  return { row: parseInt(m[2], 10), col: letterToColumn_(m[1]) };
+}
+
+
 // =========================================================================
 // Helpers per CLOUD_CALC_BATCH
 // =========================================================================
 
+/**
+ * Identificativo del foglio ("<id spreadsheet>!<id foglio>", di default il
+ * foglio attivo): il server tiene separati batch e cache di fogli diversi.
+ */
+function batchSheetId_(sheet) {
+  try {
+    var ss = SpreadsheetApp.getActiveSpreadsheet();
+    return ss.getId() + '!' + (sheet || ss.getActiveSheet()).getSheetId();
+  } catch (e) {
+    return '';
+  }
+}
+
 /**
  * Legge la formula della cella (row, col) ed estrae i riferimenti celle
  * passati come argomenti a CLOUD_CALC_BATCH (esclude operation, ROW, COLUMN).
@@ -477,39 +1001,9 @@ function extractRefs_(row, col) {
     var formula = sheet.getRange(row, col).getFormula();
     if (!formula) return [];
 
-    // Estrai il contenuto fra le parentesi piu' esterne della funzione
-    var depth = 0;
-    var start = -1;
-    var end = -1;
-    for (var i = 0; i < formula.length; i++) {
-      if (formula[i] === '(') {
-        if (depth === 0) start = i + 1;
-        depth++;
-      } else if (formula[i] === ')') {
-        depth--;
-        if (depth === 0) { end = i; break; }
-      }
-    }
-    if (start === -1 || end === -1) return [];
-    var inner = formula.substring(start, end);
-
-    // Splitta rispettando parentesi e stringhe (gestisce sia ; che ,)
-    var rawArgs = splitFormulaArgs_(inner);
-
-    // Rimuovi primo arg (operation).
-    // Se la formula e' una chiamata diretta a CLOUD_CALC_BATCH, gli ultimi
-    // 2 args sono ROW()/COLUMN() e vanno rimossi.
-    // Se e' una Named Function (es: CLOUD2), ROW/COLUMN non ci sono.
-    var rowColPattern = /^(ROW|COLUMN|RIF\.RIGA|RIF\.COLONNA)\(\)$/i;
-    var tailCount = 0;
-    if (rawArgs.length >= 2
-        && rowColPattern.test(rawArgs[rawArgs.length - 1].trim())
-        && rowColPattern.test(rawArgs[rawArgs.length - 2].trim())) {
-      tailCount = 2;
-    }
-
-    if (rawArgs.length < 1 + tailCount + 1) return [];
-    var cellArgs = rawArgs.slice(1, rawArgs.length - tailCount);
+    var call = batchFormulaArgs_(formula);
+    if (!call || call.args.length < 2) return [];
+    var cellArgs = call.args.slice(1);
 
     // Filtra: tieni solo quelli che sembrano riferimenti cella
     var cellRefPattern = /^\$?[A-Z]{1,3}\$?[0-9]+(?::\$?[A-Z]{1,3}\$?[0-9]+)?$/i;
@@ -533,6 +1027,48 @@ function extractRefs_(row, col) {
 }
 
 
+/**
+ * Argomenti (testo) della funzione piu' esterna di una formula, senza gli
+ * ultimi ROW()/COLUMN() di una chiamata diretta a CLOUD_CALC_BATCH (una
+ * Named Function come CLOUD non li ha). Il primo e' l'operazione.
+ *
+ * Ritorna { args: [...], rest: testo dopo la parentesi di chiusura }
+ * oppure null se la formula non contiene una chiamata.
+ */
+function batchFormulaArgs_(formula) {
+  // Estrai il contenuto fra le parentesi piu' esterne della funzione
+  var depth = 0;
+  var start = -1;
+  var end = -1;
+  var inStr = false;
+  for (var i = 0; i < formula.length; i++) {
+    if (formula[i] === '"') {
+      inStr = !inStr;
+    } else if (inStr) {
+      continue;
+    } else if (formula[i] === '(') {
+      if (depth === 0) start = i + 1;
+      depth++;
+    } else if (formula[i] === ')') {
+      depth--;
+      if (depth === 0) { end = i; break; }
+    }
+  }
+  if (start === -1 || end === -1) return null;
+
+  // Splitta rispettando parentesi e stringhe (gestisce sia ; che ,)
+  var rawArgs = splitFormulaArgs_(formula.substring(start, end));
+
+  var rowColPattern = /^(ROW|COLUMN|RIF\.RIGA|RIF\.COLONNA)\(\)$/i;
+  if (rawArgs.length >= 2
+      && rowColPattern.test(rawArgs[rawArgs.length - 1].trim())
+      && rowColPattern.test(rawArgs[rawArgs.length - 2].trim())) {
+    rawArgs = rawArgs.slice(0, rawArgs.length - 2);
+  }
+  return { args: rawArgs, rest: formula.substring(end + 1) };
+}
+
+
 /**
  * Splitta una stringa di argomenti rispettando parentesi, stringhe e
  * il separatore ; (locale IT) o , (locale EN).
@@ -570,6 +1106,18 @@ function splitFormulaArgs_(inner) {
 }
 
 
+/**
+ * Converte una lettera di colonna in numero (A -> 1, AA -> 27, ecc.)
+ */
+function letterToColumn_(letter) {
+  var col = 0;
+  for (var i = 0; i < letter.length; i++) {
+    col = col * 26 + (letter.toUpperCase().charCodeAt(i) - 64);
+  }
+  return col;
+}
+
+
 /**
  * Converte un numero di colonna in lettera (1 -> A, 27 -> AA, ecc.)
  */
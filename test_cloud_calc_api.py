@@ -0,0 +1,185 @@
+"""
+Test di parita' di /calc con i calcoli originali
+================================================
+Indici delle ricerche, criteri compilati di SUMIFS & co. e modalita'
+colonnare devono dare gli stessi risultati (valore e tipo) della ricerca
+lineare, di match_criteria riga per riga e di OPERATIONS riga per riga,
+su dati casuali con seme fisso.
+
+    python -m pytest -q test_cloud_calc_api.py
+"""
+
+import inspect
+import math
+import random
+
+import pytest
+
+import cloud_calc_api as api
+
+
+@pytest.fixture(autouse=True)
+def empty_range_registry(monkeypatch):
+    monkeypatch.setattr(api, 'range_registry', api.RangeRegistry())
+
+
+# ---------------------------------------------------------------------------
+# MATCH / VLOOKUP / XLOOKUP
+# ---------------------------------------------------------------------------
+
+LOOKUP_POOL = [0, 1, 2, 3, 7, 1.0, 2.5, -4, 'a', 'B', 'b', 'ab', 'Cd', 'zz', True, False, None]
+
+
+def linear_position(values, value, mode, last):
+    """lookup_position con una scansione lineare del range."""
+    key = api.lookup_key(value)
+    if key is None:
+        return None
+    keys = [api.lookup_key(v) for v in values]
+    order = range(len(keys) - 1, -1, -1) if last else range(len(keys))
+    for i in order:
+        if keys[i] == key and type(keys[i]) is type(key):
+            return i
+    if mode == 'exact' or type(key) is tuple:
+        return None
+    same_kind = [k for k in keys if type(k) is type(key)]
+    if mode == 'le':
+        candidates = [k for k in same_kind if k < key]
+        found = max(candidates) if candidates else None
+    else:
+        candidates = [k for k in same_kind if k > key]
+        found = min(candidates) if candidates else None
+    if found is None:
+        return None
+    for i in order:
+        if keys[i] == found and type(keys[i]) is type(found):
+            return i
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_lookup_position_matches_linear_scan(seed):
+    rng = random.Random(seed)
+    values = [rng.choice(LOOKUP_POOL) for _ in range(rng.randint(0, 40))]
+    column = api.CriteriaColumn(values)
+    for value in LOOKUP_POOL + [5, 1.5, 'c', 'zzz', -10]:
+        for mode in ('exact', 'le', 'ge'):
+            for last in (False, True):
+                assert (api.lookup_position(column, value, mode, last)
+                        == linear_position(values, value, mode, last)), (values, value, mode, last)
+
+
+def test_inline_lookup_ignores_replaced_registry_entry():
+    keys = list(range(api.LOOKUP_AUTO_REGISTER_CELLS))
+    payload = {'lookup_range': keys, 'lookup_value': 10, 'match_type': 0}
+    assert api.calc_lookup('match', payload) == 11
+    # Un client registra altri valori con l'id (impronta) del range inline
+    etag = api.range_etag(keys)
+    api.range_registry.put(etag, list(reversed(keys)))
+    assert api.calc_lookup('match', payload) == 11
+    assert api.range_registry.get(etag)['etag'] == etag
+
+
+# ---------------------------------------------------------------------------
+# Modalita' colonnare
+# ---------------------------------------------------------------------------
+
+BIG = 2 ** 53
+NUMBER_POOL = [0, 1, -3, 7, 2.5, -0.75, 1e-3, 3.0, BIG - 1, BIG, BIG + 1, -(BIG + 3), 2 ** 70, None]
+MIXED_POOL = NUMBER_POOL + ['#N/A', '#DIV/0!', 'x', True]
+
+
+def operation_arity(operation):
+    params = inspect.signature(api.OPERATIONS[operation]).parameters.values()
+    fixed = [p for p in params if p.kind is p.POSITIONAL_OR_KEYWORD]
+    return len(fixed) or 3
+
+
+def scalar_row(operation, row):
+    """Risultato atteso di una riga: OPERATIONS con le regole delle colonne."""
+    if all(v is None for v in row):
+        return None
+    if operation not in ('if', 'iferror'):
+        for v in row:
+            if type(v) is str and v.startswith(api.SHEET_ERRORS):
+                return v
+    if all(v is None or type(v) in (int, float) for v in row):
+        return api._apply_row(api.OPERATIONS[operation], [0 if v is None else v for v in row])
+    if operation in api.NUMERIC_COLUMN_OPERATIONS and any(type(v) is str for v in row):
+        return '#VALUE!'
+    return api._apply_row(api.OPERATIONS[operation], row)
+
+
+def same_result(got, expected):
+    if type(got) is not type(expected):
+        return False
+    if type(got) is float and math.isfinite(expected):
+        return math.isclose(got, expected, rel_tol=1e-12, abs_tol=1e-12)
+    return got == expected
+
+
+@pytest.mark.parametrize('pool', [NUMBER_POOL, MIXED_POOL], ids=['numeri', 'misti'])
+@pytest.mark.parametrize('operation', sorted(api.COLUMN_OPERATIONS))
+def test_calc_columns_matches_operations(operation, pool):
+    rng = random.Random(operation)
+    width = operation_arity(operation)
+    columns = [[rng.choice(pool) for _ in range(300)] for _ in range(width)]
+    if operation == 'power':
+        columns[1] = [rng.choice([0, 1, 2, 3, -1, 0.5, None]) for _ in range(300)]
+    got = api.calc_columns(operation, columns)
+    for row, value in zip(zip(*columns), got):
+        expected = scalar_row(operation, row)
+        assert same_result(value, expected), (operation, row, value, expected)
+
+
+# ---------------------------------------------------------------------------
+# SUMIFS & co. con criteri compilati
+# ---------------------------------------------------------------------------
+
+CRITERIA_VALUES = [0, 1, 3, -2, 2.5, 5, 1e20, True, False, None, 'abc', 'ABC', ' abc ', 'abd',
+                   'b', 'a*c', 'x1', 'inf', 'nan', '', 'TRUE']
+RAW_CRITERIA = ['>3', '>=2.5', '<0', '<=1', '>abc', '<>abc', '<>', '<>5', 'a*', '?b*', '*',
+                'abc', ' ABC ', '5', '2.5', 'TRUE', 'false', None, 'x?', '>=1e20', 'inf']
+
+
+def reference_sumifs(sum_range, criteria_pairs):
+    """Il ciclo di calc_sumifs prima dei criteri compilati."""
+    total = 0
+    for i in range(len(sum_range)):
+        if all(i < len(pair['range']) and api.match_criteria(pair['range'][i], pair['criteria'])
+               for pair in criteria_pairs):
+            if sum_range[i] is not None:
+                try:
+                    total += float(sum_range[i])
+                except (ValueError, TypeError):
+                    pass
+    return total
+
+
+@pytest.mark.parametrize('raw', RAW_CRITERIA)
+def test_compiled_criteria_match_criteria(raw):
+    criteria = api.parse_value(raw)
+    compiled = api.compile_criteria(criteria)
+    expected = [api.match_criteria(value, criteria) for value in CRITERIA_VALUES]
+    assert [compiled.test(value) for value in CRITERIA_VALUES] == expected
+    assert compiled.mask(api.CriteriaColumn(CRITERIA_VALUES)).tolist() == expected
+
+
+@pytest.mark.parametrize('numpy_available', [True, False], ids=['numpy', 'senza-numpy'])
+@pytest.mark.parametrize('seed', range(15))
+def test_sumifs_matches_original_loop(monkeypatch, seed, numpy_available):
+    monkeypatch.setattr(api, 'NUMPY_AVAILABLE', numpy_available)
+    rng = random.Random(seed)
+    rows = rng.randint(0, 60)
+    sum_range = [rng.choice([1, 2.5, -3, 0.1, 0.7, 1e16, None, 'x', True]) for _ in range(rows)]
+    criteria_pairs = []
+    for _ in range(rng.randint(1, 3)):
+        length = rows if rng.random() < 0.8 else rng.randint(0, rows)
+        criteria_pairs.append({
+            'range': [rng.choice(CRITERIA_VALUES) for _ in range(length)],
+            'criteria': api.parse_value(rng.choice(RAW_CRITERIA)),
+        })
+    expected = reference_sumifs(sum_range, criteria_pairs)
+    resolved = [{'range': api.CriteriaColumn(pair['range']), 'criteria': pair['criteria']}
+                for pair in criteria_pairs]
+    got = api.calc_ifs('sum', api.CriteriaColumn(sum_range), resolved)
+    assert got == expected and type(got) is type(expected)
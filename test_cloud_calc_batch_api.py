@@ -0,0 +1,167 @@
+"""
+Test di parita' di /eval_sheet con il modello formulas completo
+===============================================================
+Le formule calcolate per forma (fuori dal modello) devono dare gli stessi
+risultati del modello con tutte le formule, sia al primo calcolo (modello
+costruito) sia ai successivi (modello in cache).
+
+    python -m pytest -q test_cloud_calc_batch_api.py
+"""
+
+import pytest
+
+import cloud_calc_batch_api as batch_api
+
+
+def plain_results(formulas, values):
+    """Risultati del modello formulas con tutte le formule, senza forme ne' cache."""
+    (formula_cells, value_cells, positions,
+     num_rows, num_cols, _) = batch_api.parse_sheet_payload({'formulas': formulas, 'values': values})
+    solution = batch_api.build_excel_model(formula_cells, value_cells).calculate()
+    return batch_api.dense_results(solution, value_cells, batch_api.cell_index(positions),
+                                   values, num_rows, num_cols)
+
+
+@pytest.fixture(autouse=True)
+def empty_model_cache(monkeypatch):
+    monkeypatch.setattr(batch_api, 'model_cache', batch_api.ModelCache())
+
+
+PARITY_SHEETS = {
+    'celle vuote': (
+        [['', '', '=A1+B1', '=ISBLANK(A1)', '=IF(A1>2,B1,"")']],
+        [['', '', '', '', '']],
+    ),
+    'if con cella vuota': (
+        [['', '', '=IF(A1>2,B1,"")']],
+        [[5, '', '']],
+    ),
+    'oltre il bordo': (
+        [['', '=A1+Z100', '=SUM(A1:C3)']],
+        [[3, '', '']],
+    ),
+    'errori letterali': (
+        [['', '', '=A1*2', '=SUM(A1,2)', '=ISNA(A1)', '=IFERROR(B1*2,-1)']],
+        [['#N/A', '#VALUE!', '', '', '', '']],
+    ),
+    'formule copiate': (
+        [['', '', '=A1+B1'], ['', '', '=A2+B2'], ['', '', '=A3+B3'], ['', '', '=C1+C3']],
+        [[1, '', ''], ['', '', ''], ['#DIV/0!', 2, ''], ['', '', '']],
+    ),
+    'errore calcolato': (
+        [['', '=1/A1', '=B1+1']],
+        [[0, '', '']],
+    ),
+    'testo formula': (
+        [['', '=A1*2']],
+        [['=1+1', '']],
+    ),
+}
+
+
+@pytest.mark.parametrize('name', sorted(PARITY_SHEETS))
+def test_eval_sheet_matches_plain_model(name):
+    formulas, values = PARITY_SHEETS[name]
+    expected = plain_results(formulas, values)
+
+    miss, status = batch_api.evaluate_sheet({'formulas': formulas, 'values': values})
+    assert status == 200
+    assert miss['stats']['model_cache']['hit'] is False
+    assert miss['results'] == expected
+
+    hit, status = batch_api.evaluate_sheet({'formulas': formulas, 'values': values})
+    assert status == 200
+    assert hit['stats']['model_cache']['hit'] is True
+    assert hit['results'] == expected
+
+
+# Formule che restano al modello (ROW() dipende dalla cella): in cache i
+# valori vengono riassegnati con calculate(inputs=...)
+MODEL_FORMULAS = [['', '', '=A1*ROW()', '=SUM(A1,2)+ROW()', '=ISBLANK(B1)+ROW()', '=B1+ROW()']]
+
+
+@pytest.mark.parametrize('values', [
+    [['#N/A', '', '', '', '', '']],
+    [['#DIV/0!', 3, '', '', '', '']],
+    [[2, '', '', '', '', '']],
+], ids=['na', 'div0', 'vuota'])
+def test_cache_hit_matches_miss(values):
+    # Primo calcolo con altri valori nelle stesse posizioni: il modello in cache
+    # e' lo stesso, i valori del caso vengono riassegnati
+    warm = [[1 if v != '' else '' for v in row] for row in values]
+    _, status = batch_api.evaluate_sheet({'formulas': MODEL_FORMULAS, 'values': warm})
+    assert status == 200
+    hit, status = batch_api.evaluate_sheet({'formulas': MODEL_FORMULAS, 'values': values})
+    assert status == 200
+    assert hit['stats']['model_cache']['hit'] is True
+
+    batch_api.model_cache = batch_api.ModelCache()
+    miss, status = batch_api.evaluate_sheet({'formulas': MODEL_FORMULAS, 'values': values})
+    assert status == 200
+    assert miss['stats']['model_cache']['hit'] is False
+    assert hit['results'] == miss['results'] == plain_results(MODEL_FORMULAS, values)
+
+
+def test_delta_error_literal():
+    values = [[1, 3, '', '', '', '']]
+    full, _ = batch_api.evaluate_sheet({'formulas': MODEL_FORMULAS, 'values': values})
+    delta, status = batch_api.evaluate_sheet_delta({
+        'model_id': full['model_id'], 'version': full['version'],
+        'changes': [{'cell': 'A1', 'value': '#N/A'}],
+    })
+    assert status == 200
+    changes = {c['cell']: c['value'] for c in delta['changes']}
+    assert changes == {'A1': '#N/A', 'C1': '#N/A', 'D1': '#N/A'}
+
+
+def test_delta_formula_text_requires_full_eval():
+    values = [[1, 3, '', '', '', '']]
+    full, _ = batch_api.evaluate_sheet({'formulas': MODEL_FORMULAS, 'values': values})
+    _, status = batch_api.evaluate_sheet_delta({
+        'model_id': full['model_id'], 'version': full['version'],
+        'changes': [{'cell': 'A1', 'value': '=1+1'}],
+    })
+    assert status == 409
+
+
+def test_convert_block_keeps_wide_integers():
+    values = [2 ** 70, -2 ** 70, batch_api.np.uint64(2 ** 64 - 1), batch_api.np.int64(-3), 2.0, True]
+    converted = batch_api.convert_formulas_block(values)
+    assert converted == [2 ** 70, -2 ** 70, 2 ** 64 - 1, -3, 2, True]
+    assert [type(v) for v in converted] == [int, int, int, int, int, bool]
+
+
+def test_eval_sheet_value_above_int64():
+    formulas = [['', '=A1', '']]
+    values = [[2 ** 70, '', 2 ** 64 + 5]]
+    found, status = batch_api.evaluate_sheet({'formulas': formulas, 'values': values})
+    assert status == 200
+    assert found['results'] == plain_results(formulas, values)
+
+
+@pytest.mark.parametrize('backend', ['orjson', 'json'])
+def test_json_dumps_wide_integers(monkeypatch, backend):
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    monkeypatch.setattr(batch_api, 'JSON_BACKEND', backend)
+    np = batch_api.np
+    payload = {'results': [[2 ** 70, np.float64(1.5), np.int64(-3)]], 'column': np.arange(2)}
+    expected = {'results': [[2 ** 70, 1.5, -3]], 'column': [0, 1]}
+    assert batch_api.json.loads(batch_api.json_dumps(payload)) == expected
+    with batch_api.app.app_context():
+        response = batch_api.jsonify(payload)
+    assert batch_api.json.loads(response.get_data()) == expected
+
+
+def test_split_keeps_formula_text_with_its_inputs():
+    # D3 e' un valore "=A1*3": il modello lo compila come formula che legge A1
+    formulas = [['', '=A1*2', '=B1+1', ''], ['', '', '', ''], ['', '=A3+1', '', '']]
+    values = [[1, '', '', ''], ['', '', '', ''], [5, '', '', '=A1*3']]
+    (formula_cells, value_cells, positions,
+     num_rows, num_cols, _) = batch_api.parse_sheet_payload({'formulas': formulas, 'values': values})
+    plan = batch_api.plan_sheet_split(formula_cells, value_cells, positions, num_rows, num_cols, 2)
+    assert plan['components'] == 2
+    part_of = {ref: i for i, part in enumerate(plan['parts']) for ref in part}
+    prefix = batch_api.MODEL_CELL_PREFIX
+    assert part_of[prefix + 'D3'] == part_of[prefix + 'A1'] == part_of[prefix + 'B1']
+    assert part_of[prefix + 'A3'] == part_of[prefix + 'B3'] != part_of[prefix + 'A1']
@@ -0,0 +1,80 @@
+"""
+Test del grafo di dipendenze di /batch_calc
+===========================================
+Il grafo del foglio resta fra un batch e l'altro: una cella che smette di
+essere CLOUD_CALC o un batch con un ciclo non devono bloccare i batch
+successivi.
+
+    python -m pytest -q test_cloud_calc_dependencies_api.py
+"""
+
+import pytest
+
+import cloud_calc_dependencies_api as deps_api
+
+
+def arg(ref, value):
+    return {'ref': ref, 'value': value}
+
+
+@pytest.fixture
+def manager():
+    manager = deps_api.BatchManager()
+    yield manager
+    manager.close()
+
+
+def results(found):
+    return {cell: r.get('result', r.get('error')) for cell, r in found.items()}
+
+
+def test_formula_replaced_then_reverse_dependency(manager):
+    # A1 legge B1; poi A1 diventa un valore e B1 una formula che legge A1
+    assert results(manager.submit_bulk([('A1', 'plus', [arg('B1', 1)])], 's')) == {'A1': 1}
+    found = manager.submit_bulk([('B1', 'plus', [arg('A1', 1), arg('', 1)])], 's')
+    assert results(found) == {'B1': 2}
+    found = manager.submit_bulk([('C1', 'multiply', [arg('B1', 2), arg('', 3)])], 's')
+    assert results(found) == {'C1': 6}
+
+
+def test_formula_replaced_by_literal(manager):
+    manager.submit_bulk([('B1', 'plus', [arg('A1', 5)]),
+                         ('C1', 'multiply', [arg('B1', 5), arg('', 2)])], 's')
+    found = manager.submit_bulk([('C1', 'multiply', [arg('B1', 100), arg('', 2)]),
+                                 ('D1', 'plus', [arg('B1', 100)])], 's')
+    assert results(found) == {'C1': 200, 'D1': 100}
+
+
+def test_upstream_recomputed_in_same_batch(manager):
+    manager.submit_bulk([('B1', 'plus', [arg('A1', 5)]),
+                         ('C1', 'multiply', [arg('B1', 5), arg('', 2)])], 's')
+    # C1 arriva con il vecchio valore di B1, ricalcolato nello stesso batch
+    found = manager.submit_bulk([('B1', 'plus', [arg('A1', 6)]),
+                                 ('C1', 'multiply', [arg('B1', 5), arg('', 2)])], 's')
+    assert results(found) == {'B1': 6, 'C1': 12}
+    # A1 cambia: C1 (batch precedente) viene ricalcolato dal server
+    manager.submit_bulk([('B1', 'plus', [arg('A1', 7)])], 's')
+    assert manager._sheets['s']['graph']['C1']['value'] == 14
+
+
+def test_cycle_does_not_poison_sheet(manager):
+    found = manager.submit_bulk([('A1', 'plus', [arg('B1', 1)]),
+                                 ('B1', 'plus', [arg('A1', 1)])], 's')
+    assert all('circolare' in r['error'] for r in found.values())
+    assert manager._sheets['s']['graph'] == {}
+    # Formule corrette: il batch successivo si risolve
+    found = manager.submit_bulk([('A1', 'plus', [arg('B1', 1)]),
+                                 ('B1', 'plus', [arg('', 4)])], 's')
+    assert results(found) == {'A1': 4, 'B1': 4}
+
+
+def test_cycle_restores_previous_definitions(manager):
+    manager.submit_bulk([('A1', 'plus', [arg('Z1', 1)]),
+                         ('B1', 'multiply', [arg('A1', 1), arg('', 10)])], 's')
+    found = manager.submit_bulk([('A1', 'plus', [arg('B1', 10)]),
+                                 ('B1', 'multiply', [arg('A1', 1), arg('', 10)])], 's')
+    assert all('circolare' in r['error'] for r in found.values())
+    # La definizione precedente di A1 (legge Z1) e' ancora nel grafo
+    manager.submit_bulk([('Y1', 'plus', [arg('Z1', 2)])], 's')
+    graph = manager._sheets['s']['graph']
+    assert (graph['A1']['value'], graph['B1']['value']) == (2, 20)
@@ -0,0 +1,48 @@
+"""
+Test di parita' di parse_values con parse_value
+===============================================
+parse_values su una lista intera deve dare, elemento per elemento, lo
+stesso valore e lo stesso tipo di parse_value, su colonne casuali con seme
+fisso (stringhe numeriche, testo, booleani, null e valori gia' convertiti).
+
+    python -m pytest -q test_cloud_calc_values.py
+"""
+
+import random
+
+import pytest
+
+from cloud_calc_values import parse_value, parse_values
+
+
+NUMERIC_STRINGS = ['0', '7', '-3', '+4', ' 12 ', '\t5\n', '1_000', '2.5', '-0.75', '.5', '3.',
+                   ' 1.25 ', '1_0.5', '9' * 30, '1e3', '1.5e-3', 'nan', 'inf', '-inf', '1.2.3', '0x10']
+OTHER_VALUES = ['', ' ', 'TRUE', 'false', ' True ', 'abc', ' A ', '#N/A', '5a', '=A1+1', '_1',
+                None, 0, 1, -2, 2 ** 70, 2.5, float('nan'), True, False]
+
+
+def same_items(got, expected):
+    """Stesso valore e stesso tipo elemento per elemento (nan compreso)."""
+    return [(type(v), repr(v)) for v in got] == [(type(v), repr(v)) for v in expected]
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_parse_values_mixed(seed):
+    rng = random.Random(seed)
+    values = [rng.choice(NUMERIC_STRINGS + OTHER_VALUES) for _ in range(rng.randint(0, 50))]
+    assert same_items(parse_values(values), [parse_value(v) for v in values]), values
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_parse_values_numeric_strings(seed):
+    rng = random.Random(seed)
+    pool = rng.choice([NUMERIC_STRINGS, [s for s in NUMERIC_STRINGS if '.' in s],
+                       [s for s in NUMERIC_STRINGS if '.' not in s]])
+    values = [rng.choice(pool) for _ in range(rng.randint(1, 50))]
+    assert same_items(parse_values(values), [parse_value(v) for v in values]), values
+
+
+def test_parse_values_tuple_and_plain():
+    values = (1, 2.5, None, True)
+    assert same_items(parse_values(values), list(values))
+    assert parse_values([]) == []